@@ -1,82 +1,696 @@
 import re
+import os
+import sys
+import ast
+import time
 import asyncio
 import argparse  # For command-line argument parsing
+import orjson
+from collections import namedtuple
+import cachetools
 from ElementalDB import ElementalDB
+from btree import sort_key
+from durability import write_file
+
+# Consecutive adds/updates/deletes on one table are merged into bulk operations of at most this many statements.
+BULK_SIZE = 10000
+# Statement shapes kept parsed; see EDLangCompiler.parse.
+PREPARED_CACHE_SIZE = 1024
+# Defaults of EDLangCompiler.run: statements between checkpoints and seconds between progress reports.
+CHECKPOINT_EVERY = 10000
+PROGRESS_EVERY = 5.0
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<number>[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op><=|>=|!=|[\[\]{}(),:=<>*])
+    )""", re.VERBOSE)
+
+KEYWORD_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+# Statements of the language, as produced by the parser.
+CreateTable = namedtuple("CreateTable", "table columns")
+Add = namedtuple("Add", "table values")
+Update = namedtuple("Update", "table old new")
+Delete = namedtuple("Delete", "table values")
+Select = namedtuple("Select", "table values")
+# ``where`` is a list of ``[column, operator, value]`` conditions, all of which must hold (see query.Predicate).
+SelectWhere = namedtuple("SelectWhere", "table columns where order_by descending limit offset")
+UpdateWhere = namedtuple("UpdateWhere", "table changes where")
+DeleteWhere = namedtuple("DeleteWhere", "table where")
+
+COMPARISONS = {"=": "eq", "!=": "ne", "<": "lt", "<=": "lte", ">": "gt", ">=": "gte"}
+
+# A run of consecutive statements of one kind on one table, executed as one bulk operation.
+Bulk = namedtuple("Bulk", "kind table statements")
+
+# Where a statement ends in the script: its line number and the byte offset just past it.
+Position = namedtuple("Position", "line offset")
+
+
+class EDLangSyntaxError(ValueError):
+    def __init__(self, message, line_number=None):
+        if line_number is not None:
+            message = f"line {line_number}: {message}"
+        super().__init__(message)
+        self.line_number = line_number
+
+
+class Param:
+    """Stands for the ``index``-th literal of a statement in a prepared (cached) parse."""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+
+class DictTemplate:
+    """A ``{key: value}`` literal of a prepared statement, as ``(key, value)`` template pairs."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+
+def tokenize(command):
+    """
+    Splits a statement into ``(kind, text)`` tokens and the values of its literals.
+
+    Literals become ``("literal", None)`` tokens, so statements differing only
+    in their values produce the same token list. Strings are decoded with
+    ``ast.literal_eval``, which accepts nothing but a literal.
+    """
+    tokens = []
+    literals = []
+    position = 0
+    command = command.rstrip()
+    while position < len(command):
+        match = TOKEN.match(command, position)
+        if match is None or match.end() == position:
+            raise EDLangSyntaxError(f"unexpected character {command[position:].lstrip()[:1]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "string":
+            literals.append(ast.literal_eval(text))
+        elif kind == "number":
+            literals.append(float(text) if any(c in text for c in ".eE") else int(text))
+        elif kind == "name" and text in KEYWORD_LITERALS:
+            literals.append(KEYWORD_LITERALS[text])
+        else:
+            tokens.append((kind, text))
+            continue
+        tokens.append(("literal", None))
+    return tokens, literals
+
+
+class Parser:
+    """Recursive-descent parser from a token list to one statement whose literals are ``Param`` placeholders."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.literals = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise EDLangSyntaxError("unexpected end of statement")
+        self.position += 1
+        return token
+
+    def accept(self, text):
+        if self.peek()[1] == text:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, text):
+        kind, found = self.next()
+        if found != text:
+            raise EDLangSyntaxError(f"expected {text!r}, found {found if found is not None else 'a literal'!r}")
+
+    def name(self):
+        kind, text = self.next()
+        if kind != "name":
+            raise EDLangSyntaxError(f"expected a name, found {text if text is not None else 'a literal'!r}")
+        return text
+
+    def value(self):
+        kind, text = self.peek()
+        if kind == "literal":
+            self.position += 1
+            self.literals += 1
+            return Param(self.literals - 1)
+        if text == "[":
+            return self.list()
+        if text == "{":
+            return self.dict()
+        raise EDLangSyntaxError(f"expected a value, found {text!r}" if text else "expected a value")
+
+    def list(self):
+        self.expect("[")
+        items = []
+        if not self.accept("]"):
+            items.append(self.value())
+            while self.accept(","):
+                items.append(self.value())
+            self.expect("]")
+        return items
+
+    def dict(self):
+        self.expect("{")
+        items = []
+        if not self.accept("}"):
+            while True:
+                key = self.value()
+                self.expect(":")
+                items.append((key, self.value()))
+                if not self.accept(","):
+                    break
+            self.expect("}")
+        return DictTemplate(items)
+
+    def ahead(self, distance):
+        if self.position + distance < len(self.tokens):
+            return self.tokens[self.position + distance]
+        return (None, None)
+
+    def where(self):
+        """Parses an optional ``where a = 1 and b in [2, 3] and c like "x%"`` clause."""
+        conditions = []
+        if not self.accept("where"):
+            return conditions
+        while True:
+            column = self.name()
+            kind, text = self.next()
+            if text in COMPARISONS:
+                conditions.append([column, COMPARISONS[text], self.value()])
+            elif text == "in":
+                conditions.append([column, "in", self.list()])
+            elif text == "like":
+                conditions.append([column, "like", self.value()])
+            else:
+                raise EDLangSyntaxError(f"expected a comparison after {column!r}, found {text if text is not None else 'a literal'!r}")
+            if self.accept("or"):
+                raise EDLangSyntaxError("'or' is not supported; conditions can only be combined with 'and'")
+            if not self.accept("and"):
+                return conditions
+
+    def select(self):
+        """``select <* | columns> from <table> [where ...] [order by <column> [asc|desc]] [limit n [offset m]]``"""
+        columns = None
+        if not self.accept("*"):
+            columns = [self.name()]
+            while self.accept(","):
+                columns.append(self.name())
+        self.expect("from")
+        table = self.name()
+        where = self.where()
+
+        order_by = None
+        descending = False
+        if self.accept("order"):
+            self.expect("by")
+            order_by = self.name()
+            if self.accept("desc"):
+                descending = True
+            else:
+                self.accept("asc")
+
+        limit = offset = None
+        if self.accept("limit"):
+            limit = self.value()
+            if self.accept("offset"):
+                offset = self.value()
+        return SelectWhere(table, columns, where, order_by, descending, limit, offset)
+
+    def statement(self):
+        keyword = self.name()
+        if keyword == "create":
+            self.expect("table")
+            table = self.name()
+            self.expect("schema")
+            self.expect("[")
+            columns = [self.name()]
+            while self.accept(","):
+                columns.append(self.name())
+            self.expect("]")
+            node = CreateTable(table, columns)
+        elif keyword == "add":
+            node = Add(self.name(), self.list())
+        elif keyword == "update":
+            table = self.name()
+            if self.accept("set"):
+                changes = []
+                while True:
+                    column = self.name()
+                    self.expect("=")
+                    changes.append((column, self.value()))
+                    if not self.accept(","):
+                        break
+                node = UpdateWhere(table, DictTemplate(changes), self.where())
+            else:
+                node = Update(table, self.list(), self.list())
+        elif keyword == "delete":
+            # ``delete <table> [values]`` or ``delete from <table> where ...``
+            if self.peek()[1] == "from" and self.ahead(1)[0] == "name":
+                self.expect("from")
+                node = DeleteWhere(self.name(), self.where())
+            else:
+                node = Delete(self.name(), self.list())
+        elif keyword == "select":
+            # ``select <table> [values]`` or ``select <columns> from <table> ...``
+            if self.peek()[0] == "name" and self.ahead(1)[1] == "[":
+                node = Select(self.name(), self.list())
+            else:
+                node = self.select()
+        else:
+            raise EDLangSyntaxError(f"unknown statement {keyword!r}")
+
+        if self.peek()[0] is not None:
+            raise EDLangSyntaxError(f"unexpected {self.peek()[1] or 'literal'!r} after the statement")
+        return node
+
+
+def bind(value, literals):
+    """Replaces the ``Param`` placeholders of a prepared statement with a line's literal values."""
+    if isinstance(value, Param):
+        return literals[value.index]
+    if isinstance(value, list):
+        return [bind(item, literals) for item in value]
+    if isinstance(value, DictTemplate):
+        return {bind(key, literals): bind(item, literals) for key, item in value.items}
+    return value
+
+
+def count_of(step):
+    return len(step.statements) if isinstance(step, Bulk) else 1
+
+
+def row_key(values):
+    return tuple(sort_key(value) for value in values)
+
 
 class EDLangCompiler:
-    def __init__(self):
-        self.db = ElementalDB()
+    """
+    Runs EDLang scripts against an ``ElementalDB``.
+
+    Besides the value-list forms (``add t [...]``, ``update t [...] [...]``,
+    ``delete t [...]``, ``select t [...]``), scripts can query and change
+    records by condition::
+
+        select name, age from users where age >= 18 and city in ["Oslo", "Rome"] order by age desc limit 10
+        update users set city = "Paris" where name like "Al%"
+        delete from users where age < 18
+
+    These run as ``ElementalDB.query`` reads, so they use the table's
+    indexes and zone maps rather than scanning every row.
+
+    Each line is tokenized and parsed into a statement; parses are cached by
+    the statement's shape (its tokens with literals left out), so the many
+    ``add`` lines of a load script are parsed once and only have their
+    literals bound. ``plan`` then merges runs of adds, updates or deletes on
+    one table into bulk operations: a run of adds is one ``add_many`` and a run
+    of updates or deletes is one pass over the table and one ``batch``.
+    """
+
+    def __init__(self, db=None):
+        self.db = db if db is not None else ElementalDB()
+        self.prepared = cachetools.LRUCache(maxsize=PREPARED_CACHE_SIZE)
+
+    def parse(self, command, line_number=None):
+        """Returns the statement on one line, or ``None`` for a blank line or ``#`` comment."""
+        command = command.strip()
+        if not command or command.startswith("#"):
+            return None
+        try:
+            tokens, literals = tokenize(command)
+            shape = tuple(tokens)
+            template = self.prepared.get(shape)
+            if template is None:
+                template = self.prepared[shape] = Parser(tokens).statement()
+            return template._make(bind(field, literals) for field in template)
+        except EDLangSyntaxError as e:
+            raise EDLangSyntaxError(str(e), line_number) from None
+        except (ValueError, SyntaxError) as e:
+            raise EDLangSyntaxError(f"invalid literal: {e}", line_number) from None
+
+    def plan(self, statements):
+        """
+        Groups consecutive adds, updates or deletes on the same table into ``Bulk`` steps.
+
+        Takes and yields ``(position, item)`` pairs; a step's position is that
+        of its last statement. A syntax error (passed in as the exception) ends
+        the current run, so everything before it still runs.
+        """
+        run = []
+        last = None
+        for position, statement in statements:
+            if statement is None:
+                continue
+            if run and (type(statement) is not type(run[0]) or statement.table != run[0].table or len(run) >= BULK_SIZE):
+                yield last, self.step(run)
+                run = []
+            if isinstance(statement, (Add, Update, Delete)):
+                run.append(statement)
+                last = position
+            else:
+                yield position, statement
+        if run:
+            yield last, self.step(run)
+
+    @staticmethod
+    def step(run):
+        if len(run) == 1:
+            return run[0]
+        return Bulk(type(run[0]), run[0].table, run)
 
     async def compile(self, script_path):
-        with open(script_path, "r") as file:
-            commands = file.readlines()
-            for command in commands:
-                await self.parse_command(command.strip())
+        return await self.run(script_path)
+
+    def read(self, file, start=Position(0, 0)):
+        """
+        Yields ``(position, statement)`` for each line of a binary ``file``, from ``start`` on.
+
+        Lines are read one at a time, so memory does not grow with the script.
+        A line that does not parse yields its ``EDLangSyntaxError`` instead,
+        positioned just before the line so a resumed run reads it again.
+        """
+        line_number, offset = start
+        if offset:
+            if file.seekable():
+                file.seek(offset)
+            else:
+                # A pipe cannot seek: skip the lines already run.
+                for _ in range(line_number):
+                    file.readline()
+        for raw in file:
+            try:
+                statement = self.parse(raw.decode("utf-8"), line_number + 1)
+            except UnicodeDecodeError as e:
+                statement = EDLangSyntaxError(f"not UTF-8: {e}", line_number + 1)
+            except EDLangSyntaxError as e:
+                statement = e
+            if isinstance(statement, EDLangSyntaxError):
+                yield Position(line_number, offset), statement
+            line_number += 1
+            offset += len(raw)
+            if not isinstance(statement, EDLangSyntaxError):
+                yield Position(line_number, offset), statement
+
+    async def run(self, script_path, checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY,
+                  progress_every=PROGRESS_EVERY, on_error="stop"):
+        """
+        Streams a script (``"-"`` for stdin) through the planner and runs it.
+
+        With ``checkpoint_path``, the position after the last completed step is
+        saved there at least every ``checkpoint_every`` statements, and a run
+        that finds a checkpoint for the same script resumes after it. The
+        checkpoint is a separate write from the data, so resuming is
+        at-least-once: the statements run since the last checkpoint run again,
+        and adds without an ``id`` among them are added twice. Scripts that must
+        resume exactly give their records ids. A bulk add is one atomic log
+        write, so a crash keeps or loses it whole. The checkpoint is removed
+        once the script completes. Progress and throughput go to stderr every
+        ``progress_every`` seconds (``None`` for no reports).
+
+        On a bad line the statements before it are still run and checkpointed;
+        then ``on_error="stop"`` raises ``EDLangSyntaxError`` while ``"skip"``
+        reports the line and goes on. Returns a summary of the run.
+        """
+        if on_error not in ("stop", "skip"):
+            raise ValueError(f"on_error must be 'stop' or 'skip', not {on_error!r}")
+
+        start = self.load_checkpoint(checkpoint_path, script_path)
+        if start.line:
+            print(f"Resuming {script_path} after line {start.line}", file=sys.stderr)
+
+        stats = {"lines": start.line, "statements": 0, "errors": 0}
+        started = last_report = time.monotonic()
+        total = None if script_path == "-" else os.path.getsize(script_path)
+        since_checkpoint = 0
+        position = start
+
+        file = sys.stdin.buffer if script_path == "-" else open(script_path, "rb")
+        try:
+            for position, step in self.plan(self.read(file, start)):
+                if isinstance(step, EDLangSyntaxError):
+                    self.save_checkpoint(checkpoint_path, script_path, position)
+                    if on_error == "stop":
+                        raise step
+                    stats["errors"] += 1
+                    print(f"Skipped {step}", file=sys.stderr)
+                    continue
+
+                try:
+                    await self.execute(step)
+                except Exception as e:
+                    raise RuntimeError(f"The {count_of(step)} statement(s) ending on line {position.line} failed: {e}") from e
+
+                count = count_of(step)
+                stats["statements"] += count
+                stats["lines"] = position.line
+                since_checkpoint += count
+                if checkpoint_path is not None and since_checkpoint >= checkpoint_every:
+                    self.save_checkpoint(checkpoint_path, script_path, position)
+                    since_checkpoint = 0
+
+                now = time.monotonic()
+                if progress_every is not None and now - last_report >= progress_every:
+                    last_report = now
+                    self.report(stats, start, position, total, now - started)
+        finally:
+            if file is not sys.stdin.buffer:
+                file.close()
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        stats["seconds"] = time.monotonic() - started
+        if progress_every is not None:
+            self.report(stats, start, position, total, stats["seconds"])
+        return stats
+
+    @staticmethod
+    def report(stats, start, position, total, elapsed):
+        elapsed = elapsed or 1e-9
+        done = f" ({100 * position.offset / total:.1f}%)" if total else ""
+        print(f"line {position.line}{done}: {stats['statements']} statements in {elapsed:.1f}s, "
+              f"{stats['statements'] / elapsed:,.0f} statements/s, "
+              f"{(position.offset - start.offset) / elapsed / 1e6:.1f} MB/s read",
+              file=sys.stderr)
+
+    @staticmethod
+    def load_checkpoint(checkpoint_path, script_path):
+        if checkpoint_path is None or not os.path.exists(checkpoint_path):
+            return Position(0, 0)
+        with open(checkpoint_path, "rb") as file:
+            checkpoint = orjson.loads(file.read())
+        if checkpoint.get("script") != os.path.abspath(script_path) and script_path != "-":
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to {checkpoint.get('script')}, not {script_path}")
+        return Position(checkpoint["line"], checkpoint["offset"])
+
+    @staticmethod
+    def save_checkpoint(checkpoint_path, script_path, position):
+        """Records that everything up to ``position`` has run; written atomically and synced."""
+        if checkpoint_path is None:
+            return
+        write_file(checkpoint_path, orjson.dumps({
+            "script": os.path.abspath(script_path) if script_path != "-" else "-",
+            "line": position.line,
+            "offset": position.offset,
+        }))
 
     async def parse_command(self, command):
-        create_pattern = r"create table (\w+) schema \[(.+)\]"
-        add_pattern = r"add (\w+) \[(.+)\]"
-        update_pattern = r"update (\w+) \[(.+)\] \[(.+)\]"
-        delete_pattern = r"delete (\w+) \[(.+)\]"
-        select_pattern = r"select (\w+) \[(.+)\]"
-
-        if match := re.match(create_pattern, command):
-            await self.handle_create(match, create_pattern)
-        elif match := re.match(add_pattern, command):
-            await self.handle_add(match, add_pattern)
-        elif match := re.match(update_pattern, command):
-            await self.handle_update(match, update_pattern)
-        elif match := re.match(delete_pattern, command):
-            await self.handle_delete(match, delete_pattern)
-        elif match := re.match(select_pattern, command):
-            await self.handle_select(match, select_pattern)
-
-    async def handle_create(self, match, create_pattern):
-        table_name = match.group(1)
-        schema = match.group(2).split(", ")
-        schema = [(col, "TEXT") for col in schema]
-        self.db.create_table(table_name, schema)
-        print(f"Table '{table_name}' created with schema {schema}")
-
-    async def handle_add(self, match, add_pattern):
-        table_name = match.group(1)
-        values = eval(match.group(2))
-        await self.db.add(table_name, values)
-        print(f"Record {values} added to table '{table_name}'")
-
-    async def handle_update(self, match, update_pattern):
-        table_name = match.group(1)
-        old_values = eval(match.group(2))
-        new_values = eval(match.group(3))
-        record = await self.db.get(table_name, 'id', old_values[0])  # Assume 'id' is the first element
-        if record:
-            await self.db.update(table_name, record['id'], dict(zip(record.keys(), new_values)))
-            print(f"Record updated from {old_values} to {new_values}")
+        """Parses and runs a single statement."""
+        statement = self.parse(command)
+        if statement is not None:
+            await self.execute(statement)
+
+    async def execute(self, step):
+        if isinstance(step, CreateTable):
+            await self.handle_create(step)
+        elif isinstance(step, Select):
+            await self.handle_select(step)
+        elif isinstance(step, SelectWhere):
+            await self.handle_select_where(step)
+        elif isinstance(step, (UpdateWhere, DeleteWhere)):
+            await self.handle_where(step)
+        elif isinstance(step, Bulk) and step.kind is Add:
+            await self.handle_add_many(step)
+        elif isinstance(step, Add):
+            await self.handle_add(step)
         else:
-            print(f"Record {old_values} not found in table '{table_name}'")
-
-    async def handle_delete(self, match, delete_pattern):
-        table_name = match.group(1)
-        values = eval(match.group(2))
-        await self.db.delete(table_name, values)
-
-    async def handle_select(self, match, select_pattern):
-        table_name = match.group(1)
-        values = eval(match.group(2))
-        record = await self.db.get(table_name, 'id', values[0])  # Assuming the first value is 'id'
-        if record:
+            await self.handle_changes(step.statements if isinstance(step, Bulk) else [step])
+
+    async def handle_create(self, statement):
+        schema = [(col, "TEXT") for col in statement.columns]
+        self.db.create_table(statement.table, schema)
+        print(f"Table '{statement.table}' created with schema {schema}")
+
+    async def handle_add(self, statement):
+        await self.db.add(statement.table, statement.values)
+        print(f"Record {statement.values} added to table '{statement.table}'")
+
+    async def handle_add_many(self, bulk):
+        added = await self.db.add_many(bulk.table, [statement.values for statement in bulk.statements], BULK_SIZE)
+        if added:
+            print(f"{added} records added to table '{bulk.table}'")
+
+    def columns(self, table_name):
+        schema = self.db.schema_for(table_name)
+        if schema is None:
+            print(f"No schema found for table {table_name}")
+            return None
+        return [col[0] for col in schema]
+
+    async def matching(self, table_name, columns, rows):
+        """
+        Yields the records whose values, in schema order, equal one of ``rows``.
+
+        The table is read once; an index on the first column narrows the read.
+        """
+        keys = {row_key(values) for values in rows}
+        filters = {columns[0]: {"in": [values[0] for values in rows]}}
+        async for record in self.db.query(table_name, filters):
+            if row_key(record.get(col) for col in columns) in keys:
+                yield record
+
+    async def handle_changes(self, statements):
+        """Applies a run of updates and deletes on one table with one read of the table and one batch."""
+        table_name = statements[0].table
+        columns = self.columns(table_name)
+        if columns is None:
+            return
+
+        rows = []
+        for statement in statements:
+            values = statement.old if isinstance(statement, Update) else statement.values
+            if len(values) != len(columns):
+                print("Data list does not match schema length.")
+                continue
+            rows.append(values)
+        if not rows:
+            return
+
+        # Records by their values, taken in statement order; an update may match what an earlier one wrote.
+        found = {}
+        async for record in self.matching(table_name, columns, rows):
+            found.setdefault(row_key(record.get(col) for col in columns), []).append(record)
+
+        operations = []
+        for statement in statements:
+            if isinstance(statement, Update):
+                if len(statement.old) != len(columns):
+                    continue
+                candidates = found.get(row_key(statement.old))
+                if not candidates:
+                    print(f"Record {statement.old} not found in table '{table_name}'")
+                    continue
+                record = candidates.pop(0)
+                changes = dict(zip(columns, statement.new))
+                new = {**record, **changes}
+                found.setdefault(row_key(new.get(col) for col in columns), []).append(new)
+                operations.append({"op": "update", "table": table_name, "id": record['id'], "changes": changes})
+                print(f"Record updated from {statement.old} to {statement.new}")
+            elif len(statement.values) == len(columns):
+                doomed = found.pop(row_key(statement.values), [])
+                for record in doomed:
+                    operations.append({"op": "delete", "table": table_name, "id": record['id']})
+                print(f"Record {statement.values} deleted from table '{table_name}'")
+
+        if operations:
+            await self.db.batch(operations)
+
+    async def handle_select(self, statement):
+        columns = self.columns(statement.table)
+        if columns is None:
+            return
+        found = False
+        async for record in self.matching(statement.table, columns, [statement.values]):
+            found = True
             print(f"Record found: {record}")
+        if not found:
+            print(f"Record {statement.values} not found in table '{statement.table}'")
+
+
+    @staticmethod
+    def filters(where):
+        """Turns a ``where`` clause into ``query`` conditions; ``like "abc%"`` becomes a prefix match."""
+        conditions = []
+        for column, op, value in where:
+            if op == "like":
+                if not isinstance(value, str) or not value.endswith("%") or any(c in value[:-1] for c in "%_"):
+                    raise EDLangSyntaxError(f"only prefix patterns like \"abc%\" are supported, not {value!r}")
+                op, value = "prefix", value[:-1]
+            conditions.append((column, op, value))
+        return conditions
+
+    async def handle_select_where(self, statement):
+        for name, value in (("limit", statement.limit), ("offset", statement.offset)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                raise EDLangSyntaxError(f"{name} must be a non-negative integer, not {value!r}")
+        if self.columns(statement.table) is None:
+            return
+
+        found = 0
+        rows = self.db.query(
+            statement.table, self.filters(statement.where), statement.columns,
+            statement.order_by, statement.descending, statement.limit, statement.offset or 0,
+        )
+        async for record in rows:
+            found += 1
+            print(record)
+        if not found:
+            print(f"No matching records in table '{statement.table}'")
+
+    async def handle_where(self, statement):
+        """Runs ``update ... set ... where`` or ``delete from ... where`` as a query and batches of changes."""
+        table_name = statement.table
+        if self.columns(table_name) is None:
+            return
+
+        filters = self.filters(statement.where)
+        if isinstance(statement, UpdateWhere):
+            changes = statement.changes
+            make = lambda record_id: {"op": "update", "table": table_name, "id": record_id, "changes": changes}
         else:
-            print(f"Record {values} not found in table '{table_name}'")
+            make = lambda record_id: {"op": "delete", "table": table_name, "id": record_id}
+
+        # Ids are collected first so the writes cannot disturb the read.
+        ids = [record['id'] async for record in self.db.query(table_name, filters, columns=["id"])]
+        for start in range(0, len(ids), BULK_SIZE):
+            await self.db.batch([make(record_id) for record_id in ids[start:start + BULK_SIZE]])
+
+        done = "updated in" if isinstance(statement, UpdateWhere) else "deleted from"
+        print(f"{len(ids)} records {done} table '{table_name}'")
 
 
 # Command-line argument parsing and script execution
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run EDLang script")
-    parser.add_argument('-r', '--run', type=str, required=True, help="File name of the EDLang script to run")
+    parser.add_argument('-r', '--run', type=str, required=True, help="File name of the EDLang script to run, or - for stdin")
+    parser.add_argument('--checkpoint', type=str, help="File recording progress; an interrupted run resumes from it")
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, help="Statements between checkpoints")
+    parser.add_argument('--progress', type=float, default=PROGRESS_EVERY, help="Seconds between progress reports (0 for none)")
+    parser.add_argument('--on-error', choices=["stop", "skip"], default="stop", help="What to do with a line that does not parse")
 
     args = parser.parse_args()
 
     # Run the compiler with asyncio and the provided file name
     compiler = EDLangCompiler()
-    asyncio.run(compiler.compile(args.run))
+    try:
+        asyncio.run(compiler.run(args.run, args.checkpoint, args.checkpoint_every, args.progress or None, args.on_error))
+    except (EDLangSyntaxError, RuntimeError) as e:
+        sys.exit(f"Error: {e}")
+    finally:
+        compiler.db.close()
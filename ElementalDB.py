@@ -1,171 +1,849 @@
 import os
+import glob
+import asyncio
+import contextlib
+import functools
+import itertools
+import threading
 import orjson
-import random
 import string
-import cachetools
+from concurrent.futures import ThreadPoolExecutor
+from storage import TableStore
+from btree import in_range
+from placement import ShardPlacement
+from batching import WriteBatcher
+from sequences import SequenceAllocator
+from cache import RecordCache
+from query import Query, parse_filters
+from columnar import aggregate
+from locking import FileLock
+from durability import sync_directory, write_file
+from transactions import Transaction, apply_batches, recover
+from views import MaterializedView
+from relations import ON_CHANGE, Join, Relation, RelationError, default_column, join_columns
 
 class ElementalDB:
-    def __init__(self, db_dir="db", map_file="map.map"):
+    def __init__(self, db_dir="db", map_file="map.map", btree_degree=32, shard_count=None, max_workers=None,
+                 batch_window=0.002, batch_size=1024, id_block_size=1000,
+                 cache_bytes=16 * 1024 * 1024, cache_policy="lru", shared=False):
         self.db_dir = db_dir
         self.map_file = map_file
+        self.id_block_size = id_block_size
         self.shards = {}
-        self.BTREE_DEGREE = 2
+        self.BTREE_DEGREE = btree_degree
         self.btrees = {}
 
-        self.cache = cachetools.LRUCache(maxsize=100)
+        # File I/O and (de)serialization run on this pool so the event loop never blocks on them.
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="elementaldb")
+        self.locks = {}
+        self.open_lock = threading.Lock()
+
+        # Concurrent adds/updates to a table are grouped into one log write per batch.
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.batchers = {}
+
+        # Results of get(), keyed by (table, column, value); see cache.RecordCache.
+        self.cache = RecordCache(cache_bytes, cache_policy)
 
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
 
-        self.shard_map = self.load_map()
-
-    def load_map(self):
+        # Several processes (e.g. server workers) may open the same database; see TableStore.
+        self.shared = shared
+        self.map_mutex = threading.RLock()
+        self.map_lock = FileLock(f"{map_file}.lock") if shared else None
+
+        with self.map_locked():
+            self.shard_map = self.load_map()
+            if shard_count is not None and shard_count != self.placement.shard_count:
+                self.rebalance(shard_count)
+            self.migrate_legacy_shards()
+            recover(self)
+
+    def map_locked(self):
+        """Serializes changes to ``map.map``, across processes too in shared mode."""
+        stack = contextlib.ExitStack()
+        stack.enter_context(self.map_mutex)
+        if self.map_lock is not None:
+            stack.enter_context(self.map_lock)
+        return stack
+
+    def read_map(self):
+        data = {}
         if os.path.exists(self.map_file):
             with open(self.map_file, "rb") as file:
-                return orjson.loads(file.read())
-        return {}
+                data = orjson.loads(file.read())
+
+        # Older map files hold nothing but the table schemas.
+        if not isinstance(data.get("version"), int):
+            data = {"tables": data}
+        return data
+
+    def load_map(self):
+        data = self.read_map()
+        self.index_map = data.get("indexes", {})
+        # View name -> {"table": ..., "query": ...}
+        self.view_map = data.get("views", {})
+        self.relations = [Relation(**relation) for relation in data.get("relations", [])]
+        self.placement = ShardPlacement.from_dict(data.get("placement", {}))
+        self.sequences = SequenceAllocator(
+            data.get("sequences"), self.id_block_size, save=self.save_map,
+            first_id=lambda table_name: self.get_shard(table_name).max_id() + 1,
+            claim=self.claim_ids if self.shared else None,
+        )
+        return data["tables"]
+
+    def sync_map(self, data=None):
+        """Adds the tables, indexes and placements other processes saved to ``map.map``."""
+        if data is None:
+            data = self.read_map()
+        for table_name, schema in data.get("tables", {}).items():
+            self.shard_map.setdefault(table_name, schema)
+        for table_name, columns in data.get("indexes", {}).items():
+            known = self.index_map.setdefault(table_name, [])
+            known.extend(column for column in columns if column not in known)
+        for name, definition in data.get("views", {}).items():
+            self.view_map.setdefault(name, definition)
+        related = {relation[:3] for relation in self.relations}
+        for relation in data.get("relations", []):
+            relation = Relation(**relation)
+            if relation[:3] not in related:
+                self.relations.append(relation)
+        for table_name, shard_id in data.get("placement", {}).get("tables", {}).items():
+            self.placement.tables.setdefault(table_name, shard_id)
 
     def save_map(self):
-        with open(self.map_file, "wb") as file:
-            file.write(orjson.dumps(self.shard_map))
+        with self.map_locked():
+            sequences = dict(self.sequences.leases)
+            if self.shared:
+                # Merge rather than overwrite what the other processes saved.
+                data = self.read_map()
+                self.sync_map(data)
+                for table_name, lease in data.get("sequences", {}).items():
+                    sequences[table_name] = max(lease, sequences.get(table_name, 0))
+
+            # Synced before it replaces the old map: a lost sequence lease would hand out ids twice.
+            write_file(self.map_file, orjson.dumps({
+                "version": 1,
+                "tables": self.shard_map,
+                "indexes": self.index_map,
+                "views": self.view_map,
+                "relations": [relation._asdict() for relation in self.relations],
+                "placement": self.placement.to_dict(),
+                "sequences": sequences,
+            }), tmp_path=f"{self.map_file}.{os.getpid()}.tmp")
+
+    def claim_ids(self, table_name, held, start, end):
+        """
+        Leases ids ``start`` up to ``end`` for this process and returns the first one.
+
+        If another process leased ids after ``held`` (the end of our lease), the
+        block moves past that lease so no id is handed out twice.
+        """
+        with self.map_locked():
+            stored = self.read_map().get("sequences", {}).get(table_name, 0)
+            if stored > held and stored > start:
+                end += stored - start
+                start = stored
+            self.sequences.leases[table_name] = end
+            self.save_map()
+        return start
+
+    def schema_for(self, table_name):
+        """Returns the table's schema, checking ``map.map`` for tables other processes created."""
+        if table_name not in self.shard_map and self.shared:
+            with self.map_locked():
+                self.sync_map()
+        return self.shard_map.get(table_name)
+
+    def invalidate_cache(self, table_name, entries):
+        """Drops cached results made stale by writes another process logged (``None``: all of the table's)."""
+        if entries is None:
+            self.cache.invalidate_table(table_name)
+            return
+        for entry in entries:
+            self.cache.invalidate(table_name, old=entry.get("old"), new=entry.get("record"))
+
+    def shard_dir(self, shard_id):
+        path = os.path.join(self.db_dir, f"shard_{shard_id}")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def table_files(self, table_name, shard_id):
+        return glob.glob(os.path.join(self.db_dir, f"shard_{shard_id}", f"{table_name}.*"))
+
+    def locate_table(self, table_name):
+        """
+        Returns the shard holding the table's files.
+
+        Normally that is the recorded placement, but if a rebalance was cut short
+        before ``map.map`` was saved the files are found in another shard.
+        """
+        shard_id = self.placement.shard_for(table_name)
+        if not self.table_files(table_name, shard_id):
+            for other in range(1, max(self.placement.shard_count, shard_id) + 1):
+                if self.table_files(table_name, other):
+                    self.placement.tables[table_name] = other
+                    self.save_map()
+                    return other
+        return shard_id
 
     def get_shard(self, table_name):
-        shard_id = hash(table_name) % 3 + 1
-        shard_name = f"shard_{shard_id}.json"
-        shard_path = os.path.join(self.db_dir, shard_name)
-
-        if shard_name not in self.shards:
-            self.shards[shard_name] = shard_path
+        """Returns the table's store, replaying its write-ahead log on first use."""
+        with self.open_lock:
+            if table_name not in self.shards:
+                if not table_name.isidentifier():
+                    raise ValueError(f"Invalid table name: {table_name!r}")
+                store = TableStore(
+                    self.shard_dir(self.locate_table(table_name)), table_name,
+                    indexes=self.index_map.get(table_name, []),
+                    btree_degree=self.BTREE_DEGREE,
+                    schema=self.schema_for(table_name) or [],
+                    shared=self.shared,
+                    views=self.views_of(table_name),
+                )
+                store.on_change = functools.partial(self.invalidate_cache, table_name)
+                self.shards[table_name] = store
+                self.btrees[table_name] = store.indexes
+            return self.shards[table_name]
+
+    async def run(self, func, *args, **kwargs):
+        """Runs a blocking call on the database's thread pool and awaits its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def lock_for(self, table_name):
+        """Returns the asyncio lock serializing writers of ``table_name``."""
+        if table_name not in self.locks:
+            self.locks[table_name] = asyncio.Lock()
+        return self.locks[table_name]
+
+    def batcher_for(self, table_name):
+        """Returns the group-commit queue for writes to ``table_name``."""
+        if table_name not in self.batchers:
+            self.batchers[table_name] = WriteBatcher(self, table_name, self.batch_window, self.batch_size)
+        return self.batchers[table_name]
+
+    async def open_store(self, table_name):
+        """Async counterpart of ``get_shard``: replays the table's log off the event loop."""
+        store = self.shards.get(table_name)
+        if store is None:
+            store = await self.run(self.get_shard, table_name)
+        return store
+
+    def migrate_legacy_shards(self):
+        """
+        Moves records out of the old shared ``shard_N.json`` files into per-table logs.
+
+        Old shards do not record which table a row belongs to, so each record is
+        routed to the table whose schema columns match its keys. The original
+        file is kept as ``shard_N.json.migrated``.
+        """
+        for shard_path in sorted(glob.glob(os.path.join(self.db_dir, "shard_*.json"))):
+            with open(shard_path, "rb") as file:
+                try:
+                    records = orjson.loads(file.read())
+                except orjson.JSONDecodeError:
+                    # Left in place rather than migrated as an empty shard, so nothing is lost unnoticed.
+                    print(f"Could not migrate {shard_path}: the file is corrupt")
+                    continue
+
+            matched = {}
+            for record in records:
+                columns = set(record) - {"id"}
+                for table_name, schema in self.shard_map.items():
+                    if columns == {col[0] for col in schema}:
+                        matched.setdefault(table_name, []).append(("put", record, None))
+                        break
+                else:
+                    print(f"Could not match legacy record {record} to a table")
 
-        if not os.path.exists(shard_path):
-            with open(shard_path, "wb") as f:
-                f.write(orjson.dumps([]))
+            for table_name, ops in matched.items():
+                self.get_shard(table_name).apply_batch(ops)
 
-        return shard_path
+            os.replace(shard_path, f"{shard_path}.migrated")
 
     def create_table(self, table_name, schema=[]):
         self.shard_map[table_name] = schema
+        if table_name in self.shards:
+            self.shards[table_name].schema = schema
+        self.placement.assign(table_name)
         self.save_map()
 
-    async def add(self, table_name, data=[]):
-        shard_path = self.get_shard(table_name)
-        record = {}
+    def rebalance(self, shard_count):
+        """
+        Changes the number of shards and moves the tables whose placement changed.
+
+        Placement uses a consistent-hash ring, so only about ``1 / shard_count``
+        of the tables move. Stores of moved tables are closed and reopened
+        lazily from their new shard on next use.
+        """
+        for table_name, old_shard, new_shard in self.placement.rebalance(shard_count):
+            store = self.shards.pop(table_name, None)
+            if store is not None:
+                store.close()
+            self.btrees.pop(table_name, None)
+
+            target = self.shard_dir(new_shard)
+            for path in self.table_files(table_name, old_shard):
+                os.replace(path, os.path.join(target, os.path.basename(path)))
+            # The moves must be on disk before the map points at the new shard.
+            sync_directory(target)
+            sync_directory(self.shard_dir(old_shard))
+
+            self.placement.tables[table_name] = new_shard
+            self.save_map()
+        self.save_map()
 
-        schema = self.shard_map.get(table_name)
-        if not schema:
+    def create_index(self, table_name, column_name):
+        """
+        Creates a persistent B-tree index on ``column_name`` of ``table_name``.
+
+        The index is kept up to date by ``add``, ``update`` and ``delete`` and is
+        used by ``get`` and ``get_range`` for lookups on that column.
+        """
+        if self.schema_for(table_name) is None:
             print(f"No schema found for table {table_name}")
             return
+        if not column_name.isidentifier():
+            raise ValueError(f"Invalid column name for an index: {column_name!r}")
 
-        if isinstance(data, list) and len(data) == len(schema):
-            record = {col[0]: data[i] for i, col in enumerate(schema)}
+        store = self.get_shard(table_name)
+        columns = self.index_map.setdefault(table_name, [])
+        # In shared mode the column may have been indexed by another process after this one opened the table.
+        if column_name in columns and column_name in store.indexes:
+            return
 
-        if 'id' not in record:
-            record['id'] = random.randint(1, 1000000)
+        store.create_index(column_name)
+        if column_name not in columns:
+            columns.append(column_name)
+        self.save_map()
 
-        self.cache[f"{table_name}_{record['id']}"] = record
+    async def relate(self, from_table, to_table, on_change="restrict", column=None):
+        """
+        Relates ``to_table`` to ``from_table``: its ``column`` holds the id of a ``from_table`` record.
+
+        ``on_change`` decides what deleting a ``from_table`` record does to the
+        records referencing it: ``restrict`` refuses the delete while any exist
+        (``relations.RelationError``), ``cascade`` deletes them with it, in one
+        transaction. ``column`` defaults to ``<from_table>_id``, or its
+        singular (``user_id`` for ``users``). It gets an index, so deletes find
+        the referencing records without a scan, and ``join`` joins on the
+        relation when no columns are given. Relating the same column again
+        changes its ``on_change``.
+        """
+        for table_name in (from_table, to_table):
+            if self.schema_for(table_name) is None:
+                print(f"No schema found for table {table_name}")
+                return None
+        if on_change not in ON_CHANGE:
+            raise ValueError(f"Unknown on_change {on_change!r}, expected one of {ON_CHANGE}")
+        if column is None:
+            column = default_column(from_table, to_table, self.shard_map[to_table])
+
+        await self.run(self.create_index, to_table, column)
+        relation = Relation(from_table, to_table, column, on_change)
+        with self.map_locked():
+            if self.shared:
+                self.sync_map()
+            self.relations = [other for other in self.relations if other[:3] != relation[:3]]
+            self.relations.append(relation)
+            self.save_map()
+        return relation
+
+    def relations_from(self, table_name):
+        """Returns the relations whose records reference records of ``table_name``."""
+        return [relation for relation in self.relations if relation.from_table == table_name]
+
+    def views_of(self, table_name):
+        """Returns the queries of the views defined on ``table_name``, by view name."""
+        return {
+            name: definition["query"]
+            for name, definition in self.view_map.items()
+            if definition["table"] == table_name
+        }
+
+    def create_view(self, name, table_name, query=None):
+        """
+        Creates the materialized view ``name``: an aggregate query over ``table_name`` kept up to date on write.
+
+        ``query`` is a dict with the ``filters`` of ``query`` and the
+        ``group_by`` and ``aggs`` of ``aggregate``, e.g.
+        ``{"filters": {"status": "paid"}, "group_by": "region",
+        "aggs": {"orders": ("count", None), "total": ("sum", "amount")}}``.
+        The result is computed once here; after that ``add``, ``update`` and
+        ``delete`` adjust only the groups their records move between, and
+        ``view`` reads it without touching the table. Creating an existing
+        view with a new query replaces it.
+        """
+        if self.schema_for(table_name) is None:
+            print(f"No schema found for table {table_name}")
+            return
+        if not name.isidentifier():
+            raise ValueError(f"Invalid view name: {name!r}")
+        if self.shared:
+            with self.map_locked():
+                self.sync_map()
+        existing = self.view_map.get(name)
+        if existing is not None and existing["table"] != table_name:
+            raise ValueError(f"View {name!r} already exists on table {existing['table']!r}")
+
+        # Checked, and stored the way it reads back from map.map.
+        query = orjson.loads(orjson.dumps(MaterializedView(name, query).query))
+        store = self.get_shard(table_name)
+        if existing == {"table": table_name, "query": query} and name in store.views:
+            return
+        store.create_view(name, query)
+        self.view_map[name] = {"table": table_name, "query": query}
+        self.save_map()
 
-        with open(shard_path, "rb+") as file:
-            try:
-                records = orjson.loads(file.read())
-            except orjson.JSONDecodeError:
-                records = []
+    async def view(self, name):
+        """Returns the current result of the materialized view ``name``, in the form ``aggregate`` returns."""
+        definition = self.view_map.get(name)
+        if definition is None and self.shared:
+            with self.map_locked():
+                self.sync_map()
+            definition = self.view_map.get(name)
+        if definition is None:
+            print(f"No view named {name}")
+            return None
+        store = await self.open_store(definition["table"])
+        return await self.run(store.view_result, name, definition["query"])
+
+    async def build_record(self, table_name, data):
+        """Turns a list in schema order or a dict into a record with an id, taken from the table's sequence if missing."""
+        schema = self.shard_map[table_name]
+        record = {}
 
-            records.append(record)
-            file.seek(0)
-            file.write(orjson.dumps(records))
-            file.truncate()
+        if isinstance(data, list) and len(data) == len(schema):
+            record = {col[0]: data[i] for i, col in enumerate(schema)}
+        elif isinstance(data, dict):
+            record = dict(data)
+
+        await self.assign_ids(table_name, [record])
+        return record
+
+    async def assign_ids(self, table_name, records):
+        """
+        Gives the records without an id the next ids of the table's sequence, and moves it past the ids of the others.
+
+        Leasing a block of ids writes the map (or takes its lock, when shared),
+        and a table's first lease opens the table to find its largest id, so
+        this runs on the thread pool.
+        """
+        def assign():
+            # Ids for all the records come from one allocation.
+            ids = iter(self.sequences.allocate(table_name, sum('id' not in record for record in records)))
+            for record in records:
+                if 'id' in record:
+                    self.sequences.observe(table_name, record['id'])
+                else:
+                    record['id'] = next(ids)
 
-    async def get(self, table_name, column_name, value):
-        shard_path = self.get_shard(table_name)
-        cache_key = f"{table_name}_{value}"
+        await self.run(assign)
 
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+    async def add(self, table_name, data=[]):
+        schema = self.schema_for(table_name)
+        if not schema:
+            print(f"No schema found for table {table_name}")
+            return
 
-        with open(shard_path, "rb") as file:
-            try:
-                records = orjson.loads(file.read())
-            except orjson.JSONDecodeError:
-                return None
+        record = await self.build_record(table_name, data)
+        await self.batcher_for(table_name).submit(("put", record, None))
+        self.cache.invalidate(table_name, new=record)
+
+    async def add_many(self, table_name, rows, chunk_size=10000):
+        """
+        Adds many rows to ``table_name`` and returns how many were added.
+
+        ``rows`` may be any iterable or async iterable of lists (in schema order)
+        or dicts, e.g. a generator reading a CSV or JSONL file. Rows are
+        validated against the table schema and written ``chunk_size`` at a time,
+        each chunk as a single atomic log write, so memory stays bounded however
+        long the input is and a crash keeps or loses whole chunks. Synchronous
+        iterables are drained on the thread pool.
+        """
+        schema = self.schema_for(table_name)
+        if not schema:
+            print(f"No schema found for table {table_name}")
+            return 0
+
+        columns = [col[0] for col in schema]
+        allowed = set(columns) | {'id'}
+        store = await self.open_store(table_name)
+        added = 0
+
+        def to_record(row):
+            if isinstance(row, dict):
+                unknown = set(row) - allowed
+                if unknown:
+                    raise ValueError(f"Row {added + 1} has columns not in the schema of '{table_name}': {sorted(unknown)}")
+                return dict(row)
+            if isinstance(row, (list, tuple)) and len(row) == len(columns):
+                return dict(zip(columns, row))
+            raise ValueError(f"Row {added + 1} does not match the schema of '{table_name}': {row!r}")
+
+        async def chunks():
+            if hasattr(rows, "__aiter__"):
+                chunk = []
+                async for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
+            else:
+                iterator = iter(rows)
+                while chunk := await self.run(list, itertools.islice(iterator, chunk_size)):
+                    yield chunk
+
+        async for chunk in chunks():
+            records = []
+            for row in chunk:
+                records.append(to_record(row))
+                added += 1
+
+            await self.assign_ids(table_name, records)
+
+            async with self.lock_for(table_name):
+                await self.run(store.apply_batch, [("put", record, None) for record in records], atomic=True)
 
             for record in records:
-                if record.get(column_name) == value:
-                    self.cache[cache_key] = record
-                    return record
-        return None
+                self.cache.invalidate(table_name, new=record)
+
+        return added
+
+    async def get(self, table_name, column_name=None, value=None, filters=None):
+        """
+        Returns the first record whose ``column_name`` equals ``value`` (or ``None``).
+
+        Called with ``filters`` instead, or with no column at all, it returns the
+        list of every matching record; see ``query`` for the filter syntax.
+        """
+        if column_name is None:
+            return [record async for record in self.query(table_name, filters)]
+
+        store = await self.open_store(table_name)
+        if store.changed_elsewhere():
+            # Picks up other processes' writes, dropping the cache entries they made stale.
+            await self.run(store.refresh)
+
+        hit, record = self.cache.get(table_name, column_name, value)
+        if hit:
+            return record
+        generation = self.cache.generation(table_name)
+
+        def lookup():
+            if column_name == 'id':
+                # Primary-key lookups go straight to the partition whose id range holds the value.
+                records = store.find_many([value])
+            elif column_name in store.indexes:
+                records = store.find_many(store.lookup(column_name, value)[:1])
+            else:
+                ranges = {column_name: (value, value)} if value is not None else None
+                records = (record for record in store.scan(ranges) if record.get(column_name) == value)
+            return next(iter(records), None)
+
+        record = await self.run(lookup)
+        self.cache.put(table_name, column_name, value, record, generation)
+        return record
+
+    async def get_range(self, table_name, column_name, low=None, high=None):
+        """Returns every record with ``low <= column_name <= high``; either bound may be left open."""
+        store = await self.open_store(table_name)
+
+        def lookup():
+            if column_name in store.indexes:
+                return store.find_many(store.between(column_name, low, high))
+
+            ranges = {column_name: (low, high)} if low is not None or high is not None else None
+            return [record for record in store.scan(ranges) if in_range(record.get(column_name), low, high)]
+
+        return await self.run(lookup)
+
+    async def query(self, table_name, filters=None, columns=None, order_by=None, descending=False,
+                    limit=None, offset=0, chunk_size=256):
+        """
+        Yields the records of ``table_name`` matching ``filters``, as an async generator.
+
+        ``filters`` maps columns to a value (equality) or to operators:
+        ``{"age": {"gte": 18, "lt": 65}, "role": {"in": ["admin", "user"]},
+        "name": {"prefix": "Jo"}}``. ``columns`` projects each record onto the
+        given columns, ``order_by`` sorts on a column (walking its index when it
+        has one) and ``limit``/``offset`` page through the result. Rows are
+        filtered while the table is read, ``chunk_size`` at a time on the I/O
+        pool, so a small query never loads the whole table.
+        """
+        store = await self.open_store(table_name)
+        rows = Query(filters, columns, order_by, descending, limit, offset).execute(store)
+        try:
+            while chunk := await self.run(list, itertools.islice(rows, chunk_size)):
+                for record in chunk:
+                    yield record
+        finally:
+            rows.close()
+
+    async def aggregate(self, table_name, group_by=None, aggs=None):
+        """
+        Summarizes ``table_name``: ``aggs`` per distinct value of the ``group_by`` column(s).
+
+        ``aggs`` maps result names to ``(function, column)`` pairs with the
+        functions ``count``, ``sum``, ``avg``, ``min`` and ``max``, e.g.
+        ``{"orders": ("count", None), "total": ("sum", "amount")}``; the default
+        counts rows. Returns one dict per group, ordered by the group values.
+        Columns are read as typed arrays, built once per compacted segment,
+        and aggregated a chunk at a time (with NumPy when it is installed).
+        """
+        if self.schema_for(table_name) is None:
+            print(f"No schema found for table {table_name}")
+            return None
+        store = await self.open_store(table_name)
+        return await self.run(aggregate, store, group_by, aggs)
+
+    async def join(self, left_table, right_table, on=None, how="inner", left_filters=None, right_filters=None,
+                   chunk_size=256):
+        """
+        Yields ``(left, right)`` pairs of records whose join columns are equal, as an async generator.
+
+        ``on`` is a column of both tables or a ``(left column, right column)``
+        pair; without it the tables are joined on a ``relate`` relation
+        between them (the referencing column against ``id``). ``how="left"``
+        also yields each unmatched left record, paired with ``None``.
+        ``left_filters`` and ``right_filters`` use the syntax of ``query``.
+        The join streams one table and either looks its matches up in the
+        other's index (index nested-loop join, when the other table is
+        indexed on its join column and not the smaller one) or holds the
+        smaller table in a hash table (hash join); see ``relations.Join``.
+        """
+        for table_name in (left_table, right_table):
+            if self.schema_for(table_name) is None:
+                print(f"No schema found for table {table_name}")
+                return
+
+        left_column, right_column = join_columns(self.relations, left_table, right_table, on)
+        left = await self.open_store(left_table)
+        right = await self.open_store(right_table)
+        pairs = Join(left_column, right_column, how, left_filters, right_filters).execute(left, right)
+        try:
+            while chunk := await self.run(list, itertools.islice(pairs, chunk_size)):
+                for pair in chunk:
+                    yield pair
+        finally:
+            pairs.close()
 
     async def update(self, table_name, record_id, updated_data):
-        shard_path = self.get_shard(table_name)
+        record = await self.batcher_for(table_name).submit(("update", record_id, updated_data))
 
-        with open(shard_path, "rb+") as file:
-            try:
-                records = orjson.loads(file.read())
-            except orjson.JSONDecodeError:
-                return None
+        if record is None:
+            print(f"Record with id {record_id} not found.")
+            return None
 
-            record_found = False
-            for record in records:
-                if record.get('id') == record_id:
-                    record_found = True
-                    record.update(updated_data)
-                    break
-
-            if not record_found:
-                print(f"Record with id {record_id} not found.")
-                return None
-
-            file.seek(0)
-            file.write(orjson.dumps(records))
-            file.truncate()
+        self.cache.invalidate(table_name, old=record, new={**record, **updated_data})
 
-            cache_key = f"{table_name}_{record_id}"
-            if cache_key in self.cache:
-                self.cache[cache_key].update(updated_data)
-
-            print(f"Record with id {record_id} updated.")
+        print(f"Record with id {record_id} updated.")
 
     async def delete(self, table_name, data):
-        shard_path = self.get_shard(table_name)
+        if isinstance(data, bool) or not isinstance(data, (list, int)):
+            raise TypeError(f"delete takes a list of every column's value or a row number, not {type(data).__name__}")
+        store = await self.open_store(table_name)
 
-        with open(shard_path, "rb+") as file:
-            try:
-                records = orjson.loads(file.read())
-            except orjson.JSONDecodeError:
-                return None
+        # Get the schema columns (names only)
+        schema_columns = [col[0] for col in self.shard_map[table_name]]
 
-            # Get the schema columns (names only)
-            schema_columns = [col[0] for col in self.shard_map[table_name]]
+        # If data is a list (e.g., ['Alice', 30]), it must name every column
+        if isinstance(data, list) and len(data) != len(schema_columns):
+            print("Data list does not match schema length.")
+            return
 
-            # If data is a list (e.g., ['Alice', 30]), delete the matching records
+        def matching():
+            doomed = []
             if isinstance(data, list):
-                if len(data) != len(schema_columns):
-                    print("Data list does not match schema length.")
-                    return
-
                 # Perform deletion based on matching column values
-                records = [
-                    record for record in records
-                    if not all(record.get(col) == val for col, val in zip(schema_columns, data))
+                doomed = [
+                    record for record in store.scan()
+                    if all(record.get(col) == val for col, val in zip(schema_columns, data))
                 ]
             elif isinstance(data, int):
-                if 0 <= data < len(records):
-                    del records[data]
+                for row_number, record in enumerate(store.scan()):
+                    if row_number == data:
+                        doomed = [record]
+                        break
                 else:
-                    print("Invalid row number")
-                    return
-
-            file.seek(0)
-            file.write(orjson.dumps(records))
-            file.truncate()
-
-            print(f"Record {data} deleted from table '{table_name}'")
+                    return None
+            return doomed
+
+        def remove():
+            doomed = matching()
+            if doomed is not None:
+                store.apply_batch([("delete", record['id'], record) for record in doomed])
+            return doomed
+
+        if self.relations_from(table_name):
+            # A transaction finds the referencing records and deletes the cascaded ones along with these.
+            doomed = await self.run(matching)
+            if doomed is None:
+                print("Invalid row number")
+                return
+            if not doomed:
+                print(f"No record {data} in table '{table_name}'")
+                return
+            try:
+                async with self.transaction() as tx:
+                    for record in doomed:
+                        await tx.delete(table_name, record['id'])
+            except RelationError as error:
+                print(error)
+                return
+        else:
+            async with self.lock_for(table_name):
+                doomed = await self.run(remove)
+
+            if doomed is None:
+                print("Invalid row number")
+                return
+            if not doomed:
+                print(f"No record {data} in table '{table_name}'")
+                return
+
+            for record in doomed:
+                self.cache.invalidate(table_name, old=record)
+
+        print(f"Record {data} deleted from table '{table_name}'")
+
+    async def batch(self, operations):
+        """
+        Runs a list of mixed operations in order and returns one result per operation.
+
+        Each operation is a dict naming its ``table`` and an ``op``: ``add``
+        (with ``record``), ``update`` (``id``, ``changes``), ``delete`` (``id``)
+        or ``get`` (``filters``). The writes are applied at the end as one
+        atomic log frame per table, and writes to several tables are committed
+        together through the transaction intent file, so a crash keeps all of
+        them or none. A ``get`` first applies the writes queued on its table,
+        so it sees them. Every operation is validated before any runs, so an
+        invalid one raises ``ValueError`` and nothing is written. A ``delete``
+        from a table other tables ``relate`` to runs, after the operations
+        before it, as a transaction that also applies the relation's cascade;
+        one refused by a ``restrict`` relation raises
+        ``relations.RelationError``.
+        """
+        for i, operation in enumerate(operations):
+            kind = operation.get("op")
+            table_name = operation.get("table")
+            if self.schema_for(table_name) is None:
+                raise ValueError(f"Operation {i}: no schema found for table {table_name!r}")
+            if kind == "add":
+                record = operation.get("record")
+                if not isinstance(record, (dict, list)):
+                    raise ValueError(f"Operation {i}: 'add' needs a record")
+                columns = [col[0] for col in self.shard_map[table_name]]
+                if isinstance(record, list) and len(record) != len(columns):
+                    raise ValueError(f"Operation {i}: record does not match the schema of '{table_name}'")
+                unknown = set(record) - set(columns) - {'id'} if isinstance(record, dict) else None
+                if unknown:
+                    raise ValueError(
+                        f"Operation {i}: record has columns not in the schema of '{table_name}': {sorted(unknown)}"
+                    )
+            elif kind == "update":
+                if "id" not in operation or not isinstance(operation.get("changes"), dict):
+                    raise ValueError(f"Operation {i}: 'update' needs an id and changes")
+            elif kind == "delete":
+                if "id" not in operation:
+                    raise ValueError(f"Operation {i}: 'delete' needs an id")
+            elif kind == "get":
+                try:
+                    parse_filters(operation.get("filters"))
+                except ValueError as e:
+                    raise ValueError(f"Operation {i}: {e}") from e
+            else:
+                raise ValueError(f"Operation {i}: unknown operation {kind!r}")
+
+        results = [None] * len(operations)
+        # table -> [(position in operations, storage op)] not yet written
+        pending = {}
+
+        async def flush(*table_names):
+            queued = {table_name: pending.pop(table_name) for table_name in table_names if pending.get(table_name)}
+            if not queued:
+                return
+            batches = {table_name: [op for _, op in ops] for table_name, ops in queued.items()}
+            if len(batches) == 1:
+                [(table_name, ops)] = batches.items()
+                store = await self.open_store(table_name)
+                async with self.lock_for(table_name):
+                    replaced = {table_name: await self.run(store.apply_batch, ops, atomic=True)}
+            else:
+                # Written together through an intent file, so a crash keeps all of the tables' writes or none.
+                replaced = await apply_batches(self, batches)
+
+            for table_name, ops in queued.items():
+                for (position, op), old in zip(ops, replaced[table_name]):
+                    if op[0] == "put":
+                        self.cache.invalidate(table_name, new=op[1])
+                        results[position] = {"id": op[1]['id']}
+                    elif op[0] == "update":
+                        if old is not None:
+                            self.cache.invalidate(table_name, old=old, new={**old, **op[2]})
+                        results[position] = {"updated": old is not None}
+                    else:
+                        if old is not None:
+                            self.cache.invalidate(table_name, old=old)
+                        results[position] = {"deleted": old is not None}
+
+        for position, operation in enumerate(operations):
+            table_name = operation["table"]
+            kind = operation["op"]
+            if kind == "get":
+                await flush(table_name)
+                results[position] = {"items": await self.get(table_name, filters=operation.get("filters"))}
+                continue
+
+            if kind == "delete" and self.relations_from(table_name):
+                # The cascade may write to any table, so everything queued goes first.
+                await flush(*pending)
+                async with self.transaction() as tx:
+                    results[position] = {"deleted": await tx.delete(table_name, operation["id"])}
+                continue
+
+            if kind == "add":
+                op = ("put", await self.build_record(table_name, operation["record"]), None)
+            elif kind == "update":
+                op = ("update", operation["id"], operation["changes"])
+            else:
+                op = ("delete", operation["id"], None)
+            pending.setdefault(table_name, []).append((position, op))
+
+        await flush(*pending)
+        return results
+
+    def transaction(self):
+        """
+        Starts a transaction: ``async with db.transaction() as tx:`` then ``tx.get``/``query``/``add``/``update``/``delete``.
+
+        Reads see a snapshot of each table; the writes are applied together when
+        the block ends, or not at all if it raises or another writer changed the
+        same records first (``transactions.TransactionConflict``).
+        """
+        return Transaction(self)
 
     def print_all(self, table_name):
-        shard_path = self.get_shard(table_name)
-        with open(shard_path, "rb") as file:
-            try:
-                records = orjson.loads(file.read())
-                for record in records:
-                    print(record)
-            except orjson.JSONDecodeError:
-                print(f"No records found for table {table_name}")
+        store = self.get_shard(table_name)
+        found = False
+        for record in store.scan():
+            found = True
+            print(record)
+        if not found:
+            print(f"No records found for table {table_name}")
+
+    def cache_stats(self):
+        """Returns the record cache's hit, miss, eviction and size counters."""
+        return self.cache.stats()
+
+    def close(self):
+        """Flushes and closes every open table log and stops the I/O thread pool."""
+        self.executor.shutdown(wait=True)
+        for store in self.shards.values():
+            store.close()
@@ -1,4 +1,7 @@
 import asyncio
+import os
+import time
+import cachetools
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Optional
@@ -11,11 +14,30 @@ from ElementalDB import ElementalDB
 SECRET_KEY = "ElementalDB"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# How long a verified token is trusted without decoding it again (never past its expiry).
+TOKEN_CACHE_SECONDS = 60
+AUTH_CACHE_SIZE = 10000
 
-db = ElementalDB("database")
-pwd_context = CryptContext(schemas=["argon2"], deprecated="auto")
+USERS_TABLE = "USERS"
+USERS_SCHEMA = [["username", "str"], ["hashed_password", "str"], ["role", "str"]]
+
+# Set by ``server.py --workers N`` so the worker processes coordinate their access to the files.
+db = ElementalDB("database", shared=os.environ.get("ELEMENTALDB_SHARED") == "1")
+pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+if db.schema_for(USERS_TABLE) is None:
+    db.create_table(USERS_TABLE, USERS_SCHEMA)
+db.create_index(USERS_TABLE, "username")
+
+# token -> (username, expiry as a Unix time, USERS generation); see get_current_user.
+token_cache = cachetools.TLRUCache(
+    maxsize=AUTH_CACHE_SIZE,
+    ttu=lambda token, value, now: now + min(TOKEN_CACHE_SECONDS, value[1] - time.time()),
+)
+# username -> (USERS generation, UserInDB); see get_user.
+user_cache = cachetools.LRUCache(maxsize=AUTH_CACHE_SIZE)
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -31,6 +53,10 @@ class User(BaseModel):
 class UserInDB(User):
     hashed_password: str
 
+class UserCreate(BaseModel):
+    username: str
+    password: str
+
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
@@ -38,15 +64,41 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password(password: str) -> str:
+    """Argon2-hashes ``password`` on a worker thread, so the event loop keeps serving other requests."""
+    return await asyncio.to_thread(get_password_hash, password)
+
+async def users_generation() -> int:
+    """
+    Returns a number that changes whenever the USERS table is written.
+
+    Cached users and tokens remember the generation they were checked at and
+    are ignored once it moves, so signups, updates and deletes of users (also
+    by other server workers) take effect on the next request.
+    """
+    store = db.shards.get(USERS_TABLE)
+    if store is not None and store.changed_elsewhere():
+        await db.run(store.refresh)
+    return db.cache.generation(USERS_TABLE)
+
 async def get_user(username: str) -> Optional[UserInDB]:
+    generation = await users_generation()
+    cached = user_cache.get(username)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
     try:
-        users = await db.get("USERS", filters={"username": username})
-        if users:
-            user_data = users[0]
-            return UserInDB(**user_data)
-    except:
+        user_data = await db.get(USERS_TABLE, "username", username)
+        if user_data is None:
+            return None
+        if "hashed_password" not in user_data and "password" in user_data:
+            # Accounts created before the USERS schema stored the hash under "password".
+            user_data = {**user_data, "hashed_password": user_data["password"]}
+        user = UserInDB(**user_data)
+    except Exception:
         return None
-    return None
+    user_cache[username] = (generation, user)
+    return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -62,7 +114,7 @@ async def authenticate_user(username: str, password: str, auth_enabled: bool = T
     user = await get_user(username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await asyncio.to_thread(verify_password, password, user.hashed_password):
         return None
     return user
 
@@ -73,6 +125,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    generation = await users_generation()
+    cached = token_cache.get(token)
+    if cached is not None and cached[2] == generation:
+        user = user_cache.get(cached[0])
+        if user is not None and user[0] == generation:
+            return user[1]
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -84,4 +143,6 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     user = await get_user(username=token_data.username)
     if user is None:
         raise credentials_exception
+    if "exp" in payload:
+        token_cache[token] = (user.username, payload["exp"], generation)
     return user
@@ -0,0 +1,57 @@
+import asyncio
+
+
+class WriteBatcher:
+    """
+    Group commit for one table.
+
+    Writes submitted by concurrent coroutines are queued, and a single flusher
+    task hands everything that arrived within ``window`` seconds (or up to
+    ``max_batch`` operations) to ``TableStore.apply_batch``. The batch costs one
+    log write and one fsync, and every caller's awaitable resolves with its own
+    operation's result once that write is durable.
+    """
+
+    def __init__(self, db, table_name, window=0.002, max_batch=1024):
+        self.db = db
+        self.table_name = table_name
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = []
+        self.full = asyncio.Event()
+        self.flusher = None
+
+    async def submit(self, op):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((op, future))
+        if len(self.queue) >= self.max_batch:
+            self.full.set()
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.ensure_future(self.flush())
+        return await future
+
+    async def flush(self):
+        while self.queue:
+            if len(self.queue) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            self.full.clear()
+
+            batch = self.queue[:self.max_batch]
+            del self.queue[:self.max_batch]
+
+            try:
+                store = await self.db.open_store(self.table_name)
+                async with self.db.lock_for(self.table_name):
+                    results = await self.db.run(store.apply_batch, [op for op, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
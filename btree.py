@@ -0,0 +1,252 @@
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+import orjson
+from durability import replace_file
+
+# Header: magic, format version, degree, number of keys, root node offset, covered log sequence number.
+INDEX_HEADER = struct.Struct("<4sIIQQQ")
+INDEX_MAGIC = b"EDBI"
+NODE_HEADER = struct.Struct("<I")
+
+# Upper bound for the id part of a composite key, so that (rank, value, ID_MAX) sorts
+# after every (rank, value, id_rank, id) entry of the same value.
+ID_MAX = 4
+
+
+def sort_key(value):
+    """
+    Maps a column value onto a tuple that orders consistently across types.
+
+    ``None`` sorts first, then numbers (booleans included), then strings, then
+    anything else by its JSON encoding.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (bool, int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode())
+
+
+def index_key(value, record_id):
+    return sort_key(value) + sort_key(record_id)
+
+
+def range_keys(low=None, high=None):
+    """
+    Turns inclusive value bounds into ``[low_key, high_key)`` composite key bounds.
+
+    A side left open stays within the type of the other bound, so ``low=10``
+    never matches strings.
+    """
+    low_key = sort_key(low) if low is not None else None
+    high_key = sort_key(high) + (ID_MAX,) if high is not None else None
+    if low_key is None and high_key is not None:
+        low_key = (high_key[0],)
+    elif high_key is None and low_key is not None:
+        high_key = (low_key[0] + 1,)
+    return low_key, high_key
+
+
+def in_range(value, low=None, high=None):
+    """Tells whether ``value`` falls within the bounds used by ``BTree.between``."""
+    low_key, high_key = range_keys(low, high)
+    key = sort_key(value)
+    return (low_key is None or key >= low_key) and (high_key is None or key < high_key)
+
+
+class Node:
+    __slots__ = ("keys", "children")
+
+    def __init__(self, keys=None, children=None):
+        self.keys = keys if keys is not None else []
+        # Leaves have no children; internal nodes hold Node objects or file offsets not yet loaded.
+        self.children = children
+
+    @property
+    def leaf(self):
+        return self.children is None
+
+
+class BTree:
+    """
+    B+tree of composite ``(value, id)`` keys used as a secondary index.
+
+    Every node holds at most ``2 * degree - 1`` keys. Deletes only remove the
+    key from its leaf; nodes are repacked the next time the tree is saved.
+    A tree opened from disk loads its nodes lazily, on first access.
+    """
+
+    def __init__(self, degree=32):
+        if degree < 2:
+            raise ValueError("B-tree degree must be at least 2")
+        self.degree = degree
+        self.root = Node()
+        self.count = 0
+        self.lsn = 0
+        self.map = None
+
+    @property
+    def max_keys(self):
+        return 2 * self.degree - 1
+
+    def child(self, node, i):
+        child = node.children[i]
+        if isinstance(child, int):
+            child = self.load_node(child)
+            node.children[i] = child
+        return child
+
+    def load_node(self, offset):
+        (length,) = NODE_HEADER.unpack_from(self.map, offset)
+        start = offset + NODE_HEADER.size
+        data = orjson.loads(self.map[start:start + length])
+        keys = [tuple(key) for key in data["keys"]]
+        return Node(keys, data.get("children"))
+
+    def insert(self, key):
+        split = self._insert(self.root, key)
+        if split is not None:
+            separator, right = split
+            self.root = Node([separator], [self.root, right])
+
+    def _insert(self, node, key):
+        if node.leaf:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                return None
+            node.keys.insert(i, key)
+            self.count += 1
+        else:
+            i = bisect_right(node.keys, key)
+            split = self._insert(self.child(node, i), key)
+            if split is None:
+                return None
+            separator, right = split
+            node.keys.insert(i, separator)
+            node.children.insert(i + 1, right)
+
+        if len(node.keys) <= self.max_keys:
+            return None
+
+        middle = len(node.keys) // 2
+        if node.leaf:
+            right = Node(node.keys[middle:])
+            del node.keys[middle:]
+            return right.keys[0], right
+
+        separator = node.keys[middle]
+        right = Node(node.keys[middle + 1:], node.children[middle + 1:])
+        del node.keys[middle:]
+        del node.children[middle + 1:]
+        return separator, right
+
+    def remove(self, key):
+        node = self.root
+        while not node.leaf:
+            node = self.child(node, bisect_right(node.keys, key))
+        i = bisect_left(node.keys, key)
+        if i < len(node.keys) and node.keys[i] == key:
+            del node.keys[i]
+            self.count -= 1
+
+    def range(self, low=None, high=None):
+        """Yields keys with ``low <= key < high`` in order; ``None`` leaves a side open."""
+        yield from self._range(self.root, low, high)
+
+    def _range(self, node, low, high):
+        if node.leaf:
+            start = 0 if low is None else bisect_left(node.keys, low)
+            for key in node.keys[start:]:
+                if high is not None and key >= high:
+                    return
+                yield key
+            return
+
+        start = 0 if low is None else bisect_right(node.keys, low)
+        for i in range(start, len(node.children)):
+            if high is not None and i > 0 and node.keys[i - 1] >= high:
+                return
+            yield from self._range(self.child(node, i), low, high)
+
+    def lookup(self, value):
+        """Returns the ids of all entries whose value equals ``value``."""
+        low = sort_key(value)
+        return [key[-1] for key in self.range(low, low + (ID_MAX,))]
+
+    def between(self, low=None, high=None):
+        """Returns the ids of entries with ``low <= value <= high`` (either bound may be ``None``)."""
+        low_key, high_key = range_keys(low, high)
+        return [key[-1] for key in self.range(low_key, high_key)]
+
+    @staticmethod
+    def write(path, keys, degree=32, lsn=0):
+        """
+        Bulk-loads sorted ``keys`` into a packed tree file at ``path``.
+
+        The file is written next to ``path`` and renamed over it once synced.
+        """
+        # Unique per writer: processes sharing a database may checkpoint the same index at once.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        max_keys = 2 * degree - 1
+        count = 0
+
+        with open(tmp_path, "wb") as file:
+            file.write(b"\0" * INDEX_HEADER.size)
+
+            def write_node(node):
+                payload = orjson.dumps(node)
+                offset = file.tell()
+                file.write(NODE_HEADER.pack(len(payload)) + payload)
+                return offset
+
+            # Each level is a list of (first key, offset) pairs for the level above.
+            level = []
+            leaf = []
+            for key in keys:
+                leaf.append(key)
+                count += 1
+                if len(leaf) == max_keys:
+                    level.append((leaf[0], write_node({"keys": leaf})))
+                    leaf = []
+            if leaf or not level:
+                level.append((leaf[0] if leaf else None, write_node({"keys": leaf})))
+
+            while len(level) > 1:
+                parents = []
+                for i in range(0, len(level), max_keys + 1):
+                    group = level[i:i + max_keys + 1]
+                    node = {"keys": [first for first, _ in group[1:]], "children": [offset for _, offset in group]}
+                    parents.append((group[0][0], write_node(node)))
+                level = parents
+
+            file.seek(0)
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, 1, degree, count, level[0][1], lsn))
+            file.flush()
+            os.fsync(file.fileno())
+
+        replace_file(tmp_path, path)
+
+    def save(self, path, lsn=None):
+        self.write(path, self.range(), self.degree, self.lsn if lsn is None else lsn)
+
+    @classmethod
+    def open(cls, path):
+        """Opens a tree written by ``write``; nodes are read from the file as they are visited."""
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, _version, degree, count, root_offset, lsn = INDEX_HEADER.unpack_from(mapped, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not an index file")
+
+        tree = cls(degree)
+        tree.map = mapped
+        tree.count = count
+        tree.lsn = lsn
+        tree.root = tree.load_node(root_offset)
+        return tree
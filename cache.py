@@ -0,0 +1,278 @@
+import collections
+import threading
+import cachetools
+import orjson
+from btree import sort_key
+
+# Stored for lookups that found nothing, so repeated misses skip the storage read too.
+MISSING = object()
+
+# Rough per-entry bookkeeping cost added to the encoded size of each cached record.
+ENTRY_OVERHEAD = 64
+
+
+def entry_size(value):
+    if value is MISSING:
+        return ENTRY_OVERHEAD
+    return ENTRY_OVERHEAD + len(orjson.dumps(value))
+
+
+class FrequencySketch:
+    """
+    Count-min sketch of recent access frequencies with 4-bit saturating counters.
+
+    All counters are halved every ``10 * width`` increments so old popularity fades.
+    """
+
+    def __init__(self, width=4096, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = [bytearray(width) for _ in range(depth)]
+        self.additions = 0
+
+    def slots(self, key):
+        return [hash((row, key)) % self.width for row in range(self.depth)]
+
+    def increment(self, key):
+        for row, slot in zip(self.table, self.slots(key)):
+            if row[slot] < 15:
+                row[slot] += 1
+        self.additions += 1
+        if self.additions >= 10 * self.width:
+            self.additions = 0
+            for row in self.table:
+                for slot in range(self.width):
+                    row[slot] >>= 1
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self.table, self.slots(key)))
+
+
+class TinyLFUCache(cachetools.Cache):
+    """
+    LRU cache guarded by a TinyLFU admission filter.
+
+    When a new entry would force an eviction it is only admitted if it has
+    been requested more often than the entry it would evict.
+    """
+
+    def __init__(self, maxsize, getsizeof=None, sketch_width=4096):
+        cachetools.Cache.__init__(self, maxsize, getsizeof)
+        self.order = collections.OrderedDict()
+        self.sketch = FrequencySketch(sketch_width)
+        self.rejections = 0
+
+    def __missing__(self, key):
+        self.sketch.increment(key)
+        raise KeyError(key)
+
+    def __getitem__(self, key, cache_getitem=cachetools.Cache.__getitem__):
+        value = cache_getitem(self, key)
+        self.sketch.increment(key)
+        self.order.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value, cache_setitem=cachetools.Cache.__setitem__):
+        if key not in self and self.order and self.currsize + self.getsizeof(value) > self.maxsize:
+            victim = next(iter(self.order))
+            if self.sketch.estimate(key) <= self.sketch.estimate(victim):
+                self.rejections += 1
+                return
+        cache_setitem(self, key, value)
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def __delitem__(self, key, cache_delitem=cachetools.Cache.__delitem__):
+        cache_delitem(self, key)
+        del self.order[key]
+
+    def popitem(self):
+        try:
+            key = next(iter(self.order))
+        except StopIteration:
+            raise KeyError(f"{type(self).__name__} is empty") from None
+        return (key, self.pop(key))
+
+
+class EvictionTracking:
+    """Mixin reporting every eviction to ``on_evict`` so the owner can keep its bookkeeping in sync."""
+
+    on_evict = None
+
+    def popitem(self):
+        key, value = super().popitem()
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+        return key, value
+
+
+class LRUPolicy(EvictionTracking, cachetools.LRUCache):
+    pass
+
+
+class LFUPolicy(EvictionTracking, cachetools.LFUCache):
+    pass
+
+
+class TinyLFUPolicy(EvictionTracking, TinyLFUCache):
+    pass
+
+
+POLICIES = {"lru": LRUPolicy, "lfu": LFUPolicy, "tinylfu": TinyLFUPolicy}
+
+
+class RecordCache:
+    """
+    Cache of ``get`` results keyed by ``(table, column, value)`` and bounded by bytes.
+
+    Lookups that found nothing are cached as negative entries. Writes
+    invalidate precisely: an updated or deleted record drops every entry that
+    returned it, and a written record drops the negative entries its new values
+    would now satisfy, including lookups of ``None`` in columns it lacks.
+    Methods take a lock, since stores of shared databases invalidate from the
+    I/O threads when they pick up other processes' writes.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, policy="lru", negative=True):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy {policy!r}, expected one of {sorted(POLICIES)}")
+        self.policy = policy
+        self.negative = negative
+        self.entries = POLICIES[policy](max_bytes, getsizeof=entry_size)
+        self.entries.on_evict = self.evicted
+        # (table, id) -> keys of the entries holding that record, for invalidation.
+        self.by_record = {}
+        self.negative_keys = set()
+        # table -> negative keys looking up ``None``, which any record lacking the column now satisfies.
+        self.null_keys = {}
+        # Bumped on every invalidation so a lookup that raced a write does not cache what it read.
+        self.generations = collections.Counter()
+        self.hits = self.misses = self.negative_hits = 0
+        self.evictions = self.invalidations = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(table_name, column_name, value):
+        return (table_name, column_name, sort_key(value))
+
+    def get(self, table_name, column_name, value):
+        """Returns ``(hit, record)``; a negative hit is ``(True, None)``."""
+        with self.lock:
+            try:
+                record = self.entries[self.key(table_name, column_name, value)]
+            except KeyError:
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            if record is MISSING:
+                self.negative_hits += 1
+                return True, None
+            # A copy, so callers changing it cannot change the cached entry.
+            return True, dict(record)
+
+    def generation(self, table_name):
+        with self.lock:
+            return self.generations[table_name]
+
+    def put(self, table_name, column_name, value, record, generation=None):
+        """
+        Caches the result of a lookup; ``record=None`` stores a negative entry.
+
+        If ``generation`` (taken before the lookup) is given and the table was
+        written since, the result may be stale and is not cached.
+        """
+        with self.lock:
+            if record is None and not self.negative:
+                return
+            if generation is not None and generation != self.generations[table_name]:
+                return
+
+            key = self.key(table_name, column_name, value)
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.forget(key, previous)
+
+            try:
+                self.entries[key] = MISSING if record is None else dict(record)
+            except ValueError:
+                # Larger than the whole cache.
+                return
+            if key not in self.entries:
+                # Turned away by the admission filter.
+                return
+
+            if record is None:
+                self.negative_keys.add(key)
+                if value is None:
+                    self.null_keys.setdefault(table_name, set()).add(key)
+            else:
+                self.by_record.setdefault((table_name, record.get("id")), set()).add(key)
+
+    def invalidate(self, table_name, old=None, new=None):
+        """
+        Drops the entries made stale by a write replacing ``old`` with ``new``.
+
+        Either side may be ``None`` for inserts and deletes.
+        """
+        with self.lock:
+            self.generations[table_name] += 1
+            for record in (old, new):
+                if record is not None:
+                    for key in self.by_record.pop((table_name, record.get("id")), ()):
+                        self.discard(key)
+
+            if new is not None and self.negative_keys:
+                for column_name, value in new.items():
+                    key = self.key(table_name, column_name, value)
+                    if key in self.negative_keys:
+                        self.discard(key)
+                for key in [key for key in self.null_keys.get(table_name, ()) if key[1] not in new]:
+                    self.discard(key)
+
+    def invalidate_table(self, table_name):
+        with self.lock:
+            self.generations[table_name] += 1
+            for key in [key for key in self.entries if key[0] == table_name]:
+                self.discard(key)
+
+    def discard(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.invalidations += 1
+            self.forget(key, value)
+
+    def evicted(self, key, value):
+        self.evictions += 1
+        self.forget(key, value)
+
+    def forget(self, key, value):
+        if value is MISSING:
+            self.negative_keys.discard(key)
+            keys = self.null_keys.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.null_keys[key[0]]
+        else:
+            keys = self.by_record.get((key[0], value.get("id")))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_record[(key[0], value.get("id"))]
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and current size, ready to export."""
+        with self.lock:
+            return {
+                "policy": self.policy,
+                "entries": len(self.entries),
+                "bytes": self.entries.currsize,
+                "max_bytes": self.entries.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+                "evictions": self.evictions,
+                "rejections": getattr(self.entries, "rejections", 0),
+                "invalidations": self.invalidations,
+            }
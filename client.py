@@ -1,6 +1,15 @@
+import asyncio
+import json
 import requests
-from typing import Any, List, Dict
+from requests.adapters import HTTPAdapter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
 import time
+import wire
+
+try:
+    import httpx
+except ImportError:  # Only the async client needs it
+    httpx = None
 
 class ElementalDBClient:
     """
@@ -9,21 +18,50 @@ class ElementalDBClient:
     Provides methods to perform CRUD operations (Create, Read, Update, Delete)
     on tables stored in the ElementalDB backend.
 
+    All requests go through one ``requests.Session``, so connections are
+    pooled and kept alive instead of opened per operation. ``wire_format``
+    asks the server for ``"columnar"`` or ``"msgpack"`` responses instead of
+    JSON (the server falls back to JSON if it cannot produce them); gzip and
+    zstd response compression are negotiated by ``requests`` itself.
+
     Attributes:
         base_url (str): The base URL of the ElementalDB API server.
         timeout (int): The default timeout for HTTP requests.
+        session (requests.Session): The pooled session used for every request.
     """
 
-    def __init__(self, base_url: str, timeout: int = 5) -> None:
+    def __init__(self, base_url: str, timeout: int = 5, token: Optional[str] = None, pool_size: int = 10,
+                 wire_format: str = "json") -> None:
         """
         Initializes the ElementalDBClient with the specified base URL.
 
         Args:
             base_url (str): The base URL of the ElementalDB API server.
             timeout (int, optional): The timeout for HTTP requests in seconds. Defaults to 5 seconds.
+            token (str, optional): Bearer token sent with every request. Defaults to None.
+            pool_size (int, optional): Number of keep-alive connections to pool. Defaults to 10.
+            wire_format (str, optional): Response encoding to ask for: "json", "columnar" or "msgpack".
+                Defaults to "json".
         """
         self.base_url = base_url
         self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = wire.accept_header(wire_format)
+        if token is not None:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def close(self) -> None:
+        """Closes the pooled connections."""
+        self.session.close()
+
+    def __enter__(self) -> "ElementalDBClient":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
 
     def add_item(self, table_name: str, columns: List[str], values: List[Any]) -> Dict:
         """
@@ -38,37 +76,68 @@ class ElementalDBClient:
             Dict: The response from the server containing the status or result of the addition.
         """
         try:
-            response = requests.post(f"{self.base_url}/add", json={
+            response = self.session.post(f"{self.base_url}/add", json={
                 "table_name": table_name,
                 "columns": columns,
                 "values": values  # Ensure values is a list, not a dictionary
             }, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response.content, response.headers.get("content-type"))
         except requests.exceptions.Timeout:
             return {"error": "Request timed out"}
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
-    def get_items(self, table_name: str) -> Dict:
+    def get_items(self, table_name: str, page_size: Optional[int] = None, cursor: Optional[str] = None) -> Dict:
         """
-        Retrieves all items from the specified table in the database.
+        Retrieves one page of items from the specified table in the database.
 
         Args:
             table_name (str): Name of the table to fetch items from.
+            page_size (int, optional): Maximum number of items in the page. Defaults to the server's page size.
+            cursor (str, optional): The ``next_cursor`` of the previous page. Defaults to the first page.
 
         Returns:
-            Dict: The response from the server containing a list of items in the table.
+            Dict: The response from the server with the page's ``items`` and the ``next_cursor``
+            to request the following page (``None`` after the last page).
         """
+        params = {}
+        if page_size is not None:
+            params["page_size"] = page_size
+        if cursor is not None:
+            params["cursor"] = cursor
         try:
-            response = requests.get(f"{self.base_url}/get/{table_name}", timeout=self.timeout)
+            response = self.session.get(f"{self.base_url}/get/{table_name}", params=params, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response.content, response.headers.get("content-type"))
         except requests.exceptions.Timeout:
             return {"error": "Request timed out"}
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
+    def iter_items(self, table_name: str, cursor: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Streams every item of the specified table, in id order, as the server reads them.
+
+        Args:
+            table_name (str): Name of the table to fetch items from.
+            cursor (str, optional): Start after the page this cursor came from. Defaults to the beginning.
+
+        Yields:
+            Dict: One item at a time.
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails.
+        """
+        params = {"stream": "true"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        with self.session.get(f"{self.base_url}/get/{table_name}", params=params, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
     def delete_item(self, table_name: str, id: int) -> Dict:
         """
         Deletes an item from the specified table based on its ID.
@@ -81,9 +150,9 @@ class ElementalDBClient:
             Dict: The response from the server confirming the deletion.
         """
         try:
-            response = requests.delete(f"{self.base_url}/delete/{table_name}/{id}", timeout=self.timeout)
+            response = self.session.delete(f"{self.base_url}/delete/{table_name}/{id}", timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response.content, response.headers.get("content-type"))
         except requests.exceptions.Timeout:
             return {"error": "Request timed out"}
         except requests.exceptions.RequestException as e:
@@ -102,18 +171,175 @@ class ElementalDBClient:
             Dict: The response from the server confirming the update.
         """
         try:
-            response = requests.put(f"{self.base_url}/update", json={
+            response = self.session.put(f"{self.base_url}/update", json={
                 "table_name": table_name,
                 "row_id": row_id,
                 "updates": updates  # Ensure updates is a dictionary with column-value pairs
             }, timeout=self.timeout)
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response.content, response.headers.get("content-type"))
+        except requests.exceptions.Timeout:
+            return {"error": "Request timed out"}
+        except requests.exceptions.RequestException as e:
+            return {"error": str(e)}
+
+    def batch(self, operations: List[Dict[str, Any]]) -> Dict:
+        """
+        Runs many operations in one request.
+
+        Args:
+            operations (List[Dict[str, Any]]): Operations such as
+                ``{"op": "add", "table": "users", "record": {...}}``,
+                ``{"op": "update", "table": "users", "id": 1, "changes": {...}}``,
+                ``{"op": "delete", "table": "users", "id": 1}`` or
+                ``{"op": "get", "table": "users", "filters": {...}}``.
+
+        Returns:
+            Dict: The response from the server with one entry in ``results`` per operation.
+        """
+        try:
+            response = self.session.post(f"{self.base_url}/batch", json={"operations": operations}, timeout=self.timeout)
+            response.raise_for_status()
+            return wire.decode(response.content, response.headers.get("content-type"))
         except requests.exceptions.Timeout:
             return {"error": "Request timed out"}
         except requests.exceptions.RequestException as e:
             return {"error": str(e)}
 
+
+class AsyncElementalDBClient:
+    """
+    Asyncio client for the ElementalDB FastAPI server, built on ``httpx``.
+
+    Requests share a pool of keep-alive connections, so many of them can be
+    in flight at once; ``batch_many`` uses that to send a large list of
+    operations as concurrent ``/batch`` requests. ``wire_format`` works as in
+    ``ElementalDBClient``.
+
+    Attributes:
+        base_url (str): The base URL of the ElementalDB API server.
+        client (httpx.AsyncClient): The pooled client used for every request.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 5, token: Optional[str] = None, max_connections: int = 10,
+                 wire_format: str = "json") -> None:
+        """
+        Initializes the AsyncElementalDBClient with the specified base URL.
+
+        Args:
+            base_url (str): The base URL of the ElementalDB API server.
+            timeout (float, optional): The timeout for HTTP requests in seconds. Defaults to 5 seconds.
+            token (str, optional): Bearer token sent with every request. Defaults to None.
+            max_connections (int, optional): Size of the connection pool. Defaults to 10.
+            wire_format (str, optional): Response encoding to ask for: "json", "columnar" or "msgpack".
+                Defaults to "json".
+
+        Raises:
+            ImportError: If httpx is not installed.
+        """
+        if httpx is None:
+            raise ImportError("AsyncElementalDBClient requires httpx (pip install httpx)")
+        self.base_url = base_url
+        self.max_connections = max_connections
+        headers = {"Accept": wire.accept_header(wire_format)}
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            headers=headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def close(self) -> None:
+        """Closes the pooled connections."""
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "AsyncElementalDBClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> Dict:
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return wire.decode(response.content, response.headers.get("content-type"))
+        except httpx.TimeoutException:
+            return {"error": "Request timed out"}
+        except httpx.HTTPError as e:
+            return {"error": str(e)}
+
+    async def add_item(self, table_name: str, columns: List[str], values: List[Any]) -> Dict:
+        """Adds a new item to the specified table; see ``ElementalDBClient.add_item``."""
+        return await self.request("POST", "/add", json={"table_name": table_name, "columns": columns, "values": values})
+
+    async def get_items(self, table_name: str, page_size: Optional[int] = None, cursor: Optional[str] = None) -> Dict:
+        """Retrieves one page of items; see ``ElementalDBClient.get_items``."""
+        params = {}
+        if page_size is not None:
+            params["page_size"] = page_size
+        if cursor is not None:
+            params["cursor"] = cursor
+        return await self.request("GET", f"/get/{table_name}", params=params)
+
+    async def iter_items(self, table_name: str, cursor: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        Streams every item of the specified table, in id order, as the server reads them.
+
+        Raises:
+            httpx.HTTPError: If the request fails.
+        """
+        params = {"stream": "true"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        async with self.client.stream("GET", f"/get/{table_name}", params=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def delete_item(self, table_name: str, id: int) -> Dict:
+        """Deletes an item by its ID; see ``ElementalDBClient.delete_item``."""
+        return await self.request("DELETE", f"/delete/{table_name}/{id}")
+
+    async def update_item(self, table_name: str, row_id: int, updates: Dict[str, Any]) -> Dict:
+        """Updates an item by its ID; see ``ElementalDBClient.update_item``."""
+        return await self.request("PUT", "/update", json={"table_name": table_name, "row_id": row_id, "updates": updates})
+
+    async def batch(self, operations: List[Dict[str, Any]]) -> Dict:
+        """Runs many operations in one request; see ``ElementalDBClient.batch``."""
+        return await self.request("POST", "/batch", json={"operations": operations})
+
+    async def batch_many(self, operations: List[Dict[str, Any]], batch_size: int = 500,
+                         concurrency: Optional[int] = None) -> List[Dict]:
+        """
+        Sends a long list of operations as ``/batch`` requests of ``batch_size``, several at a time.
+
+        Batches run concurrently, so operations in different batches may be
+        applied in any order; keep operations that depend on each other in
+        the same batch.
+
+        Args:
+            operations (List[Dict[str, Any]]): The operations to run.
+            batch_size (int, optional): Operations per request. Defaults to 500.
+            concurrency (int, optional): Requests in flight at once. Defaults to the pool size.
+
+        Returns:
+            List[Dict]: The server's response for each batch, in order.
+        """
+        limit = asyncio.Semaphore(concurrency or self.max_connections)
+
+        async def send(chunk: List[Dict[str, Any]]) -> Dict:
+            async with limit:
+                return await self.batch(chunk)
+
+        return await asyncio.gather(*(
+            send(operations[start:start + batch_size]) for start in range(0, len(operations), batch_size)
+        ))
+
+
 if __name__ == "__main__":
     """
     Demonstrates the usage of the ElementalDBClient by performing example CRUD operations.
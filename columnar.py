@@ -0,0 +1,468 @@
+import array
+import collections
+import itertools
+from bisect import bisect_left, bisect_right
+import orjson
+from btree import sort_key
+from rowformat import INT, FLOAT, BOOL, schema_types, value_type
+
+try:
+    import numpy
+except ImportError:  # The array module holds the columns then, and grouping runs as Python loops.
+    numpy = None
+
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+# Overlay rows (not yet compacted into segments) are turned into columns this many at a time.
+CHUNK_ROWS = 65536
+TYPECODES = {INT: "q", FLOAT: "d", BOOL: "b"}
+DTYPES = {INT: "int64", FLOAT: "float64", BOOL: "bool"}
+
+# A run of rows as columns. ``keep`` is None, or a byte per row that is 0 for rows to leave out.
+Chunk = collections.namedtuple("Chunk", ["rows", "columns", "keep"])
+
+
+def parse_aggs(aggs):
+    """Checks an ``aggs`` mapping of names to ``(function, column)`` pairs; the default counts rows."""
+    aggs = dict(aggs or {"count": ("count", None)})
+    for name, spec in aggs.items():
+        if not isinstance(spec, (list, tuple)) or len(spec) != 2 or spec[0] not in AGGREGATES:
+            raise ValueError(
+                f"Aggregate {name!r} must be a (function, column) pair with a function among {AGGREGATES}"
+            )
+        if spec[1] is None and spec[0] != "count":
+            raise ValueError(f"Aggregate {name!r}: {spec[0]} needs a column")
+        aggs[name] = tuple(spec)
+    return aggs
+
+
+class Column:
+    """
+    One column of a chunk of rows, as a typed array.
+
+    A column whose values all have its type (``int``, ``float`` or ``bool`` in
+    the schema, or inferred) holds them in ``values``, an ``array.array``.
+    Any other column is dictionary-encoded: ``values`` holds a code per row
+    indexing ``labels``, the distinct values. ``valid`` is ``None`` when every
+    row has a value, else a byte per row that is 0 where the value is missing
+    (``None`` or absent), and such rows hold 0.
+    """
+
+    def __init__(self, kind, values, valid=None, labels=None):
+        self.kind = kind
+        self.values = values
+        self.valid = valid
+        self.labels = labels
+
+    @classmethod
+    def build(cls, values, kind=None):
+        """Builds a column from a list of Python values; ``kind=None`` infers the type from them."""
+        valid = bytearray(value is not None for value in values)
+        valid = valid if 0 in valid else None
+        kinds = {value_type(value) for value in values if value is not None}
+        if kind is None and len(kinds) == 1:
+            kind = next(iter(kinds))
+        if kind in TYPECODES and kinds <= {kind}:
+            return cls(kind, array.array(TYPECODES[kind], (0 if value is None else value for value in values)), valid)
+
+        index = {}
+        labels = []
+        codes = array.array("q")
+        for value in values:
+            if value is None:
+                codes.append(0)
+                continue
+            key = label_key(value)
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(labels)
+                labels.append(value)
+            codes.append(code)
+        return cls(None, codes, valid, labels)
+
+    def __len__(self):
+        return len(self.values)
+
+    def array(self):
+        """Returns ``values`` as a NumPy array (a view, nothing is copied), or as is without NumPy."""
+        if numpy is None:
+            return self.values
+        return numpy.frombuffer(self.values, dtype=DTYPES.get(self.kind, "int64"))
+
+    def python_values(self):
+        """Iterates ``values`` as Python values; ``array.array`` holds booleans as 0 and 1."""
+        return map(bool, self.values) if self.kind == BOOL else iter(self.values)
+
+
+def label_key(value):
+    # Keeps 1, 1.0 and True apart, and makes lists and dicts hashable.
+    if isinstance(value, (list, dict)):
+        return ("json", orjson.dumps(value, option=orjson.OPT_SORT_KEYS))
+    return (type(value).__name__, value)
+
+
+def segment_columns(segment, names):
+    """Materializes columns of a segment, once: segments are immutable, so they are cached on the segment."""
+    missing = [name for name in names if name not in segment.column_cache]
+    if missing:
+        # One pass over the rows builds every missing column.
+        values = {name: [] for name in missing}
+        appends = [(name, values[name].append) for name in missing]
+        for record in segment.scan(set(missing)):
+            for name, append in appends:
+                append(record.get(name))
+        kinds = dict(segment.columns)
+        for name in missing:
+            segment.column_cache[name] = Column.build(values[name], kinds.get(name))
+    return {name: segment.column_cache[name] for name in names}
+
+
+def overridden_rows(segment, partition, overlay_keys):
+    """Returns ``keep`` for a segment: 0 in the rows whose record was since rewritten or deleted, or ``None``."""
+    low = bisect_left(overlay_keys, (sort_key(partition["min"].get("id")),))
+    high = bisect_right(overlay_keys, (sort_key(partition["max"].get("id")), float("inf")))
+    if low == high:
+        return None
+
+    if segment.ids is None:
+        rows = segment.column_cache.get("$rows")
+        if rows is None:
+            ids = (record.get("id") for record in segment.scan(("id",)))
+            rows = segment.column_cache["$rows"] = {label_key(record_id): row for row, record_id in enumerate(ids)}
+    keep = bytearray(b"\x01") * len(segment)
+    for _, _, record_id in overlay_keys[low:high]:
+        if segment.ids is None:
+            row = rows.get(label_key(record_id))
+        else:
+            row = None
+            if value_type(record_id) == INT:
+                j = bisect_left(segment.ids, record_id)
+                if j < len(segment.ids) and segment.ids[j] == record_id:
+                    row = segment.id_rows[j]
+        if row is not None:
+            keep[row] = 0
+    return keep if 0 in keep else None
+
+
+def record_chunks(records, names, kinds):
+    for start in range(0, len(records), CHUNK_ROWS):
+        part = records[start:start + CHUNK_ROWS]
+        columns = {name: Column.build([record.get(name) for record in part], kinds.get(name)) for name in names}
+        yield Chunk(len(part), columns, None)
+
+
+def read_chunks(store, names):
+    """
+    Yields a snapshot of the table as ``Chunk``\\s holding the columns ``names``; a blocking generator.
+
+    Each compacted segment is one chunk, its columns built once and cached;
+    the rows still in the in-memory overlays follow in chunks of ``CHUNK_ROWS``.
+    """
+    declared = schema_types(store.schema)
+    kinds = {name: declared[name] for name in names if name in declared}
+    with store.snapshot() as view:
+        overlay = {**view.frozen, **view.active}
+        # (sort key, position, id): ordered by id, and never compares two ids directly.
+        overlay_keys = sorted((sort_key(record_id), i, record_id) for i, record_id in enumerate(overlay))
+        for partition in view.partitions:
+            if partition.get("format") == "rows":
+                segment = store.open_segment(partition)
+                keep = overridden_rows(segment, partition, overlay_keys)
+                yield Chunk(len(segment), segment_columns(segment, names), keep)
+            else:
+                records = [record for record in store.read_partition(partition) if record["id"] not in overlay]
+                yield from record_chunks(records, names, kinds)
+        yield from record_chunks([record for record in overlay.values() if record is not None], names, kinds)
+
+
+def both(mask, other):
+    """ANDs two row masks, either of which may be ``None`` for all rows."""
+    if mask is None or other is None:
+        return other if mask is None else mask
+    if numpy is not None:
+        return mask & other
+    return (int.from_bytes(mask, "little") & int.from_bytes(other, "little")).to_bytes(len(mask), "little")
+
+
+def as_mask(mask):
+    if mask is None or numpy is None:
+        return mask
+    return numpy.frombuffer(mask, dtype="bool")
+
+
+def plain(value):
+    # NumPy scalars become Python numbers.
+    return value.item() if hasattr(value, "item") else value
+
+
+def exact_sum(values):
+    """Sums a NumPy array, in Python integers when int64 could overflow."""
+    if values.dtype.kind == "i" and len(values) and max(-int(values.min()), int(values.max())) * len(values) >= 2 ** 63:
+        return sum(values.tolist())
+    if values.dtype.kind == "b":
+        return int(values.sum())
+    return plain(values.sum())
+
+
+class Aggregation:
+    """
+    Computes ``aggs`` over the rows of a table, per distinct value of the ``group_by`` columns.
+
+    ``aggs`` maps output names to ``(function, column)``: ``count`` (rows, or
+    with a column the rows that have a value in it), ``sum``, ``avg``, ``min``
+    and ``max``. Missing values are skipped, as in SQL. Feed it ``Chunk``\\s with
+    ``add``; each is processed column-wise, with NumPy when it is installed.
+    """
+
+    def __init__(self, group_by=None, aggs=None):
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        self.group_by = list(group_by or [])
+        self.aggs = parse_aggs(aggs)
+        # Group label tuple -> group number, and per group: rows, then per aggregate its running value.
+        self.groups = {}
+        self.labels = []
+        self.rows = collections.Counter()
+        self.state = {name: {} for name in self.aggs}
+        self.counts = {name: collections.Counter() for name, spec in self.aggs.items() if spec[0] == "avg"}
+        self.order = None
+
+    def columns(self):
+        """Names of the columns the aggregation reads."""
+        names = list(self.group_by)
+        for _, column in self.aggs.values():
+            if column is not None and column not in names:
+                names.append(column)
+        return names
+
+    def add(self, chunk):
+        if chunk.rows == 0:
+            return
+        keep = as_mask(chunk.keep)
+        groups = self.group_numbers(chunk) if self.group_by else None
+        # The chunk's rows ordered by group, shared by every NumPy reduction over it.
+        self.order = None
+        self.merge_counts(self.rows, self.count(groups, keep, chunk.rows))
+
+        for name, (function, column_name) in self.aggs.items():
+            state = self.state[name]
+            if function == "count" and column_name is None:
+                self.merge_counts(state, self.count(groups, keep, chunk.rows))
+                continue
+            column = chunk.columns[column_name]
+            mask = both(keep, as_mask(column.valid))
+            if function == "count":
+                self.merge_counts(state, self.count(groups, mask, chunk.rows))
+            elif function in ("sum", "avg"):
+                for group, total in self.sums(groups, mask, column, name).items():
+                    state[group] = state[group] + total if group in state else total
+                if function == "avg":
+                    self.merge_counts(self.counts[name], self.count(groups, mask, chunk.rows))
+            else:
+                pick = min if function == "min" else max
+                for group, value in self.extremes(groups, mask, column, function).items():
+                    current = state.get(group)
+                    state[group] = value if current is None else pick(current, value, key=sort_key)
+
+    @staticmethod
+    def merge_counts(state, counts):
+        for group, count in counts.items():
+            state[group] = state.get(group, 0) + count
+
+    def group_numbers(self, chunk):
+        """Returns the group number of every row of ``chunk``, registering groups seen for the first time."""
+        codes, labels = None, [()]
+        for name in self.group_by:
+            column_codes, column_labels = factorize(chunk.columns[name])
+            if codes is None:
+                codes, labels = column_codes, [(label,) for label in column_labels]
+            else:
+                if numpy is not None:
+                    combined = codes * len(column_labels) + column_codes
+                else:
+                    combined = array.array("q", (a * len(column_labels) + b for a, b in zip(codes, column_codes)))
+                dense, uniques = densify(combined)
+                labels = [labels[u // len(column_labels)] + (column_labels[u % len(column_labels)],) for u in uniques]
+                codes = dense
+
+        numbers = []
+        for label in labels:
+            key = tuple(label_key(value) for value in label)
+            if key not in self.groups:
+                self.groups[key] = len(self.labels)
+                self.labels.append(label)
+            numbers.append(self.groups[key])
+        if numpy is not None:
+            return numpy.asarray(numbers, dtype="int64")[codes]
+        return array.array("q", map(numbers.__getitem__, codes))
+
+    @staticmethod
+    def count(groups, mask, rows):
+        """Returns ``{group: rows}`` counting the rows ``mask`` selects."""
+        if groups is None:
+            if mask is None:
+                return {0: rows}
+            return {0: int(mask.sum()) if numpy is not None else mask.count(1)}
+        if numpy is not None:
+            counts = numpy.bincount(groups if mask is None else groups[mask])
+            return {int(group): int(counts[group]) for group in numpy.flatnonzero(counts)}
+        return collections.Counter(groups if mask is None else itertools.compress(groups, mask))
+
+    def sums(self, groups, mask, column, name):
+        if column.labels is not None:
+            totals = {}
+            for (group, code), count in label_counts(groups, mask, column).items():
+                value = column.labels[code]
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    raise ValueError(f"Aggregate {name!r}: cannot sum the non-numeric value {value!r}")
+                totals[group] = totals.get(group, 0) + value * count
+            return totals
+
+        values = column.array()
+        if numpy is not None:
+            if groups is None:
+                selected = values if mask is None else values[mask]
+                return {0: exact_sum(selected)} if len(selected) else {}
+            found, totals = self.reduce_groups(numpy.add, groups, values, mask)
+            return dict(zip(found.tolist(), totals.tolist()))
+
+        selected = values if mask is None else itertools.compress(values, mask)
+        if groups is None:
+            total = sum(selected, 0 if column.kind != FLOAT else 0.0)
+            return {0: total} if mask is None or 1 in mask else {}
+        totals = {}
+        for group, value in zip(groups if mask is None else itertools.compress(groups, mask), selected):
+            totals[group] = totals[group] + value if group in totals else value
+        return totals
+
+    def extremes(self, groups, mask, column, function):
+        if column.labels is not None:
+            found = {}
+            pick = min if function == "min" else max
+            for group, code in label_counts(groups, mask, column):
+                value = column.labels[code]
+                found[group] = value if group not in found else pick(found[group], value, key=sort_key)
+            return found
+
+        values = column.array()
+        if numpy is not None:
+            if groups is None:
+                selected = values if mask is None else values[mask]
+                return {0: plain(getattr(selected, function)())} if len(selected) else {}
+            ufunc = numpy.minimum if function == "min" else numpy.maximum
+            found, extremes = self.reduce_groups(ufunc, groups, values, mask)
+            return dict(zip(found.tolist(), extremes.tolist()))
+
+        pick = min if function == "min" else max
+        values = column.python_values()
+        selected = values if mask is None else itertools.compress(values, mask)
+        if groups is None:
+            value = pick(selected, default=None)
+            return {} if value is None else {0: value}
+        found = {}
+        for group, value in zip(groups if mask is None else itertools.compress(groups, mask), selected):
+            current = found.get(group)
+            if current is None or (value < current if function == "min" else value > current):
+                found[group] = value
+        return found
+
+    def reduce_groups(self, ufunc, groups, values, mask):
+        """Applies a NumPy ufunc's ``reduceat`` per group; returns the groups found and their results."""
+        if self.order is None:
+            self.order = numpy.argsort(groups, kind="stable")
+        groups, values = groups[self.order], values[self.order]
+        if mask is not None:
+            selected = mask[self.order]
+            groups, values = groups[selected], values[selected]
+        if not len(groups):
+            return groups, values
+        if values.dtype.kind == "i" and ufunc is numpy.add and \
+                max(-int(values.min()), int(values.max())) * len(values) >= 2 ** 63:
+            values = values.astype(object)
+        starts = numpy.flatnonzero(numpy.concatenate(([True], groups[1:] != groups[:-1])))
+        return groups[starts], ufunc.reduceat(values, starts)
+
+    def result(self):
+        """Returns one dict per group, ordered by the group columns: their values, then each aggregate."""
+        if not self.group_by and not self.labels:
+            # No rows at all, but an aggregate without grouping still has its one result row.
+            self.labels.append(())
+        order = sorted(range(len(self.labels)), key=lambda group: [sort_key(value) for value in self.labels[group]])
+        results = []
+        for group in order:
+            if self.group_by and not self.rows.get(group):
+                continue
+            result = dict(zip(self.group_by, self.labels[group]))
+            for name, (function, _) in self.aggs.items():
+                value = self.state[name].get(group)
+                if function == "count":
+                    value = value or 0
+                elif function == "avg" and value is not None:
+                    value = value / self.counts[name][group]
+                if isinstance(value, bool) and function in ("sum", "avg"):
+                    value = int(value)
+                result[name] = value
+            results.append(result)
+        return results
+
+
+def factorize(column):
+    """Returns ``(codes, labels)``: a number per row and the distinct values they stand for (``None`` for missing)."""
+    if column.labels is not None:
+        labels = list(column.labels)
+        codes = column.array()
+        if column.valid is not None:
+            labels.append(None)
+            if numpy is not None:
+                codes = numpy.where(as_mask(column.valid), codes, len(column.labels))
+            else:
+                codes = array.array("q", (code if ok else len(column.labels) for code, ok in zip(codes, column.valid)))
+        return codes, labels
+
+    values = column.array()
+    if numpy is not None:
+        uniques, codes = numpy.unique(values, return_inverse=True)
+        labels = uniques.tolist()
+        if column.valid is not None:
+            labels.append(None)
+            codes = numpy.where(as_mask(column.valid), codes, len(labels) - 1)
+        return codes, labels
+
+    index = {}
+    values = column.python_values()
+    if column.valid is not None:
+        values = (value if ok else None for value, ok in zip(values, column.valid))
+    codes = array.array("q", (index.setdefault(value, len(index)) for value in values))
+    return codes, list(index)
+
+
+def densify(codes):
+    """Renumbers ``codes`` as 0, 1, 2, ...; returns them with the original code of each new number."""
+    if numpy is not None:
+        uniques, dense = numpy.unique(codes, return_inverse=True)
+        return dense, uniques.tolist()
+    index = {}
+    dense = array.array("q", (index.setdefault(code, len(index)) for code in codes))
+    return dense, list(index)
+
+
+def label_counts(groups, mask, column):
+    """Counts the rows per ``(group, code)`` of a dictionary-encoded column."""
+    codes = column.array()
+    if numpy is not None:
+        groups = numpy.zeros(len(codes), dtype="int64") if groups is None else groups
+        if mask is not None:
+            groups, codes = groups[mask], codes[mask]
+        width = len(column.labels) or 1
+        pairs, counts = numpy.unique(groups * width + codes, return_counts=True)
+        return {(int(pair) // width, int(pair) % width): int(count) for pair, count in zip(pairs, counts)}
+    groups = itertools.repeat(0) if groups is None else groups
+    pairs = zip(groups, codes)
+    return collections.Counter(pairs if mask is None else itertools.compress(pairs, mask))
+
+
+def aggregate(store, group_by=None, aggs=None):
+    """Runs an ``Aggregation`` over a snapshot of ``store``; blocking, meant for the I/O pool."""
+    aggregation = Aggregation(group_by, aggs)
+    for chunk in read_chunks(store, aggregation.columns()):
+        aggregation.add(chunk)
+    return aggregation.result()
@@ -0,0 +1,10 @@
+import pytest
+from ElementalDB import ElementalDB
+
+
+@pytest.fixture
+def open_db(tmp_path):
+    """Opens (or reopens) a database kept in the test's temporary directory."""
+    def open_db(**options):
+        return ElementalDB(str(tmp_path / "db"), str(tmp_path / "map.map"), **options)
+    return open_db
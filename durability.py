@@ -0,0 +1,37 @@
+import os
+
+
+def sync_directory(path):
+    """
+    Makes the entries of directory ``path`` (created, renamed and removed files) survive a crash.
+
+    Renaming a synced file over another is atomic, but until its directory is
+    synced the rename itself may be lost. Platforms that cannot open a
+    directory (Windows) skip this.
+    """
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_file(tmp_path, path):
+    """Renames the already synced ``tmp_path`` over ``path`` and syncs the directory."""
+    os.replace(tmp_path, path)
+    sync_directory(os.path.dirname(path))
+
+
+def write_file(path, data, tmp_path=None):
+    """Writes ``data`` to ``path`` atomically: a crash leaves either the old contents or the new ones."""
+    tmp_path = tmp_path or f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    replace_file(tmp_path, path)
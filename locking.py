@@ -0,0 +1,60 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows: shared (multi-process) mode is unavailable there.
+    fcntl = None
+
+
+class FileLock:
+    """
+    Advisory ``flock`` on ``path`` for coordinating processes that share a database.
+
+    Holds are counted per process, so nested ``exclusive()`` blocks and
+    several reader threads share one lock on the file: the first acquire
+    takes it and the last release drops it.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise OSError("Cross-process locking needs fcntl.flock, which this platform lacks")
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.mutex = threading.Lock()
+        self.count = 0
+        self.mode = None
+
+    def acquire(self, shared=False, blocking=True):
+        """Takes the lock; returns ``False`` instead of waiting when ``blocking`` is false and it is held elsewhere."""
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        with self.mutex:
+            if self.count and self.mode == mode:
+                self.count += 1
+                return True
+            if self.count:
+                raise RuntimeError(f"{self.path} is already held in another mode by this process")
+            try:
+                fcntl.flock(self.fd, mode if blocking else mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            self.mode = mode
+            self.count = 1
+            return True
+
+    def release(self):
+        with self.mutex:
+            self.count -= 1
+            if self.count == 0:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+                self.mode = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,75 @@
+import hashlib
+from bisect import bisect_right
+
+
+def stable_hash(key):
+    """64-bit hash of ``key`` that, unlike ``hash()``, is the same in every process."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys onto shards ``1..shard_count``.
+
+    Each shard owns ``vnodes`` points on the ring, so growing or shrinking the
+    shard count only moves the keys that land next to the added/removed points.
+    """
+
+    def __init__(self, shard_count=3, vnodes=64):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.shard_count = shard_count
+        self.vnodes = vnodes
+
+        points = sorted(
+            (stable_hash(f"shard_{shard}#{vnode}"), shard)
+            for shard in range(1, shard_count + 1)
+            for vnode in range(vnodes)
+        )
+        self.points = [point for point, _ in points]
+        self.owners = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        i = bisect_right(self.points, stable_hash(key)) % len(self.points)
+        return self.owners[i]
+
+
+class ShardPlacement:
+    """
+    Table-to-shard assignments, persisted in ``map.map`` next to the schemas.
+
+    Assignments are recorded when a table is created, so they only change when
+    ``rebalance`` is asked to move tables onto a ring with a new shard count.
+    """
+
+    def __init__(self, shard_count=3, vnodes=64, tables=None):
+        self.ring = HashRing(shard_count, vnodes)
+        self.tables = dict(tables or {})
+
+    @property
+    def shard_count(self):
+        return self.ring.shard_count
+
+    def shard_for(self, table_name):
+        return self.tables.get(table_name) or self.ring.shard_for(table_name)
+
+    def assign(self, table_name):
+        self.tables[table_name] = self.shard_for(table_name)
+        return self.tables[table_name]
+
+    def rebalance(self, shard_count):
+        """Switches to a ring of ``shard_count`` shards and returns ``[(table, old, new)]`` moves."""
+        self.ring = HashRing(shard_count, self.ring.vnodes)
+        moves = []
+        for table_name, shard in self.tables.items():
+            target = self.ring.shard_for(table_name)
+            if target != shard:
+                moves.append((table_name, shard, target))
+        return moves
+
+    def to_dict(self):
+        return {"shards": self.ring.shard_count, "vnodes": self.ring.vnodes, "tables": self.tables}
+
+    @classmethod
+    def from_dict(cls, data, default_shards=3):
+        return cls(data.get("shards", default_shards), data.get("vnodes", 64), data.get("tables"))
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+from btree import in_range, sort_key
+
+OPERATORS = {"eq", "ne", "gt", "gte", "lt", "lte", "in", "prefix"}
+
+# Ids fetched from the table per find_many call when a query is answered from an index.
+FETCH_CHUNK = 256
+
+
+class Predicate:
+    """One ``column <op> value`` condition of a query."""
+
+    __slots__ = ("column", "op", "value", "keys")
+
+    def __init__(self, column, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown filter operator {op!r} on column {column!r}, expected one of {sorted(OPERATORS)}")
+        if op == "in" and not isinstance(value, (list, tuple, set, frozenset)):
+            raise ValueError(f"'in' filter on column {column!r} needs a list of values")
+        if op == "prefix" and not isinstance(value, str):
+            raise ValueError(f"'prefix' filter on column {column!r} needs a string")
+        self.column = column
+        self.op = op
+        self.value = value
+        if op == "in":
+            self.value = list(value)
+        # Equality goes through sort_key so it agrees with index lookups.
+        self.keys = {sort_key(item) for item in (self.value if op == "in" else [value])}
+
+    def bounds(self):
+        """Returns the inclusive ``(low, high)`` value range this predicate restricts the column to."""
+        if self.op == "ne":
+            return None
+        if self.op == "eq":
+            return self.value, self.value
+        if self.op in ("gt", "gte"):
+            return self.value, None
+        if self.op in ("lt", "lte"):
+            return None, self.value
+        if self.op == "in":
+            if not self.value:
+                return None
+            keys = sorted(self.value, key=sort_key)
+            return keys[0], keys[-1]
+        return self.value, self.value + "\U0010ffff"
+
+    def matches(self, record):
+        value = record.get(self.column)
+        if self.op in ("eq", "in"):
+            return sort_key(value) in self.keys
+        if self.op == "ne":
+            return sort_key(value) not in self.keys
+        if self.op == "prefix":
+            return isinstance(value, str) and value.startswith(self.value)
+
+        low, high = self.bounds()
+        if not in_range(value, low, high):
+            return False
+        # in_range is inclusive; gt/lt also exclude the bound itself.
+        return self.op in ("gte", "lte") or sort_key(value) != sort_key(self.value)
+
+
+def parse_filters(filters):
+    """
+    Turns a ``filters`` dict into predicates.
+
+    ``{"age": 30}`` is an equality test; ``{"age": {"gte": 18, "lt": 65}}``,
+    ``{"role": {"in": ["admin", "user"]}}`` and ``{"name": {"prefix": "Jo"}}``
+    use operators. A dict with a key that is not an operator raises ``ValueError``;
+    to compare with a dict value, use ``{"eq": {...}}``. ``filters`` may also be
+    a list of ``(column, op, value)`` conditions.
+    """
+    if isinstance(filters, (list, tuple)):
+        return [Predicate(column, op, value) for column, op, value in filters]
+    predicates = []
+    for column, condition in (filters or {}).items():
+        if isinstance(condition, dict) and condition:
+            unknown = set(condition) - OPERATORS
+            if unknown:
+                raise ValueError(
+                    f"Unknown operators {sorted(unknown)} for column {column!r}, expected {sorted(OPERATORS)}"
+                )
+            predicates.extend(Predicate(column, op, value) for op, value in condition.items())
+        else:
+            predicates.append(Predicate(column, "eq", condition))
+    return predicates
+
+
+class Query:
+    """
+    A filtered, projected, ordered and limited read of one table.
+
+    ``execute`` picks the cheapest access path it can: the primary key for
+    ``id`` equality, an index for equality, ``order_by`` or a range on an
+    indexed column, an id-ordered merge of the partitions for ``order_by="id"``,
+    and otherwise a scan that skips partitions ruled out by their zone maps.
+    Rows are filtered as they are read, and a query read in its requested
+    order stops reading once ``offset + limit`` rows have matched.
+    """
+
+    def __init__(self, filters=None, columns=None, order_by=None, descending=False, limit=None, offset=0):
+        self.predicates = parse_filters(filters)
+        self.columns = columns
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+        self.offset = offset or 0
+
+    def matches(self, record):
+        return all(predicate.matches(record) for predicate in self.predicates)
+
+    def project(self, record):
+        if self.columns is None:
+            return record
+        return {column: record[column] for column in self.columns if column in record}
+
+    def ranges(self):
+        """Per-column inclusive bounds of the predicates, for zone map pruning."""
+        ranges = {}
+        for predicate in self.predicates:
+            bounds = predicate.bounds()
+            if bounds is None:
+                continue
+            low, high = bounds
+            if predicate.column in ranges:
+                old_low, old_high = ranges[predicate.column]
+                if low is None or (old_low is not None and sort_key(old_low) > sort_key(low)):
+                    low = old_low
+                if high is None or (old_high is not None and sort_key(old_high) < sort_key(high)):
+                    high = old_high
+            ranges[predicate.column] = (low, high)
+        return ranges
+
+    def candidate_ids(self, store):
+        """Returns ``(ids, ordered)`` from the primary key or an index, or ``(None, False)`` to scan."""
+        for predicate in self.predicates:
+            if predicate.column == "id" and predicate.op in ("eq", "in"):
+                return (predicate.value if predicate.op == "in" else [predicate.value]), False
+
+        for predicate in self.predicates:
+            if predicate.column in store.indexes and predicate.op in ("eq", "in"):
+                values = predicate.value if predicate.op == "in" else [predicate.value]
+                return [record_id for value in values for record_id in store.lookup(predicate.column, value)], False
+
+        ranges = self.ranges()
+        if self.order_by is not None and self.order_by in store.indexes:
+            ids = store.between(self.order_by, *ranges.get(self.order_by, (None, None)))
+            if self.descending:
+                ids.reverse()
+            return ids, True
+
+        for column, (low, high) in ranges.items():
+            if column in store.indexes:
+                return store.between(column, low, high), False
+        return None, False
+
+    def execute(self, store):
+        """Yields the query's rows from ``store``; a blocking generator meant for the I/O pool."""
+        ids, ordered = self.candidate_ids(store)
+        if ids is None and self.order_by == "id" and not self.descending:
+            # Primary-key order comes from merging partitions by their id ranges.
+            rows = store.scan_by_id(self.ranges().get("id", (None, None))[0])
+            ordered = True
+        elif ids is None:
+            ranges = self.ranges()
+            rows = store.scan(ranges or None)
+        else:
+            ids = list(dict.fromkeys(ids))
+            rows = (
+                record
+                for start in range(0, len(ids), FETCH_CHUNK)
+                for record in store.find_many(ids[start:start + FETCH_CHUNK])
+            )
+
+        rows = (record for record in rows if self.matches(record))
+        if self.order_by is not None and not ordered:
+            key = lambda record: sort_key(record.get(self.order_by))
+            if self.limit is not None:
+                pick = heapq.nlargest if self.descending else heapq.nsmallest
+                rows = pick(self.offset + self.limit, rows, key=key)
+            else:
+                rows = sorted(rows, key=key, reverse=self.descending)
+
+        stop = None if self.limit is None else self.offset + self.limit
+        for record in itertools.islice(rows, self.offset, stop):
+            yield self.project(record)
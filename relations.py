@@ -0,0 +1,137 @@
+import collections
+import contextlib
+import itertools
+from btree import sort_key
+from query import Query
+
+ON_CHANGE = ("restrict", "cascade")
+JOINS = ("inner", "left")
+# Outer rows whose matches an index nested-loop join fetches with one find_many.
+JOIN_CHUNK = 256
+
+# ``column`` of ``to_table`` holds the id of a ``from_table`` record; ``on_change`` is what deleting that record does.
+Relation = collections.namedtuple("Relation", ["from_table", "to_table", "column", "on_change"])
+
+
+class RelationError(ValueError):
+    """Raised when a delete is refused because records of a ``restrict`` relation still reference the record."""
+
+
+def default_column(from_table, to_table, schema):
+    """Picks the column of ``to_table`` referencing ``from_table``: ``<from_table>_id``, or its singular (``user_id`` for ``users``)."""
+    columns = [col[0] for col in schema]
+    candidates = [f"{from_table}_id"]
+    if from_table.endswith("s"):
+        candidates.append(f"{from_table[:-1]}_id")
+    for column in candidates:
+        if column in columns:
+            return column
+    raise ValueError(f"Table '{to_table}' has none of the columns {candidates}; pass the referencing column explicitly")
+
+
+def join_columns(relations, left_table, right_table, on):
+    """Resolves ``on`` (a column of both tables, or a ``(left, right)`` pair) into two column names, defaulting to a relation."""
+    if isinstance(on, str):
+        return on, on
+    if isinstance(on, (list, tuple)) and len(on) == 2:
+        return on[0], on[1]
+    if on is not None:
+        raise ValueError(f"'on' must be a column name or a (left column, right column) pair, not {on!r}")
+    for relation in relations:
+        if (relation.from_table, relation.to_table) == (left_table, right_table):
+            return "id", relation.column
+        if (relation.from_table, relation.to_table) == (right_table, left_table):
+            return relation.column, "id"
+    raise ValueError(f"No relation between '{left_table}' and '{right_table}'; pass the columns to join on")
+
+
+class Join:
+    """
+    An equi-join of two tables, streamed as ``(left, right)`` record pairs.
+
+    ``plan`` picks the algorithm from the tables' sizes and indexes. When the
+    inner side is indexed on its join column (or joined on ``id``, its
+    primary key) and the outer side is no larger, it runs an index
+    nested-loop join: the outer table is streamed and each chunk of its rows
+    fetches its matches through the index, so the inner table is never
+    scanned. Otherwise it runs a hash join, holding the smaller table's rows
+    in a hash table keyed on the join value and streaming the larger one
+    through it. A ``left`` join always streams the left table and pairs rows
+    without a match with ``None``. ``None`` join values match nothing.
+    """
+
+    def __init__(self, left_column, right_column, how="inner", left_filters=None, right_filters=None):
+        if how not in JOINS:
+            raise ValueError(f"Unknown join {how!r}, expected one of {JOINS}")
+        self.left_column = left_column
+        self.right_column = right_column
+        self.how = how
+        self.left_query = Query(left_filters)
+        self.right_query = Query(right_filters)
+
+    @staticmethod
+    def indexed(store, column):
+        return column == "id" or column in store.indexes
+
+    def plan(self, left, right):
+        """Returns the algorithm, ``"index"`` or ``"hash"``, and which side, ``"left"`` or ``"right"``, is streamed."""
+        left_rows, right_rows = left.estimated_rows(), right.estimated_rows()
+        if self.indexed(right, self.right_column) and left_rows <= right_rows:
+            return "index", "left"
+        if self.how == "inner" and self.indexed(left, self.left_column) and right_rows <= left_rows:
+            return "index", "right"
+        if self.how == "left" or left_rows >= right_rows:
+            return "hash", "left"
+        return "hash", "right"
+
+    def execute(self, left, right):
+        algorithm, streamed = self.plan(left, right)
+        sides = [
+            (left, self.left_column, self.left_query),
+            (right, self.right_column, self.right_query),
+        ]
+        if streamed == "right":
+            sides.reverse()
+        run = self.index_join if algorithm == "index" else self.hash_join
+        for outer, inner in run(*sides[0], *sides[1]):
+            yield (outer, inner) if streamed == "left" else (inner, outer)
+
+    def index_join(self, outer, outer_column, outer_query, inner, inner_column, inner_query):
+        with contextlib.closing(outer_query.execute(outer)) as rows:
+            while chunk := list(itertools.islice(rows, JOIN_CHUNK)):
+                values = {}
+                for record in chunk:
+                    value = record.get(outer_column)
+                    if value is not None:
+                        values.setdefault(sort_key(value), value)
+
+                if inner_column == "id":
+                    found = inner.find_many(list(values.values()))
+                else:
+                    found = inner.find_many([
+                        record_id for value in values.values() for record_id in inner.lookup(inner_column, value)
+                    ])
+                matches = {}
+                for record in found:
+                    if inner_query.matches(record):
+                        matches.setdefault(sort_key(record.get(inner_column)), []).append(record)
+                yield from self.pair(chunk, outer_column, matches)
+
+    def hash_join(self, outer, outer_column, outer_query, inner, inner_column, inner_query):
+        table = {}
+        with contextlib.closing(inner_query.execute(inner)) as rows:
+            for record in rows:
+                value = record.get(inner_column)
+                if value is not None:
+                    table.setdefault(sort_key(value), []).append(record)
+        with contextlib.closing(outer_query.execute(outer)) as rows:
+            yield from self.pair(rows, outer_column, table)
+
+    def pair(self, records, column, matches):
+        for record in records:
+            value = record.get(column)
+            found = matches.get(sort_key(value), ()) if value is not None else ()
+            for match in found:
+                yield record, match
+            if not found and self.how == "left":
+                yield record, None
@@ -0,0 +1,476 @@
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+import orjson
+
+try:
+    import zstandard
+except ImportError:  # Pages are compressed with lz4 then, or else zlib.
+    zstandard = None
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+# Header: magic, format version, column count, row count, page count, page directory offset, id index offset.
+SEGMENT_HEADER = struct.Struct("<4sHHIIQQ")
+SEGMENT_MAGIC = b"EDBR"
+COLUMN_HEADER = struct.Struct("<BH")
+PAGE_HEADER = struct.Struct("<I")
+# Slot: record offset from the start of its page, record length.
+SLOT = struct.Struct("<II")
+PAGE_SIZE = 8192
+# Per-page compression of version 3 segments; the codec follows the column headers.
+RAW, ZLIB, ZSTD, LZ4 = range(4)
+CODEC_NAMES = {RAW: "none", ZLIB: "zlib", ZSTD: "zstd", LZ4: "lz4"}
+DEFAULT_CODEC = ZSTD if zstandard is not None else LZ4 if lz4 is not None else ZLIB
+CODEC_HEADER = struct.Struct("<B")
+# Column number and entry count of a column's dictionary; its entries follow as length-prefixed UTF-8.
+DICTIONARY_HEADER = struct.Struct("<HI")
+CODE = struct.Struct("<H")
+# A string column is dictionary-encoded when it has at most this many distinct values, each used twice on average.
+DICTIONARY_LIMIT = 4096
+# Decompressed pages a segment keeps for point reads.
+PAGE_CACHE = 16
+
+INT64 = struct.Struct("<q")
+FLOAT64 = struct.Struct("<d")
+BOOL8 = struct.Struct("<?")
+LENGTH = struct.Struct("<I")
+
+# Column types. JSON holds anything else, and any value that does not fit its column's type.
+INT, FLOAT, BOOL, STR, JSON = range(5)
+
+TYPE_NAMES = {
+    "int": INT, "integer": INT, "bigint": INT,
+    "float": FLOAT, "real": FLOAT, "double": FLOAT,
+    "bool": BOOL, "boolean": BOOL,
+    "str": STR, "string": STR, "text": STR, "varchar": STR, "char": STR,
+}
+
+
+def value_type(value):
+    if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+        return INT
+    if type(value) is float:
+        return FLOAT
+    if type(value) is bool:
+        return BOOL
+    if type(value) is str:
+        return STR
+    return JSON
+
+
+def schema_types(schema):
+    """Maps the column names of a ``create_table`` schema onto column types."""
+    types = {"id": INT}
+    for column in schema or ():
+        if isinstance(column, str):
+            types[column] = JSON
+        elif column:
+            type_name = column[1] if len(column) > 1 else None
+            types[column[0]] = TYPE_NAMES.get(str(type_name).lower(), JSON)
+    return types
+
+
+def segment_columns(records, schema=()):
+    """
+    Returns the ``(name, type)`` columns of a segment holding ``records``.
+
+    Columns are ordered by first appearance so decoded rows keep their key
+    order. Types come from the schema; columns it does not declare get the
+    type shared by all their values, or JSON.
+    """
+    declared = schema_types(schema)
+    order = {}
+    for record in records:
+        for name, value in record.items():
+            if name not in order:
+                order[name] = set()
+            if name not in declared and value is not None:
+                order[name].add(value_type(value))
+
+    columns = []
+    for name, seen in order.items():
+        if name in declared:
+            columns.append((name, declared[name]))
+        else:
+            columns.append((name, seen.pop() if len(seen) == 1 else JSON))
+    return columns
+
+
+def build_dictionaries(records, columns):
+    """Returns ``{column number: sorted distinct values}`` for the string columns with few distinct values."""
+    dictionaries = {}
+    for i, (name, kind) in enumerate(columns):
+        if kind != STR:
+            continue
+        values = [record.get(name) for record in records]
+        distinct = {value for value in values if type(value) is str}
+        if distinct and len(distinct) <= DICTIONARY_LIMIT and 2 * len(distinct) <= len(values):
+            dictionaries[i] = sorted(distinct)
+    return dictionaries
+
+
+def compress(codec, data):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == LZ4:
+        return lz4.block.compress(data)
+    if codec == ZLIB:
+        return zlib.compress(data, 6)
+    return data
+
+
+def decompress(codec, data):
+    if codec == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == LZ4:
+        return lz4.block.decompress(data)
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+def encode_record(record, columns, codes=None):
+    """
+    Encodes a record as two bitmaps followed by its fields in column order.
+
+    The first bitmap marks columns the record does not have, the second
+    values stored as length-prefixed JSON because they do not fit the column
+    type (``None`` included). Fixed-width values are stored as is and strings
+    are length-prefixed UTF-8, or a 16-bit code when ``codes`` maps the
+    column's number to a ``{value: code}`` dictionary.
+    """
+    width = (len(columns) + 7) // 8
+    absent = bytearray(width)
+    other = bytearray(width)
+    fields = []
+    for i, (name, kind) in enumerate(columns):
+        if name not in record:
+            absent[i >> 3] |= 1 << (i & 7)
+            continue
+        value = record[name]
+        if kind == JSON or value_type(value) != kind:
+            other[i >> 3] |= 1 << (i & 7)
+            data = orjson.dumps(value)
+            fields.append(LENGTH.pack(len(data)) + data)
+        elif kind == INT:
+            fields.append(INT64.pack(value))
+        elif kind == FLOAT:
+            fields.append(FLOAT64.pack(value))
+        elif kind == BOOL:
+            fields.append(BOOL8.pack(value))
+        elif codes is not None and i in codes:
+            fields.append(CODE.pack(codes[i][value]))
+        else:
+            data = value.encode()
+            fields.append(LENGTH.pack(len(data)) + data)
+    return bytes(absent) + bytes(other) + b"".join(fields)
+
+
+def decode_record(buffer, offset, columns, wanted=None, dictionaries=None):
+    """Decodes the record at ``offset``, or only the ``wanted`` columns of it."""
+    width = (len(columns) + 7) // 8
+    absent = buffer[offset:offset + width]
+    other = buffer[offset + width:offset + 2 * width]
+    position = offset + 2 * width
+    record = {}
+    for i, (name, kind) in enumerate(columns):
+        bit = 1 << (i & 7)
+        if absent[i >> 3] & bit:
+            continue
+        if kind == STR and dictionaries and i in dictionaries and not other[i >> 3] & bit:
+            (code,) = CODE.unpack_from(buffer, position)
+            position += CODE.size
+            if wanted is None or name in wanted:
+                record[name] = dictionaries[i][code]
+            continue
+        if other[i >> 3] & bit or kind == STR:
+            (length,) = LENGTH.unpack_from(buffer, position)
+            start = position + LENGTH.size
+            position = start + length
+            if wanted is None or name in wanted:
+                raw = buffer[start:position]
+                record[name] = orjson.loads(raw) if other[i >> 3] & bit else str(raw, "utf-8")
+            continue
+        if kind == INT:
+            (value,) = INT64.unpack_from(buffer, position)
+            position += INT64.size
+        elif kind == FLOAT:
+            (value,) = FLOAT64.unpack_from(buffer, position)
+            position += FLOAT64.size
+        else:
+            (value,) = BOOL8.unpack_from(buffer, position)
+            position += BOOL8.size
+        if wanted is None or name in wanted:
+            record[name] = value
+    return record
+
+
+def pad(file, alignment):
+    file.write(b"\0" * (-file.tell() % alignment))
+
+
+def write_segment(path, records, schema=(), codec=DEFAULT_CODEC):
+    """
+    Writes ``records`` to a segment file at ``path`` and syncs it.
+
+    Records are packed into slotted pages of up to ``PAGE_SIZE`` bytes: a slot
+    count, the slot array growing from the front and the records from the
+    back. A record larger than a page gets a page of its own. Each page is
+    compressed on its own with ``codec``, so reading a record inflates only
+    its page. String columns with few distinct values are dictionary-encoded,
+    their dictionaries stored once after the column headers. A page
+    directory and, when every id is an integer, a sorted id index follow the
+    pages. The directory holds a CRC32 of every stored page, which
+    ``Segment`` checks the first time it reads the page.
+    """
+    columns = segment_columns(records, schema)
+    dictionaries = build_dictionaries(records, columns)
+    codes = {i: {value: code for code, value in enumerate(values)} for i, values in dictionaries.items()}
+    page_offsets = []
+    first_rows = []
+    checksums = []
+    lengths = []
+
+    with open(path, "wb") as file:
+        file.write(b"\0" * SEGMENT_HEADER.size)
+        for name, kind in columns:
+            data = name.encode()
+            file.write(COLUMN_HEADER.pack(kind, len(data)) + data)
+        file.write(CODEC_HEADER.pack(codec) + LENGTH.pack(len(dictionaries)))
+        for i, values in dictionaries.items():
+            file.write(DICTIONARY_HEADER.pack(i, len(values)))
+            for value in values:
+                data = value.encode()
+                file.write(LENGTH.pack(len(data)) + data)
+
+        def write_page(first_row, page):
+            end = PAGE_HEADER.size + sum(SLOT.size + len(data) for data in page)
+            slots = []
+            for data in page:
+                end -= len(data)
+                slots.append(SLOT.pack(end, len(data)))
+            data = compress(codec, PAGE_HEADER.pack(len(page)) + b"".join(slots) + b"".join(reversed(page)))
+
+            page_offsets.append(file.tell())
+            first_rows.append(first_row)
+            checksums.append(zlib.crc32(data))
+            lengths.append(len(data))
+            file.write(data)
+
+        page = []
+        first_row = 0
+        used = PAGE_HEADER.size
+        for row, record in enumerate(records):
+            data = encode_record(record, columns, codes)
+            if page and used + SLOT.size + len(data) > PAGE_SIZE:
+                write_page(first_row, page)
+                page = []
+                first_row = row
+                used = PAGE_HEADER.size
+            page.append(data)
+            used += SLOT.size + len(data)
+        if page:
+            write_page(first_row, page)
+
+        pad(file, 8)
+        directory = file.tell()
+        file.write(struct.pack(f"<{len(page_offsets)}Q", *page_offsets))
+        file.write(struct.pack(f"<{len(first_rows)}I", *first_rows))
+        file.write(struct.pack(f"<{len(checksums)}I", *checksums))
+        file.write(struct.pack(f"<{len(lengths)}I", *lengths))
+
+        id_index = 0
+        ids = [record.get("id") for record in records]
+        if ids and all(value_type(record_id) == INT for record_id in ids):
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            pad(file, 8)
+            id_index = file.tell()
+            file.write(struct.pack(f"<{len(ids)}q", *(ids[row] for row in order)))
+            file.write(struct.pack(f"<{len(ids)}I", *order))
+
+        file.seek(0)
+        file.write(SEGMENT_HEADER.pack(
+            SEGMENT_MAGIC, 3, len(columns), len(records), len(page_offsets), directory, id_index,
+        ))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class PackedArray:
+    """Read-only sequence over fixed-width numbers in a buffer, unpacked only as they are indexed."""
+
+    def __init__(self, buffer, offset, count, fmt):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.item = struct.Struct(fmt)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.item.unpack_from(self.buffer, self.offset + i * self.item.size)[0]
+
+
+class Segment:
+    """
+    A segment file written by ``write_segment``, memory-mapped for reading.
+
+    Reading one record touches only its page's slot and the record's own
+    bytes; strings are decoded straight from the mapping and numbers are
+    unpacked in place. Pages of compressed (version 3) segments are inflated
+    one at a time, and the last few a point read needed are kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, version, column_count, self.rows, page_count, directory, id_index = SEGMENT_HEADER.unpack_from(self.map, 0)
+        if magic != SEGMENT_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a segment file")
+
+        self.columns = []
+        offset = SEGMENT_HEADER.size
+        for _ in range(column_count):
+            kind, length = COLUMN_HEADER.unpack_from(self.map, offset)
+            offset += COLUMN_HEADER.size
+            self.columns.append((str(self.view[offset:offset + length], "utf-8"), kind))
+            offset += length
+
+        # Before version 3 pages are stored uncompressed, aligned to PAGE_SIZE.
+        self.codec = None
+        self.dictionaries = {}
+        self.pages = {}
+        if version >= 3:
+            (self.codec,) = CODEC_HEADER.unpack_from(self.map, offset)
+            (count,) = LENGTH.unpack_from(self.map, offset + CODEC_HEADER.size)
+            offset += CODEC_HEADER.size + LENGTH.size
+            for _ in range(count):
+                column, entries = DICTIONARY_HEADER.unpack_from(self.map, offset)
+                offset += DICTIONARY_HEADER.size
+                values = []
+                for _ in range(entries):
+                    (length,) = LENGTH.unpack_from(self.map, offset)
+                    offset += LENGTH.size
+                    values.append(str(self.view[offset:offset + length], "utf-8"))
+                    offset += length
+                self.dictionaries[column] = values
+            missing = {ZSTD: (zstandard, "zstandard"), LZ4: (lz4, "lz4")}
+            if self.codec in missing and missing[self.codec][0] is None:
+                self.close()
+                raise ValueError(
+                    f"{path} is compressed with {CODEC_NAMES[self.codec]}; install the {missing[self.codec][1]} package to read it"
+                )
+
+        self.page_offsets = PackedArray(self.map, directory, page_count, "<Q")
+        self.first_rows = PackedArray(self.map, directory + 8 * page_count, page_count, "<I")
+        # Version 1 segments have no page checksums.
+        self.directory = directory
+        self.checksums = self.lengths = None
+        if version >= 2:
+            self.checksums = PackedArray(self.map, directory + 12 * page_count, page_count, "<I")
+            self.verified = bytearray(page_count)
+        if version >= 3:
+            self.lengths = PackedArray(self.map, directory + 16 * page_count, page_count, "<I")
+        # Columns materialized by ``columnar``; the file never changes, so they never go stale.
+        self.column_cache = {}
+        self.ids = self.id_rows = None
+        if id_index:
+            self.ids = PackedArray(self.map, id_index, self.rows, "<q")
+            self.id_rows = PackedArray(self.map, id_index + 8 * self.rows, self.rows, "<I")
+
+    def __len__(self):
+        return self.rows
+
+    def page_range(self, page):
+        start = self.page_offsets[page]
+        if self.lengths is not None:
+            return start, start + self.lengths[page]
+        return start, self.page_offsets[page + 1] if page + 1 < len(self.page_offsets) else self.directory
+
+    def verify(self, page):
+        """Checks a page against its checksum, once; a mismatch raises rather than returning damaged rows."""
+        start, end = self.page_range(page)
+        if zlib.crc32(self.view[start:end]) != self.checksums[page]:
+            raise ValueError(f"{self.path}: page {page} is corrupt (checksum mismatch)")
+        self.verified[page] = 1
+
+    def read_page(self, page):
+        """Returns the buffer holding page ``page`` and the page's offset in it."""
+        if self.checksums is not None and not self.verified[page]:
+            self.verify(page)
+        if self.codec in (None, RAW):
+            return self.view, self.page_offsets[page]
+        start, end = self.page_range(page)
+        return memoryview(decompress(self.codec, self.view[start:end])), 0
+
+    def cached_page(self, page):
+        if self.codec in (None, RAW):
+            return self.read_page(page)
+        found = self.pages.get(page)
+        if found is None:
+            found = self.read_page(page)
+            if len(self.pages) >= PAGE_CACHE:
+                self.pages.clear()
+            self.pages[page] = found
+        return found
+
+    def locate(self, row):
+        """Returns the buffer holding row number ``row`` and the row's offset in it."""
+        page = bisect_right(self.first_rows, row) - 1
+        buffer, page_offset = self.cached_page(page)
+        slot = page_offset + PAGE_HEADER.size + (row - self.first_rows[page]) * SLOT.size
+        start, _length = SLOT.unpack_from(buffer, slot)
+        return buffer, page_offset + start
+
+    def record(self, row, wanted=None):
+        """Decodes row number ``row``, or only its ``wanted`` columns."""
+        buffer, offset = self.locate(row)
+        return decode_record(buffer, offset, self.columns, wanted, self.dictionaries)
+
+    def __iter__(self):
+        return self.scan()
+
+    def scan(self, wanted=None):
+        """Yields every row in order, or only its ``wanted`` columns."""
+        for i in range(len(self.page_offsets)):
+            buffer, page_offset = self.read_page(i)
+            (count,) = PAGE_HEADER.unpack_from(buffer, page_offset)
+            for slot in range(count):
+                start, _length = SLOT.unpack_from(buffer, page_offset + PAGE_HEADER.size + slot * SLOT.size)
+                yield decode_record(buffer, page_offset + start, self.columns, wanted, self.dictionaries)
+
+    def find(self, record_id):
+        """Returns the record with ``record_id``, or ``None``; uses the id index when there is one."""
+        if self.ids is not None:
+            if value_type(record_id) != INT:
+                return None
+            i = bisect_left(self.ids, record_id)
+            if i < self.rows and self.ids[i] == record_id:
+                return self.record(self.id_rows[i])
+            return None
+
+        for row in range(self.rows):
+            if self.record(row, ("id",)).get("id") == record_id:
+                return self.record(row)
+        return None
+
+    def close(self):
+        self.pages = {}
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # A decoded value still references the mapping; it is unmapped once that is collected.
+            pass
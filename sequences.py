@@ -0,0 +1,65 @@
+import threading
+
+
+class SequenceAllocator:
+    """
+    Per-table monotonic id sequences handed out from leased blocks.
+
+    Only the upper bound of each table's current lease is persisted (through
+    ``save``, which ``ElementalDB`` points at ``save_map``), so ids cost one map
+    write per ``block_size`` allocations. After a restart allocation resumes at
+    the persisted bound: ids leased but never used are skipped, never reused.
+
+    When several processes share the map, ``claim`` replaces ``save``: it is
+    called as ``claim(table, held, start, end)`` with the lease this process
+    holds and must persist ``end`` as the new lease, first moving the block past
+    any lease another process took after ``held``. It returns the moved start.
+    """
+
+    def __init__(self, leases=None, block_size=1000, save=None, first_id=None, claim=None):
+        self.leases = dict(leases or {})
+        self.block_size = block_size
+        self.save = save
+        # Called once for a table without a lease, to start above its existing ids.
+        self.first_id = first_id
+        self.claim = claim
+        self.next = {}
+        self.lock = threading.Lock()
+
+    def allocate(self, table_name, count=1):
+        """Reserves ``count`` consecutive ids for ``table_name`` and returns them as a range."""
+        with self.lock:
+            start = self.reserve(table_name, self.current(table_name), count)
+            return range(start, start + count)
+
+    def observe(self, table_name, record_id):
+        """Moves the sequence past an id the caller chose itself, so it is never handed out again."""
+        if not isinstance(record_id, int) or isinstance(record_id, bool):
+            return
+        with self.lock:
+            if record_id >= self.current(table_name):
+                self.reserve(table_name, record_id + 1, 0)
+
+    def current(self, table_name):
+        if table_name not in self.next:
+            if table_name in self.leases:
+                self.next[table_name] = self.leases[table_name]
+            else:
+                self.next[table_name] = self.first_id(table_name) if self.first_id else 1
+                self.leases[table_name] = self.next[table_name]
+        return self.next[table_name]
+
+    def reserve(self, table_name, start, count):
+        """Takes ``count`` ids from ``start`` on, leasing a new block if needed; returns the first id taken."""
+        end = start + count
+        if end > self.leases[table_name]:
+            if self.claim:
+                moved = self.claim(table_name, self.leases[table_name], start, end + self.block_size)
+                start, end = moved, moved + count
+                self.leases[table_name] = end + self.block_size
+            else:
+                self.leases[table_name] = end + self.block_size
+                if self.save:
+                    self.save()
+        self.next[table_name] = end
+        return start
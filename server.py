@@ -1,27 +1,94 @@
-from fastapi import FastAPI, HTTPException
-from typing import List, Dict, Optional
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Any, AsyncIterator, List, Dict, Literal, Optional
+import argparse
+import base64
+import binascii
+import orjson
+import os
 import uvicorn
-from ElementalDB import ElementalDB
+import wire
 from pydantic import BaseModel
 from auth import (
-    get_password_hash,
+    hash_password,
     authenticate_user,
     create_access_token,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     Token,
     User,
-    get_current_user
+    UserCreate,
+    USERS_TABLE,
+    get_current_user,
+    oauth2_scheme,
+    db
 )
 from datetime import timedelta
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, Depends, oauth2
+from fastapi.security import OAuth2PasswordRequestForm
 from http import HTTPStatus
-# Initialize FastAPI and the ElementalDB instance
+# Initialize FastAPI; the ElementalDB instance is shared with auth so both see the same tables
 app = FastAPI()
 auth_enabled = True
-db = ElementalDB('database', auth=auth_enabled)  # Initialize the database
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+# Rows serialized per chunk of a streamed NDJSON response
+STREAM_CHUNK_ROWS = 256
+
+def encode_cursor(record_id: Any) -> str:
+    """
+    Builds the opaque continuation token pointing just past ``record_id``.
+
+    Args:
+        record_id (Any): The id of the last row of a page.
+
+    Returns:
+        str: A URL-safe token to pass back as ``cursor``.
+    """
+    return base64.urlsafe_b64encode(orjson.dumps({"after": record_id})).decode()
+
+def respond(request: Request, payload: Any) -> Response:
+    """
+    Encodes a response in the format the client asked for.
+
+    The body is JSON unless the ``Accept`` header weighs the columnar or msgpack
+    encoding highest (see ``wire.negotiate``). Bodies of at least
+    ``wire.COMPRESS_MIN_BYTES`` are compressed with zstd or gzip, whichever
+    ``Accept-Encoding`` weighs highest, unless it refuses both.
+
+    Args:
+        request (Request): The request being answered.
+        payload (Any): The response data.
+
+    Returns:
+        Response: The encoded and possibly compressed response.
+    """
+    media_type = wire.negotiate(request.headers.get("accept"))
+    body = wire.encode(payload, media_type)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    coding = wire.choose_compression(request.headers.get("accept-encoding"))
+    if coding is not None and len(body) >= wire.COMPRESS_MIN_BYTES:
+        body = wire.compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return Response(body, media_type=media_type, headers=headers)
+
+def decode_cursor(cursor: str) -> Any:
+    """
+    Reads the id a continuation token points past.
+
+    Raises:
+        HTTPException: If the token was not produced by ``encode_cursor``.
+    """
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(cursor.encode()))["after"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.on_event("shutdown")
+def close_db():
+    db.close()
 
 @app.post("/signup")
-async def signup(user: User):
+async def signup(user: UserCreate):
     """
     Create a new user account.
 
@@ -36,25 +103,23 @@ async def signup(user: User):
     """
 
     # Checks if user already exists
-    existing_users = await db.get("USERS", filters={"username": user.username})
-    if existing_users:
+    existing_user = await db.get(USERS_TABLE, "username", user.username)
+    if existing_user is not None:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     user_record = {
         "username": user.username,
-        "password": hashed_password,
+        "hashed_password": hashed_password,
         "role": "user"
     }
 
     try: 
-        await db.add("USERS", user_record)
-        created_users = await db.get("USERS", filters={"username": user.username})
-        if not created_users:
+        await db.add(USERS_TABLE, user_record)
+        created_user = await db.get(USERS_TABLE, "username", user.username)
+        if created_user is None:
             raise HTTPException(status_code=400, detail="Error retrieving created user")
 
-        created_user = created_users[0]
-
         return User(id=created_user['id'], username=created_user['username'], role=created_user['role'])
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -121,26 +186,72 @@ async def add_item(table_name: str, columns: List[str], values: List[str], token
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/get/{table_name}")
-async def get_items(table_name: str):
+async def get_items(
+    request: Request,
+    table_name: str,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    token: str = Depends(oauth2_scheme),
+):
     """
-    Retrieve all items from a specified table in the database.
+    Retrieve the items of a table one page at a time, or stream all of them.
+
+    Rows come in id order. A page is returned as ``{"items": [...], "next_cursor": ...}``;
+    pass ``next_cursor`` back as ``cursor`` to get the next page, until it is ``null``.
+    With ``stream=true`` every row after ``cursor`` is sent as newline-delimited
+    JSON, serialized (and compressed, if the client accepts it) chunk by chunk
+    as it is read, so memory stays flat however large the table is.
 
     Args:
         table_name (str): The name of the table from which to retrieve items.
+        page_size (int): The maximum number of items per page.
+        cursor (str, optional): The continuation token of the previous page.
+        stream (bool): Stream the rows as NDJSON instead of returning one page.
 
     Returns:
-        list: A list of items in the specified table.
+        Response: A page of items encoded as negotiated by ``respond``, or an NDJSON stream.
 
     Raises:
-        HTTPException: If the table does not exist or if an error occurs during retrieval.
+        HTTPException: If the token is invalid, the table does not exist or is the
+            user table, or the cursor is invalid.
     """
-    try:
-        items = await db.get(table_name)
-        if not items:
-            raise HTTPException(status_code=404, detail="Table not found or is empty")
-        return items
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=str(e))
+    await get_current_user(token)
+    # The user table holds password hashes; it is only read through /login.
+    if table_name == USERS_TABLE:
+        raise HTTPException(status_code=403, detail="The user table cannot be read")
+    if db.schema_for(table_name) is None:
+        raise HTTPException(status_code=404, detail="Table not found")
+
+    filters = {"id": {"gt": decode_cursor(cursor)}} if cursor is not None else None
+
+    if stream:
+        coding = wire.choose_compression(request.headers.get("accept-encoding"))
+        compressor = wire.StreamCompressor(coding) if coding is not None else None
+
+        async def ndjson() -> AsyncIterator[bytes]:
+            chunk = []
+            async for record in db.query(table_name, filters, order_by="id"):
+                chunk.append(orjson.dumps(record))
+                if len(chunk) >= STREAM_CHUNK_ROWS:
+                    data = b"\n".join(chunk) + b"\n"
+                    yield compressor.compress(data) if compressor else data
+                    chunk = []
+            if chunk:
+                data = b"\n".join(chunk) + b"\n"
+                yield compressor.compress(data) if compressor else data
+            if compressor:
+                yield compressor.finish()
+
+        headers = {"Vary": "Accept-Encoding"}
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
+
+    # One extra row tells whether another page follows.
+    items = [record async for record in db.query(table_name, filters, order_by="id", limit=page_size + 1)]
+    next_cursor = encode_cursor(items[page_size - 1]["id"]) if len(items) > page_size else None
+    return respond(request, {"items": items[:page_size], "next_cursor": next_cursor})
 
 @app.delete("/delete/{table_name}/{id}")
 async def delete_item(table_name: str, id: int, token: str = Depends(oauth2_scheme), auth_enabled: bool = auth_enabled):
@@ -195,5 +306,57 @@ async def update_item(table_name: str, row_id: int, updates: Dict[str, str], tok
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+class Operation(BaseModel):
+    op: Literal["add", "update", "delete", "get"]
+    table: str
+    record: Optional[Any] = None
+    id: Optional[Any] = None
+    changes: Optional[Dict[str, Any]] = None
+    filters: Optional[Dict[str, Any]] = None
+
+class BatchRequest(BaseModel):
+    operations: List[Operation]
+
+@app.post("/batch")
+async def batch(request: BatchRequest, http_request: Request, token: str = Depends(oauth2_scheme)):
+    """
+    Run a list of mixed add/update/delete/get operations in one request.
+
+    Operations run in order, and the writes to each table are stored as a
+    single log write, so one round-trip can carry a whole ingest batch.
+
+    Args:
+        request (BatchRequest): The operations, each naming its ``op`` and ``table``.
+
+    Returns:
+        dict: ``{"results": [...]}`` with one entry per operation: ``{"id": ...}``
+        for adds, ``{"updated": bool}``, ``{"deleted": bool}`` or ``{"items": [...]}``.
+
+    Raises:
+        HTTPException: If the token is invalid, or an operation is; in that case nothing is written.
+    """
+    await get_current_user(token)
+    if any(operation.table == USERS_TABLE for operation in request.operations):
+        raise HTTPException(status_code=403, detail="The user table cannot be accessed through /batch")
+
+    operations = [operation.model_dump(exclude_unset=True) for operation in request.operations]
+    try:
+        results = await db.batch(operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return respond(http_request, {"results": results})
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    parser = argparse.ArgumentParser(description="Serve an ElementalDB database over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes; more than one opens the database in shared mode")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Read by auth.py in every worker before it opens the database.
+        os.environ["ELEMENTALDB_SHARED"] = "1"
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
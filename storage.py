@@ -0,0 +1,1110 @@
+import contextlib
+import glob
+import heapq
+import itertools
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_left
+from collections.abc import Mapping
+import orjson
+from btree import BTree, in_range, index_key, range_keys, sort_key
+from rowformat import Segment, write_segment
+from locking import FileLock
+from durability import sync_directory, write_file
+from views import MaterializedView
+
+# Every frame of a legacy log (and legacy segment) is a little-endian u32 payload length followed by an orjson payload.
+FRAME_HEADER = struct.Struct("<I")
+# Logs now start with this marker, and each frame carries the CRC32 of its payload after the length.
+WAL_MAGIC = b"EDBLOG2\n"
+WAL_FRAME_HEADER = struct.Struct("<II")
+
+# Undo entry for a record that was not in the overlay before a write.
+ABSENT = object()
+
+
+class WriteAheadLog:
+    """
+    Append-only mutation log made of length-prefixed, checksummed orjson frames.
+
+    ``append`` writes a whole batch of entries with a single ``write`` and
+    ``fsync``, so callers get group commit by batching their entries. An
+    ``atomic`` batch goes into one frame holding the list of entries, so a
+    crash leaves all of them or none. Reading stops at the first frame that
+    is cut short or fails its checksum: that is where a crash interrupted
+    the last write, and ``TableStore.load`` truncates the log there.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab")
+        # Whether frames carry checksums; known on the first append. Logs of older versions do not.
+        self.checksummed = None
+
+    def append(self, entries, atomic=False):
+        created = False
+        if self.checksummed is None:
+            if self.size() == 0:
+                self.file.write(WAL_MAGIC)
+                self.checksummed = created = True
+            else:
+                with open(self.path, "rb") as file:
+                    self.checksummed = file.read(len(WAL_MAGIC)) == WAL_MAGIC
+
+        frames = []
+        for entry in ([entries] if atomic else entries):
+            payload = orjson.dumps(entry)
+            if self.checksummed:
+                frames.append(WAL_FRAME_HEADER.pack(len(payload), zlib.crc32(payload)))
+            else:
+                frames.append(FRAME_HEADER.pack(len(payload)))
+            frames.append(payload)
+        self.file.write(b"".join(frames))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if created:
+            # A new log (e.g. after rotation) is lost in a crash unless its directory entry is synced too.
+            sync_directory(os.path.dirname(self.path))
+
+    def size(self):
+        # fstat rather than tell(): in shared mode other processes append to the same file.
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    @staticmethod
+    def replay(path):
+        """
+        Yields the entries stored in the log at ``path``.
+
+        A frame cut short by a crash ends the replay; everything before it is kept.
+        """
+        yield from WriteAheadLog.read_from(path)[0]
+
+    @staticmethod
+    def read_from(path, offset=0):
+        """Returns the intact entries stored from byte ``offset`` on, and the offset just past them."""
+        try:
+            with open(path, "rb") as file:
+                head = file.read(len(WAL_MAGIC))
+                if head == WAL_MAGIC:
+                    header = WAL_FRAME_HEADER
+                    offset = max(offset, len(WAL_MAGIC))
+                elif WAL_MAGIC.startswith(head):
+                    # Empty, or a crash cut off the marker of a new log.
+                    return [], offset
+                else:
+                    header = FRAME_HEADER
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return [], offset
+
+        entries = []
+        position = 0
+        view = memoryview(data)
+        while position + header.size <= len(data):
+            if header is WAL_FRAME_HEADER:
+                length, checksum = header.unpack_from(data, position)
+            else:
+                (length,) = header.unpack_from(data, position)
+                checksum = None
+            start = position + header.size
+            if start + length > len(data):
+                break
+            payload = view[start:start + length]
+            if checksum is not None and zlib.crc32(payload) != checksum:
+                break
+            try:
+                entry = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                break
+            if isinstance(entry, list):
+                entries.extend(entry)
+            else:
+                entries.append(entry)
+            position = start + length
+        return entries, offset + position
+
+
+def merge_records(records, overlay):
+    """
+    Applies an ``{id: record}`` overlay (``None`` marks a delete) on top of ``records``.
+
+    Rewritten records keep their position, new ones are appended in insertion order.
+    Overlay records are yielded as copies, so callers changing them cannot
+    change the table behind its log.
+    """
+    seen = set()
+    for record in records:
+        record_id = record.get("id")
+        if record_id in overlay:
+            seen.add(record_id)
+            record = overlay[record_id]
+            if record is None:
+                continue
+            record = dict(record)
+        yield record
+
+    for record_id, record in overlay.items():
+        if record_id not in seen and record is not None:
+            yield dict(record)
+
+
+class SnapshotOverlay(Mapping):
+    """
+    Read-only view of the active overlay as it was at log sequence number ``lsn``.
+
+    Writers keep changing the overlay; the view sees the values from before
+    those writes through the store's undo versions, and only the ids that
+    were present at ``lsn`` (the first ``count`` of the store's ``order``).
+    """
+
+    def __init__(self, overlay, order, undo, lsn):
+        self.overlay = overlay
+        self.order = order
+        self.count = len(order)
+        self.undo = undo
+        self.lsn = lsn
+
+    def __getitem__(self, record_id):
+        versions = self.undo.get(record_id)
+        if versions:
+            for lsn, previous in versions:
+                if lsn > self.lsn:
+                    if previous is ABSENT:
+                        raise KeyError(record_id)
+                    return previous
+        return self.overlay[record_id]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.order[i]
+
+    def __len__(self):
+        return self.count
+
+
+class Snapshot:
+    """
+    A table as of one log sequence number, for reads that must not see later writes.
+
+    Taking one costs a lock acquisition: nothing is copied, and writers go on
+    without waiting for it. ``close`` it when done; until then replaced segments
+    and undo versions are kept for it. It offers the store's read methods
+    (``scan``, ``scan_by_id``, ``find_many``, ``lookup``, ``between``), so a
+    ``query.Query`` can run against it.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.active, self.frozen, self.partitions = store.pin()
+        self.lsn = self.active.lsn
+        self.closed = False
+
+    @property
+    def indexes(self):
+        # After another process's compaction reloaded the store, the current indexes
+        # cannot be corrected back to the snapshot, so queries scan it instead.
+        return self.store.indexes if self.lsn >= self.store.reloaded_lsn else {}
+
+    def scan(self, ranges=None):
+        return self.store.scan(ranges, self)
+
+    def scan_by_id(self, low=None):
+        return self.store.scan_by_id(low, self)
+
+    def find_many(self, record_ids):
+        return self.store.find_many(record_ids, self)
+
+    def find(self, record_id):
+        found = self.find_many([record_id])
+        return found[0] if found else None
+
+    def changed_ids(self):
+        """Returns the ids written since the snapshot was taken."""
+        with self.store.lock:
+            return {record_id for record_id, lsn in self.store.modified.items() if lsn > self.lsn}
+
+    def between(self, column, low=None, high=None):
+        """Index range lookup as of the snapshot: the current index, corrected for records written since."""
+        low_key, high_key = range_keys(low, high)
+        with self.store.lock:
+            keys = [tuple(key) for key in self.store.indexes[column].range(low_key, high_key)]
+            changed = self.changed_ids()
+        if not changed:
+            return [key[-1] for key in keys]
+
+        keys = [key for key in keys if key[-1] not in changed]
+        restored = sorted(
+            index_key(record.get(column), record["id"])
+            for record in self.find_many(list(changed))
+            if in_range(record.get(column), low, high)
+        )
+        return [key[-1] for key in heapq.merge(keys, restored)]
+
+    def lookup(self, column, value):
+        return self.between(column, value, value)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.store.unpin()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_frame(file):
+    # Segments written before the binary row format hold one frame with the whole partition.
+    header = file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    return orjson.loads(file.read(length))
+
+
+def file_stamp(path, content=False):
+    """Identifies the file at ``path`` (and, with ``content``, its version) to notice when it is replaced."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if content:
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return (stat.st_dev, stat.st_ino)
+
+
+def column_stats(records):
+    """
+    Returns per-column ``(min, max)`` dicts for a partition's zone map.
+
+    A column missing from some rows reads as ``None`` there, so its minimum is ``None``.
+    """
+    lows, highs, present = {}, {}, {}
+    for record in records:
+        for column, value in record.items():
+            key = sort_key(value)
+            if column not in lows:
+                lows[column] = highs[column] = (key, value)
+                present[column] = 1
+                continue
+            present[column] += 1
+            if key < lows[column][0]:
+                lows[column] = (key, value)
+            elif key > highs[column][0]:
+                highs[column] = (key, value)
+
+    mins = {column: (None if present[column] < len(records) else low[1]) for column, low in lows.items()}
+    maxs = {column: high[1] for column, high in highs.items()}
+    return mins, maxs
+
+
+def partition_matches(partition, ranges):
+    """Tells whether a partition's zone map overlaps every ``{column: (low, high)}`` range."""
+    for column, (low, high) in ranges.items():
+        low_key, high_key = range_keys(low, high)
+        smallest = sort_key(partition["min"].get(column))
+        largest = sort_key(partition["max"].get(column))
+        if high_key is not None and smallest >= high_key:
+            return False
+        if low_key is not None and largest < low_key:
+            return False
+    return True
+
+
+def partition_holds_any(partition, id_keys):
+    """Tells whether any of the sorted ``id_keys`` falls within the partition's id range."""
+    i = bisect_left(id_keys, sort_key(partition["min"].get("id")))
+    return i < len(id_keys) and id_keys[i] <= sort_key(partition["max"].get("id"))
+
+
+class TableStore:
+    """
+    Log-structured storage for a single table.
+
+    Mutations are appended to ``<table>.wal`` and kept in an in-memory overlay.
+    Once the log outgrows ``compact_threshold`` bytes it is rotated to
+    ``<table>.wal.old`` and a background thread folds it into the table's
+    segment files, ``<table>.<n>.seg``.
+
+    Each segment is a row-range partition of at most ``partition_rows`` rows,
+    stored in the binary page format of ``rowformat`` with column types taken
+    from the table ``schema``, compressed page by page and memory-mapped for
+    reading. Segments written before that format are whole-partition JSON
+    frames and are still read.
+    ``<table>.manifest`` lists them in row order together with a min/max zone
+    map per column, so reads skip partitions that cannot match. Compaction
+    only rewrites the partitions the overlay touches, and the manifest is
+    replaced atomically once the new segments are on disk.
+
+    Every log entry carries a log sequence number (LSN) and the record's
+    previous version, so B-tree indexes checkpointed at some LSN can be
+    brought up to date by replaying only the entries after it. Materialized
+    views (``views.MaterializedView``) are maintained from the same entries
+    and checkpointed to ``<table>.<view>.view`` in the same way.
+
+    With ``shared=True`` several processes may open the same table. Writers
+    serialize on an ``flock`` of ``<table>.lock`` and first catch up on the
+    log tail written by the others (``refresh``); only one process at a time
+    compacts (``<table>.compacting``); and replaced segments are deleted only
+    while no process holds a shared lock on ``<table>.readers``.
+    """
+
+    def __init__(self, directory, table_name, indexes=(), btree_degree=32,
+                 compact_threshold=4 * 1024 * 1024, partition_rows=4096, schema=(), shared=False, views=None):
+        self.table_name = table_name
+        self.schema = schema
+        self.btree_degree = btree_degree
+        self.compact_threshold = compact_threshold
+        self.partition_rows = partition_rows
+        self.base = os.path.join(directory, table_name)
+        self.wal_path = f"{self.base}.wal"
+        self.old_wal_path = f"{self.base}.wal.old"
+        self.manifest_path = f"{self.base}.manifest"
+
+        self.lock = threading.RLock()
+        self.compactor = None
+        self.readers = 0
+        self.garbage = []
+        self.segments = {}
+        # While snapshots are open: the last LSN that wrote each id, for conflict checks.
+        self.modified = {}
+        # LSN of the last reload from disk; writes it folded into segments are missing from ``modified``.
+        self.reloaded_lsn = 0
+        self.index_columns = list(indexes)
+        # View name -> its query
+        self.view_queries = dict(views or {})
+        self.wal = None
+        # Called with the entries other processes wrote, or None after a full reload.
+        self.on_change = None
+
+        self.shared = shared
+        self.write_lock = self.read_lock = self.compact_lock = None
+        if shared:
+            self.write_lock = FileLock(f"{self.base}.lock")
+            self.read_lock = FileLock(f"{self.base}.readers")
+            self.compact_lock = FileLock(f"{self.base}.compacting")
+
+        with self.lock, self.exclusive():
+            self.remove_orphan_segments()
+            self.load()
+        # A leftover rotated log means the last compaction never finished.
+        if os.path.exists(self.old_wal_path):
+            self.maybe_compact(force=True)
+
+    def exclusive(self):
+        """Holds the cross-process write lock in shared mode; does nothing otherwise."""
+        return self.write_lock if self.write_lock is not None else contextlib.nullcontext()
+
+    def load(self):
+        """Reads the table's state from disk: manifest, index checkpoints and both logs."""
+        self.reset_active()
+        self.frozen = {}
+        self.manifest = self.read_manifest()
+        self.manifest_stamp = file_stamp(self.manifest_path, content=True)
+        self.lsn = self.manifest["lsn"]
+        # Segments another process's compaction replaced are unmapped once no reader can be using them.
+        live = {self.segment_path(partition["segment"]) for partition in self.manifest["partitions"]}
+        self.garbage.extend(path for path in self.segments if path not in live and path not in self.garbage)
+
+        self.indexes = {}
+        self.checkpoints = {}
+        stale = []
+        for column in self.index_columns:
+            try:
+                tree = BTree.open(self.index_path(column))
+            except (OSError, ValueError):
+                tree = None
+            # An index older than the segments misses changes whose log is gone.
+            if tree is None or tree.lsn < self.lsn:
+                stale.append(column)
+            else:
+                self.indexes[column] = tree
+                self.checkpoints[column] = tree.lsn
+
+        self.views = {}
+        self.view_checkpoints = {}
+        stale_views = []
+        for name, query in self.view_queries.items():
+            view = MaterializedView.read(self.view_path(name), name, query)
+            if view is None or view.lsn < self.lsn:
+                stale_views.append(name)
+            else:
+                self.views[name] = view
+                self.view_checkpoints[name] = view.lsn
+
+        # Rotated but not yet compacted, by this process before a crash or by another one right now.
+        for entry in WriteAheadLog.replay(self.old_wal_path):
+            self.apply(self.frozen, entry)
+        self.frozen_lsn = self.lsn
+        entries, self.wal_offset = WriteAheadLog.read_from(self.wal_path)
+        for entry in entries:
+            self.apply(self.active, entry)
+
+        if self.wal is not None:
+            self.wal.close()
+        self.truncate_torn_tail()
+        self.wal = WriteAheadLog(self.wal_path)
+        self.wal_stamp = file_stamp(self.wal_path)
+
+        for column in stale:
+            self.create_index(column)
+        for name in stale_views:
+            self.create_view(name, self.view_queries[name])
+        self.reloaded_lsn = self.lsn
+
+    def truncate_torn_tail(self):
+        """
+        Cuts the log back to its last intact frame, dropping what a crash left half written.
+
+        Otherwise new frames would be appended after the damaged one, where no
+        replay could reach them. Called from ``load``, under the write lock.
+        """
+        try:
+            size = os.path.getsize(self.wal_path)
+        except FileNotFoundError:
+            return
+        if size > self.wal_offset:
+            with open(self.wal_path, "r+b") as file:
+                file.truncate(self.wal_offset)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def reset_active(self):
+        self.active = {}
+        # Ids of the active overlay in insertion order, and the versions open snapshots may still need.
+        self.order = []
+        self.undo = {}
+
+    def changed_elsewhere(self):
+        """Tells, from two ``stat`` calls, whether another process has written the table since the last refresh."""
+        if not self.shared:
+            return False
+        try:
+            size = os.stat(self.wal_path).st_size
+        except FileNotFoundError:
+            return True
+        return (
+            size != self.wal_offset
+            or file_stamp(self.wal_path) != self.wal_stamp
+            or file_stamp(self.manifest_path, content=True) != self.manifest_stamp
+        )
+
+    def refresh(self):
+        """
+        Catches up with writes other processes made to a shared table.
+
+        New log entries are applied to the overlay; a rotated log or a new
+        manifest (another process compacted) reloads the table from disk.
+        """
+        if not self.shared:
+            return
+        with self.lock:
+            if (file_stamp(self.wal_path) != self.wal_stamp
+                    or file_stamp(self.manifest_path, content=True) != self.manifest_stamp):
+                with self.exclusive():
+                    self.load()
+                if self.on_change is not None:
+                    self.on_change(None)
+                return
+
+            entries, self.wal_offset = WriteAheadLog.read_from(self.wal_path, self.wal_offset)
+            for entry in entries:
+                self.apply(self.active, entry)
+            if entries and self.on_change is not None:
+                self.on_change(entries)
+
+    def index_path(self, column):
+        return f"{self.base}.{column}.idx"
+
+    def view_path(self, name):
+        return f"{self.base}.{name}.view"
+
+    def segment_path(self, segment):
+        return f"{self.base}.{segment}.seg"
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, "rb") as file:
+                return orjson.loads(file.read())
+        except FileNotFoundError:
+            return {"lsn": 0, "next_segment": 1, "partitions": []}
+
+    def write_manifest(self, manifest):
+        write_file(self.manifest_path, orjson.dumps(manifest))
+
+    def remove_orphan_segments(self):
+        """Deletes segments written by a compaction that crashed before switching the manifest."""
+        if self.shared:
+            # Segments missing from the manifest may be another process's compaction output,
+            # or replaced segments its readers still use.
+            if not self.claim_compaction():
+                return
+            try:
+                if not self.read_lock.acquire(blocking=False):
+                    return
+                try:
+                    self.remove_unlisted_segments()
+                finally:
+                    self.read_lock.release()
+            finally:
+                self.release_compaction()
+        else:
+            self.remove_unlisted_segments()
+
+    def remove_unlisted_segments(self):
+        live = {
+            self.segment_path(partition["segment"])
+            for partition in self.read_manifest()["partitions"]
+        }
+        for path in glob.glob(f"{glob.escape(self.base)}.*.seg"):
+            if path not in live:
+                os.remove(path)
+
+    def open_segment(self, partition):
+        """Returns the memory-mapped segment of a binary partition, mapping it on first use."""
+        path = self.segment_path(partition["segment"])
+        with self.lock:
+            if path not in self.segments:
+                self.segments[path] = Segment(path)
+            return self.segments[path]
+
+    def remove_segment(self, path):
+        segment = self.segments.pop(path, None)
+        if segment is not None:
+            segment.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def read_partition(self, partition):
+        """Returns an iterable over a partition's records, decoded as they are reached."""
+        if partition.get("format") == "rows":
+            return self.open_segment(partition)
+        with open(self.segment_path(partition["segment"]), "rb") as file:
+            return read_frame(file)
+
+    def write_partition(self, manifest, records):
+        segment = manifest["next_segment"]
+        manifest["next_segment"] += 1
+        write_segment(self.segment_path(segment), records, self.schema)
+        mins, maxs = column_stats(records)
+        return {"segment": segment, "format": "rows", "rows": len(records), "min": mins, "max": maxs}
+
+    def apply(self, overlay, entry):
+        record_id = entry["id"]
+        if overlay is self.active:
+            previous = overlay.get(record_id, ABSENT)
+            if previous is ABSENT:
+                self.order.append(record_id)
+            if self.readers:
+                self.undo.setdefault(record_id, []).append((entry["lsn"], previous))
+                self.modified[record_id] = entry["lsn"]
+        overlay[record_id] = entry.get("record")
+        self.lsn = max(self.lsn, entry["lsn"])
+
+        old = entry.get("old")
+        record = entry.get("record")
+        for column, tree in self.indexes.items():
+            if entry["lsn"] <= tree.lsn:
+                continue
+            if old is not None:
+                tree.remove(index_key(old.get(column), record_id))
+            if record is not None:
+                tree.insert(index_key(record.get(column), record_id))
+        for view in self.views.values():
+            if entry["lsn"] > view.lsn:
+                view.apply(old, record)
+                view.lsn = entry["lsn"]
+
+    def log(self, entries, atomic=False):
+        """Appends ``entries`` to the log with one write and fsync, then applies them."""
+        with self.lock, self.exclusive():
+            self.refresh()
+            for entry in entries:
+                self.lsn += 1
+                entry["lsn"] = self.lsn
+            self.wal.append(entries, atomic)
+            for entry in entries:
+                self.apply(self.active, entry)
+            self.wal_offset = self.wal.size()
+        self.maybe_compact()
+
+    def apply_batch(self, ops, atomic=False):
+        """
+        Applies a batch of operations as one durable log write and returns a result per op.
+
+        Supported operations are ``("put", record, old)``, ``("update", id, changes)``
+        and ``("delete", id, old)``; a delete with ``old=None`` looks the record up.
+        Updates and deletes return the record they replaced, or ``None`` when no
+        record has that id. Callers must not run two batches
+        for the same table at once. An ``atomic`` batch survives a crash whole
+        or not at all.
+        """
+        with self.lock, self.exclusive():
+            # Other processes' writes must be visible to the lookups below.
+            self.refresh()
+            return self.apply_ops(ops, atomic)
+
+    def apply_ops(self, ops, atomic=False):
+        resolved, results = self.resolve_ops(ops)
+        entries = []
+        for kind, value, old in resolved:
+            if kind == "put":
+                entries.append({"op": "put", "id": value["id"], "record": value, "old": old})
+            else:
+                entries.append({"op": "delete", "id": value, "old": old})
+        if entries:
+            self.log(entries, atomic)
+        return results
+
+    def resolve_ops(self, ops):
+        """
+        Turns the operations of ``apply_batch`` into the ``("put", record, old)`` and ``("delete", id, old)`` they write.
+
+        Returns those and the result of each operation. Updates and deletes of
+        missing records write nothing. The caller holds the table's locks.
+        """
+        resolved = []
+        results = []
+        # Later operations in the batch see the versions written by earlier ones.
+        pending = {}
+        for op in ops:
+            kind = op[0]
+            if kind == "put":
+                _, record, old = op
+                resolved.append(("put", record, old))
+                pending[record["id"]] = record
+                results.append(record)
+            elif kind == "update":
+                _, record_id, changes = op
+                old = pending[record_id] if record_id in pending else self.find(record_id)
+                if old is not None:
+                    record = {**old, **changes}
+                    resolved.append(("put", record, old))
+                    pending[record_id] = record
+                results.append(old)
+            elif kind == "delete":
+                _, record_id, old = op
+                if old is None:
+                    old = pending[record_id] if record_id in pending else self.find(record_id)
+                if old is not None:
+                    resolved.append(("delete", record_id, old))
+                    pending[record_id] = None
+                results.append(old)
+            else:
+                raise ValueError(f"Unknown operation: {kind!r}")
+        return resolved, results
+
+    def put(self, record, old=None):
+        """Writes ``record``; ``old`` is the version it replaces, if any."""
+        self.apply_batch([("put", record, old)])
+
+    def delete(self, record_id, old):
+        self.apply_batch([("delete", record_id, old)])
+
+    def create_index(self, column):
+        """Builds and checkpoints a B-tree over ``column`` from the table's current rows."""
+        with self.lock, self.exclusive():
+            self.refresh()
+            if column not in self.index_columns:
+                self.index_columns.append(column)
+            keys = sorted(index_key(record.get(column), record["id"]) for record in self.scan())
+            BTree.write(self.index_path(column), keys, self.btree_degree, self.lsn)
+            tree = BTree.open(self.index_path(column))
+            self.indexes[column] = tree
+            self.checkpoints[column] = tree.lsn
+
+    def create_view(self, name, query):
+        """Builds and checkpoints the materialized view ``name`` from the table's current rows."""
+        with self.lock, self.exclusive():
+            self.refresh()
+            view = MaterializedView(name, query, self.lsn)
+            for record in self.scan():
+                view.apply(None, record)
+            view.write(self.view_path(name))
+            self.view_queries[name] = query
+            self.views[name] = view
+            self.view_checkpoints[name] = view.lsn
+
+    def view_result(self, name, query):
+        """Returns the current result of view ``name``, building it first if this store does not have it yet."""
+        with self.lock:
+            self.refresh()
+            if name not in self.views:
+                self.create_view(name, query)
+            return self.views[name].result()
+
+    def lookup(self, column, value):
+        """Returns the ids of records whose ``column`` equals ``value``, using its index."""
+        with self.lock:
+            return self.indexes[column].lookup(value)
+
+    def between(self, column, low=None, high=None):
+        """Returns the ids of records with ``low <= column <= high``, using its index."""
+        with self.lock:
+            return self.indexes[column].between(low, high)
+
+    def max_id(self):
+        """Returns the largest integer id in the table (0 if none), mostly from the zone maps."""
+        with self.snapshot() as view:
+            active, frozen, partitions = view.active, view.frozen, view.partitions
+            ids = [record_id for overlay in (active, frozen) for record_id in overlay]
+            for partition in partitions:
+                largest = partition["max"].get("id")
+                if isinstance(largest, int) and not isinstance(largest, bool):
+                    ids.append(largest)
+                else:
+                    # Non-numeric ids sort after numbers, so the zone map cannot tell the numeric maximum.
+                    ids.extend(record["id"] for record in self.read_partition(partition))
+        return max((i for i in ids if isinstance(i, int) and not isinstance(i, bool)), default=0)
+
+    def estimated_rows(self):
+        """Returns about how many records the table holds, from the manifest; overlay updates count as rows."""
+        with self.lock:
+            stored = sum(partition["rows"] for partition in self.manifest["partitions"])
+            return stored + len(self.frozen) + len(self.active)
+
+    def pin(self):
+        """Captures a consistent view of the overlays and partitions for a reader."""
+        with self.lock:
+            if self.read_lock is not None:
+                self.read_lock.acquire(shared=True)
+            self.readers += 1
+            self.refresh()
+            active = SnapshotOverlay(self.active, self.order, self.undo, self.lsn)
+            return active, self.frozen, self.manifest["partitions"]
+
+    def unpin(self):
+        with self.lock:
+            self.readers -= 1
+            if self.read_lock is not None:
+                self.read_lock.release()
+            if self.readers == 0:
+                self.undo = {}
+                self.modified = {}
+            self.collect_garbage()
+
+    def snapshot(self):
+        """Returns a ``Snapshot`` of the table as of now."""
+        return Snapshot(self)
+
+    def conflicts(self, snapshot, record_ids):
+        """Returns which of ``record_ids`` were written after ``snapshot`` was taken; call with the lock held."""
+        if snapshot.lsn < self.reloaded_lsn:
+            # Reloaded since the snapshot, so compare the versions instead.
+            record_ids = list(record_ids)
+            now = {record["id"]: record for record in self.find_many(record_ids)}
+            then = {record["id"]: record for record in snapshot.find_many(record_ids)}
+            return [record_id for record_id in record_ids if now.get(record_id) != then.get(record_id)]
+        return [record_id for record_id in record_ids if self.modified.get(record_id, 0) > snapshot.lsn]
+
+    def collect_garbage(self):
+        # Segments replaced by a compaction stay on disk until no reader can still be using them.
+        if self.readers != 0 or not self.garbage:
+            return
+        if self.read_lock is not None and not self.read_lock.acquire(blocking=False):
+            # A reader in another process; retried on the next unpin.
+            return
+        try:
+            for path in self.garbage:
+                self.remove_segment(path)
+            self.garbage = []
+        finally:
+            if self.read_lock is not None:
+                self.read_lock.release()
+
+    def scan(self, ranges=None, snapshot=None):
+        """
+        Yields the table's live records in row order.
+
+        ``ranges`` maps columns to inclusive ``(low, high)`` bounds and lets the
+        scan skip partitions whose zone maps rule them out. Records outside the
+        ranges can still be yielded, so callers must filter the rows themselves.
+        The rows are read from ``snapshot`` if given, else from a snapshot
+        taken when the scan starts.
+        """
+        view = snapshot if snapshot is not None else self.snapshot()
+        active, frozen, partitions = view.active, view.frozen, view.partitions
+        try:
+            records = (
+                record
+                for partition in partitions
+                if not ranges or partition_matches(partition, ranges)
+                for record in self.read_partition(partition)
+            )
+            yield from merge_records(merge_records(records, frozen), active)
+        finally:
+            if snapshot is None:
+                view.close()
+
+    def scan_by_id(self, low=None, snapshot=None):
+        """
+        Yields the table's live records with ``id >= low`` in id order.
+
+        Partitions are opened in order of their smallest id, and only once the
+        rows already read can no longer come first, so reading the first rows
+        touches only the first partitions.
+        """
+        view = snapshot if snapshot is not None else self.snapshot()
+        active, frozen, partitions = view.active, view.frozen, view.partitions
+        try:
+            overlay = {**frozen, **active}
+            low_key = sort_key(low) if low is not None else None
+
+            def wanted(record_id):
+                return low_key is None or sort_key(record_id) >= low_key
+
+            pending = sorted(
+                (partition for partition in partitions
+                 if low_key is None or sort_key(partition["max"].get("id")) >= low_key),
+                key=lambda partition: sort_key(partition["min"].get("id")),
+            )
+            heap = [
+                (sort_key(record_id), i, dict(record))
+                for i, (record_id, record) in enumerate(overlay.items())
+                if record is not None and wanted(record_id)
+            ]
+            heapq.heapify(heap)
+            counter = itertools.count(len(heap))
+
+            next_partition = 0
+            while heap or next_partition < len(pending):
+                while next_partition < len(pending) and (
+                    not heap or sort_key(pending[next_partition]["min"].get("id")) <= heap[0][0]
+                ):
+                    for record in self.read_partition(pending[next_partition]):
+                        if record["id"] not in overlay and wanted(record["id"]):
+                            heapq.heappush(heap, (sort_key(record["id"]), next(counter), record))
+                    next_partition += 1
+                yield heapq.heappop(heap)[2]
+        finally:
+            if snapshot is None:
+                view.close()
+
+    def find(self, record_id):
+        found = self.find_many([record_id])
+        return found[0] if found else None
+
+    def find_many(self, record_ids, snapshot=None):
+        """Returns the live records among ``record_ids``, reading only partitions whose id range may hold them."""
+        found = {}
+        missing = set()
+        view = snapshot if snapshot is not None else self.snapshot()
+        active, frozen, partitions = view.active, view.frozen, view.partitions
+        try:
+            for record_id in record_ids:
+                for overlay in (active, frozen):
+                    if record_id in overlay:
+                        record = overlay[record_id]
+                        # Copied, like the records merge_records yields.
+                        found[record_id] = dict(record) if record is not None else None
+                        break
+                else:
+                    missing.add(record_id)
+
+            id_keys = sorted(sort_key(record_id) for record_id in missing)
+            for partition in partitions:
+                if not missing:
+                    break
+                if not partition_holds_any(partition, id_keys):
+                    continue
+                if partition.get("format") == "rows":
+                    # Binary segments decode just the requested rows.
+                    segment = self.open_segment(partition)
+                    for record_id in list(missing):
+                        record = segment.find(record_id)
+                        if record is not None:
+                            found[record_id] = record
+                            missing.discard(record_id)
+                    continue
+                for record in self.read_partition(partition):
+                    if record["id"] in missing:
+                        found[record["id"]] = record
+                        missing.discard(record["id"])
+        finally:
+            if snapshot is None:
+                view.close()
+
+        return [found[record_id] for record_id in record_ids if found.get(record_id) is not None]
+
+    def maybe_compact(self, force=False):
+        if self.wal.size() < self.compact_threshold and not force:
+            return
+
+        with self.lock, self.exclusive():
+            if self.compactor is not None or not self.claim_compaction():
+                return
+            # Another process may have compacted, or rotated the log, before the claim.
+            self.refresh()
+            pending = os.path.exists(self.old_wal_path)
+            if self.wal.size() < self.compact_threshold and not pending:
+                self.release_compaction()
+                return
+            # A leftover rotated log is from a failed compaction; retry it first.
+            if not pending:
+                self.wal.close()
+                os.replace(self.wal_path, self.old_wal_path)
+                self.frozen = self.active
+                self.frozen_lsn = self.lsn
+                self.reset_active()
+                self.wal = WriteAheadLog(self.wal_path)
+                self.wal_stamp = file_stamp(self.wal_path)
+                self.wal_offset = 0
+            self.start_compaction()
+
+    def claim_compaction(self):
+        """Takes the right to compact; in shared mode only one process compacts a table at a time."""
+        return self.compact_lock is None or self.compact_lock.acquire(blocking=False)
+
+    def release_compaction(self):
+        if self.compact_lock is not None:
+            self.compact_lock.release()
+
+    def start_compaction(self):
+        self.compactor = threading.Thread(target=self.compact, name=f"compact-{self.table_name}", daemon=True)
+        self.compactor.start()
+
+    def compact(self):
+        try:
+            self.fold_frozen()
+        finally:
+            self.compactor = None
+            self.release_compaction()
+
+    def fold_frozen(self):
+        lsn = self.frozen_lsn
+        base_lsn = self.manifest["lsn"]
+        manifest = {"lsn": lsn, "next_segment": self.manifest["next_segment"], "partitions": []}
+        pending = dict(self.frozen)
+        changes = []
+        replaced = []
+
+        # Rewrite only the partitions whose id range may hold a changed record.
+        id_keys = sorted(sort_key(record_id) for record_id in pending)
+        for partition in self.manifest["partitions"]:
+            if not partition_holds_any(partition, id_keys):
+                manifest["partitions"].append(partition)
+                continue
+
+            records = []
+            changed = False
+            for record in self.read_partition(partition):
+                if record["id"] in pending:
+                    changed = True
+                    new = pending.pop(record["id"])
+                    changes.append((record, new))
+                    if new is None:
+                        continue
+                    record = new
+                records.append(record)
+
+            if not changed:
+                manifest["partitions"].append(partition)
+                continue
+            replaced.append(partition)
+            if records:
+                manifest["partitions"].append(self.write_partition(manifest, records))
+
+        # Whatever is left was inserted: top up the last partition, then start new ones.
+        inserted = [record for record in pending.values() if record is not None]
+        changes.extend((None, record) for record in inserted)
+        written = {partition["segment"] for partition in manifest["partitions"]} - {
+            partition["segment"] for partition in self.manifest["partitions"]
+        }
+        if inserted and manifest["partitions"] and manifest["partitions"][-1]["rows"] < self.partition_rows:
+            last = manifest["partitions"].pop()
+            room = self.partition_rows - last["rows"]
+            manifest["partitions"].append(self.write_partition(manifest, list(self.read_partition(last)) + inserted[:room]))
+            inserted = inserted[room:]
+            if last["segment"] in written:
+                self.remove_segment(self.segment_path(last["segment"]))
+            else:
+                replaced.append(last)
+        for i in range(0, len(inserted), self.partition_rows):
+            manifest["partitions"].append(self.write_partition(manifest, inserted[i:i + self.partition_rows]))
+
+        # Index checkpoints go before the manifest: one newer than the segments is fine, one older is not.
+        for column in list(self.indexes):
+            checkpoint = self.checkpoints.get(column, 0)
+            if checkpoint == base_lsn:
+                keys = self.merge_index(column, changes)
+            elif checkpoint < lsn:
+                keys = sorted(
+                    index_key(record.get(column), record["id"])
+                    for partition in manifest["partitions"]
+                    for record in self.read_partition(partition)
+                )
+            else:
+                continue
+            BTree.write(self.index_path(column), keys, self.btree_degree, lsn)
+            self.checkpoints[column] = lsn
+
+        for name, query in list(self.view_queries.items()):
+            checkpoint = self.view_checkpoints.get(name, 0)
+            if checkpoint == base_lsn:
+                view = MaterializedView.read(self.view_path(name), name, query)
+                if view is not None:
+                    for old, new in changes:
+                        view.apply(old, new)
+            elif checkpoint < lsn:
+                view = None
+            else:
+                continue
+            if view is None:
+                view = MaterializedView(name, query)
+                for partition in manifest["partitions"]:
+                    for record in self.read_partition(partition):
+                        view.apply(None, record)
+            view.lsn = lsn
+            view.write(self.view_path(name))
+            self.view_checkpoints[name] = lsn
+
+        self.write_manifest(manifest)
+
+        with self.lock:
+            self.manifest = manifest
+            self.manifest_stamp = file_stamp(self.manifest_path, content=True)
+            self.frozen = {}
+            if os.path.exists(self.old_wal_path):
+                os.remove(self.old_wal_path)
+            self.garbage.extend(self.segment_path(partition["segment"]) for partition in replaced)
+            self.collect_garbage()
+
+    def merge_index(self, column, changes):
+        """Streams the current index checkpoint with ``changes`` (``(old, new)`` record pairs) applied."""
+        removed = set()
+        added = set()
+        for old, new in changes:
+            if old is not None:
+                removed.add(index_key(old.get(column), old["id"]))
+            if new is not None:
+                added.add(index_key(new.get(column), new["id"]))
+        removed -= added
+
+        current = (key for key in BTree.open(self.index_path(column)).range() if key not in removed)
+        last = None
+        for key in heapq.merge(current, sorted(added)):
+            if key != last:
+                yield key
+            last = key
+
+    def close(self):
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        with self.lock:
+            self.wal.close()
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+            for lock in (self.write_lock, self.read_lock, self.compact_lock):
+                if lock is not None:
+                    lock.close()
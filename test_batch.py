@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+
+
+def test_invalid_operation_rejects_the_whole_batch(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("users", schema=[('name', 'string')])
+        for bad in [
+            {"op": "add", "table": "users", "record": {"name": "bob", "bogus": 5}},
+            {"op": "add", "table": "users", "record": ["bob", 5]},
+            {"op": "add", "table": "nope", "record": ["bob"]},
+            {"op": "update", "table": "users", "id": 1},
+            {"op": "drop", "table": "users"},
+            {"op": "get", "table": "users", "filters": {"name": {"bogus": 1}}},
+        ]:
+            with pytest.raises(ValueError):
+                await db.batch([{"op": "add", "table": "users", "record": ["ann"]}, bad])
+        assert await db.get("users", filters={}) == []
+
+        assert await db.batch([
+            {"op": "add", "table": "users", "record": {"id": 7, "name": "ann"}},
+            {"op": "update", "table": "users", "id": 7, "changes": {"name": "bea"}},
+            {"op": "get", "table": "users", "filters": {"name": "bea"}},
+        ]) == [{"id": 7}, {"updated": True}, {"items": [{"id": 7, "name": "bea"}]}]
+        db.close()
+
+    asyncio.run(body())
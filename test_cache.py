@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from cache import RecordCache, TinyLFUCache
+
+
+def test_hits_misses_and_negative_entries():
+    cache = RecordCache()
+    assert cache.get("t", "name", "ann") == (False, None)
+    cache.put("t", "name", "ann", {"id": 1, "name": "ann"})
+    cache.put("t", "name", "bob", None)
+    assert cache.get("t", "name", "ann") == (True, {"id": 1, "name": "ann"})
+    assert cache.get("t", "name", "bob") == (True, None)
+    # Equal numbers are one key, as they are for index lookups.
+    cache.put("t", "n", 1, {"id": 2, "n": 1})
+    assert cache.get("t", "n", 1.0) == (True, {"id": 2, "n": 1})
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["negative_hits"], stats["entries"]) == (3, 1, 1, 3)
+
+    no_negatives = RecordCache(negative=False)
+    no_negatives.put("t", "name", "bob", None)
+    assert no_negatives.get("t", "name", "bob") == (False, None)
+
+
+def test_writes_invalidate_what_they_make_stale():
+    cache = RecordCache()
+    ann = {"id": 1, "name": "ann", "age": 30}
+    cache.put("t", "name", "ann", ann)
+    cache.put("t", "age", 30, ann)
+    cache.put("t", "name", "zed", None)
+    cache.put("t", "age", None, None)
+    cache.put("t", "name", "kim", None)
+    cache.put("u", "name", "zed", None)
+
+    cache.invalidate("t", old=ann, new={**ann, "age": 31})
+    assert cache.get("t", "name", "ann") == (False, None)
+    assert cache.get("t", "age", 30) == (False, None)
+
+    cache.invalidate("t", new={"id": 2, "name": "zed"})
+    # The new record satisfies name = "zed", and age = None since it has no age.
+    assert cache.get("t", "name", "zed") == (False, None)
+    assert cache.get("t", "age", None) == (False, None)
+    assert cache.get("t", "name", "kim") == (True, None)
+    assert cache.get("u", "name", "zed") == (True, None)
+
+    cache.invalidate_table("t")
+    assert cache.get("t", "name", "kim") == (False, None)
+
+
+def test_lookup_that_raced_a_write_is_not_cached():
+    cache = RecordCache()
+    generation = cache.generation("t")
+    cache.invalidate("t", new={"id": 1, "name": "ann"})
+    cache.put("t", "name", "ann", None, generation)
+    assert cache.get("t", "name", "ann") == (False, None)
+    cache.put("t", "name", "ann", {"id": 1, "name": "ann"}, cache.generation("t"))
+    assert cache.get("t", "name", "ann")[0]
+
+
+def test_byte_bound_evicts_and_keeps_bookkeeping_in_sync():
+    cache = RecordCache(max_bytes=1000)
+    for n in range(50):
+        cache.put("t", "id", n, {"id": n, "payload": "x" * 50})
+    stats = cache.stats()
+    assert stats["bytes"] <= 1000 and stats["evictions"] > 0
+    assert sum(len(keys) for keys in cache.by_record.values()) == len(cache.entries)
+    assert all(key in cache.entries for keys in cache.by_record.values() for key in keys)
+    assert cache.get("t", "id", 49)[0]
+
+
+def test_tinylfu_admits_only_entries_requested_more_than_the_victim():
+    cache = TinyLFUCache(maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    for _ in range(3):
+        cache["a"]
+        cache["b"]
+    cache["c"] = 3
+    assert "c" not in cache and cache.rejections == 1
+    for _ in range(5):
+        try:
+            cache["c"]
+        except KeyError:
+            pass
+    cache["c"] = 3
+    assert "c" in cache and len(cache) == 2
+
+    with pytest.raises(ValueError):
+        RecordCache(policy="fifo")
+
+
+def test_returned_records_are_copies(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("t", schema=[('amount', 'int')])
+        await db.add("t", data=[2])
+        for _ in range(2):
+            record = await db.get("t", "id", 1)
+            record["amount"] = 12345
+        (await db.get("t", filters={}))[0]["amount"] = 12345
+        assert await db.get("t", "id", 1) == {"amount": 2, "id": 1}
+        assert await db.get("t", filters={}) == [{"amount": 2, "id": 1}]
+        assert db.cache_stats()["hits"] >= 2
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_database_reads_see_writes_through_the_cache(open_db):
+    async def body():
+        db = open_db(cache_policy="tinylfu")
+        db.create_table("t", schema=[('name', 'string'), ('age', 'int')])
+        assert await db.get("t", "name", "ann") is None
+        assert await db.get("t", "age", None) is None
+        await db.add("t", data={"name": "ann"})
+        assert (await db.get("t", "name", "ann"))["id"] == 1
+        assert (await db.get("t", "age", None))["id"] == 1
+        await db.update("t", 1, {"name": "bea"})
+        assert await db.get("t", "name", "ann") is None
+        assert (await db.get("t", "name", "bea"))["id"] == 1
+        db.close()
+
+    asyncio.run(body())
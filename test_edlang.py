@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from EDLang import (
+    Add, Bulk, CreateTable, Delete, DeleteWhere, EDLangCompiler, EDLangSyntaxError, Select, SelectWhere, Update,
+    UpdateWhere,
+)
+
+
+def test_parses_every_statement():
+    compiler = EDLangCompiler(db=object())
+    assert compiler.parse("create table users schema [name, age]") == CreateTable("users", ["name", "age"])
+    assert compiler.parse('add users ["ann", 31]') == Add("users", ["ann", 31])
+    assert compiler.parse('add users [{"a": [1, 2.5]}, null, true]') == Add("users", [{"a": [1, 2.5]}, None, True])
+    assert compiler.parse('update users ["ann", 31] ["ann", 32]') == Update("users", ["ann", 31], ["ann", 32])
+    assert compiler.parse('delete users ["ann", 32]') == Delete("users", ["ann", 32])
+    assert compiler.parse('select users ["ann", 32]') == Select("users", ["ann", 32])
+    assert compiler.parse(
+        'select name, age from users where age >= 18 and city in ["Oslo", "Rome"] order by age desc limit 10 offset 5'
+    ) == SelectWhere("users", ["name", "age"], [["age", "gte", 18], ["city", "in", ["Oslo", "Rome"]]], "age", True, 10, 5)
+    assert compiler.parse('update users set city = "Paris", age = 1 where name like "Al%"') == UpdateWhere(
+        "users", {"city": "Paris", "age": 1}, [["name", "like", "Al%"]],
+    )
+    assert compiler.parse("delete from users where age < 18") == DeleteWhere("users", [["age", "lt", 18]])
+    assert compiler.parse("   ") is None
+    assert compiler.parse("# a comment") is None
+
+
+@pytest.mark.parametrize("line", [
+    'add users ["ann" 31]', "add users", "select users", 'drop table users', 'add users ["ann"] extra',
+    "select * from", "delete from users where age", 'add users ["unterminated]',
+])
+def test_syntax_errors_name_the_line(line):
+    with pytest.raises(EDLangSyntaxError, match="^line 7: "):
+        EDLangCompiler(db=object()).parse(line, 7)
+
+
+def test_statements_of_one_shape_share_a_prepared_parse():
+    compiler = EDLangCompiler(db=object())
+    first = compiler.parse('add users ["ann", 31]')
+    second = compiler.parse('add users ["bob", 17]')
+    assert (first.values, second.values) == (["ann", 31], ["bob", 17])
+    compiler.parse('add users ["carl", 45, "Oslo"]')
+    compiler.parse('add orders ["x", 1]')
+    assert len(compiler.prepared) == 3
+    # A bound statement must not share its lists with the template.
+    first.values.append("changed")
+    assert compiler.parse('add users ["dana", 17]').values == ["dana", 17]
+
+
+def test_plan_merges_runs_of_writes_on_one_table():
+    compiler = EDLangCompiler(db=object())
+    lines = [
+        'add users ["ann", 31]', 'add users ["bob", 17]', 'add orders ["x", 1]', 'select users ["ann", 31]',
+        'delete users ["bob", 17]', 'delete users ["ann", 31]', 'add users ["carl", 45]',
+    ]
+    steps = [step for _, step in compiler.plan(enumerate(compiler.parse(line) for line in lines))]
+    assert [type(step).__name__ if not isinstance(step, Bulk) else ("Bulk", step.kind.__name__) for step in steps] == [
+        ("Bulk", "Add"), "Add", "Select", ("Bulk", "Delete"), "Add",
+    ]
+    assert [statement.values for statement in steps[0].statements] == [["ann", 31], ["bob", 17]]
+
+
+def test_run_executes_a_script(open_db, tmp_path, capsys):
+    async def body():
+        script = tmp_path / "script.eldblang"
+        script.write_text("\n".join([
+            "create table users schema [name, age, city]",
+            *[f'add users ["u{n}", {n}, "{["Oslo", "Rome"][n % 2]}"]' for n in range(20)],
+            'update users ["u1", 1, "Rome"] ["u1", 100, "Rome"]',
+            'delete users ["u2", 2, "Oslo"]',
+            'update users set city = "Paris" where age >= 18 and city = "Oslo"',
+            "delete from users where age < 5",
+            "select name from users where city = \"Paris\" order by age limit 1",
+        ]) + "\n")
+        db = open_db()
+        stats = await EDLangCompiler(db).run(str(script), progress_every=None)
+        assert (stats["statements"], stats["errors"]) == (26, 0)
+        assert (await db.get("users", "name", "u1"))["age"] == 100
+        assert await db.get("users", "name", "u2") is None
+        assert sorted(record["name"] for record in await db.get("users", filters={"city": "Paris"})) == ["u18"]
+        assert await db.get("users", "name", "u3") is None
+        assert "{'name': 'u18'}" in capsys.readouterr().out
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_resume_after_a_bad_line(open_db, tmp_path):
+    async def body():
+        script = tmp_path / "script.eldblang"
+        lines = ["create table t schema [n]", *[f"add t [{n}]" for n in range(10)]]
+        lines[6] = "add t [oops"
+        script.write_text("\n".join(lines) + "\n")
+        checkpoint = str(tmp_path / "checkpoint.json")
+
+        db = open_db()
+        with pytest.raises(EDLangSyntaxError, match="line 7"):
+            await EDLangCompiler(db).run(str(script), checkpoint, progress_every=None)
+        assert len(await db.get("t", filters={})) == 5
+
+        script.write_text(script.read_text().replace("add t [oops", "add t [5]"))
+        stats = await EDLangCompiler(db).run(str(script), checkpoint, progress_every=None)
+        assert stats["statements"] == 5
+        assert sorted(record["n"] for record in await db.get("t", filters={})) == list(range(10))
+
+        script.write_text(script.read_text().replace("add t [5]", "add t [oops"))
+        stats = await EDLangCompiler(db).run(str(script), progress_every=None, on_error="skip")
+        assert stats["errors"] == 1
+        db.close()
+
+    asyncio.run(body())
@@ -0,0 +1,52 @@
+import asyncio
+from placement import HashRing, ShardPlacement, stable_hash
+
+TABLES = [f"table_{n}" for n in range(200)]
+
+
+def test_ring_is_stable_and_uses_every_shard():
+    assert stable_hash("users") == stable_hash("users") != stable_hash("orders")
+    ring = HashRing(4)
+    shards = [ring.shard_for(table) for table in TABLES]
+    assert shards == [HashRing(4).shard_for(table) for table in TABLES]
+    assert set(shards) == {1, 2, 3, 4}
+
+
+def test_rebalance_moves_only_some_tables():
+    placement = ShardPlacement(3)
+    for table in TABLES:
+        placement.assign(table)
+    before = dict(placement.tables)
+
+    moves = placement.rebalance(4)
+    assert moves and all(new == 4 for _, _, new in moves)
+    # About a quarter of the tables move onto the new shard.
+    assert len(moves) < len(TABLES) / 2
+    assert all(before[table] == old for table, old, _ in moves)
+    # rebalance reports the moves; the caller records them once the files are moved.
+    assert placement.tables == before
+
+    restored = ShardPlacement.from_dict(placement.to_dict())
+    assert restored.shard_count == 4 and restored.tables == before
+    assert ShardPlacement.from_dict({}).shard_count == 3
+
+
+def test_rebalance_keeps_the_data(open_db):
+    async def body():
+        db = open_db(shard_count=2)
+        for n in range(12):
+            db.create_table(f"t{n}", schema=[('n', 'int')])
+            await db.add(f"t{n}", data=[n])
+        db.rebalance(5)
+        assert len({db.placement.tables[f"t{n}"] for n in range(12)}) > 2
+        for n in range(12):
+            assert (await db.get(f"t{n}", "id", 1))["n"] == n
+        db.close()
+
+        db = open_db()
+        assert db.placement.shard_count == 5
+        for n in range(12):
+            assert (await db.get(f"t{n}", "id", 1))["n"] == n
+        db.close()
+
+    asyncio.run(body())
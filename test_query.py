@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from query import Predicate, Query, parse_filters
+
+PEOPLE = [
+    ["ann", 31, "Oslo"], ["bob", 17, "Rome"], ["carl", 45, None], ["dana", 17, "Oslo"],
+    ["eve", 62, "Paris"], ["joe", 25, "Rome"], ["jon", 38, "Oslo"],
+]
+
+
+async def people(open_db, index=None):
+    db = open_db()
+    db.create_table("people", schema=[('name', 'string'), ('age', 'int'), ('city', 'string')])
+    await db.add_many("people", PEOPLE)
+    if index:
+        db.create_index("people", index)
+    return db
+
+
+async def names(db, filters=None, **options):
+    return [record["name"] async for record in db.query("people", filters, **options)]
+
+
+async def matching(db, filters):
+    # Without order_by the order depends on the access path, e.g. index order for an indexed range.
+    return sorted(await names(db, filters))
+
+
+@pytest.mark.parametrize("index", [None, "age"])
+def test_operators(open_db, index):
+    async def body():
+        db = await people(open_db, index)
+        assert await matching(db, {"age": 17}) == ["bob", "dana"]
+        assert await matching(db, {"age": {"ne": 17}}) == ["ann", "carl", "eve", "joe", "jon"]
+        assert await matching(db, {"age": {"gt": 38}}) == ["carl", "eve"]
+        assert await matching(db, {"age": {"gte": 38}}) == ["carl", "eve", "jon"]
+        assert await matching(db, {"age": {"lt": 25}}) == ["bob", "dana"]
+        assert await matching(db, {"age": {"gte": 18, "lte": 38}}) == ["ann", "joe", "jon"]
+        assert await matching(db, {"city": {"in": ["Rome", "Paris"]}}) == ["bob", "eve", "joe"]
+        assert await matching(db, {"name": {"prefix": "jo"}}) == ["joe", "jon"]
+        assert await matching(db, {"city": None}) == ["carl"]
+        assert await matching(db, [("age", "lt", 30), ("city", "eq", "Oslo")]) == ["dana"]
+        assert await matching(db, {"age": 99}) == []
+        db.close()
+
+    asyncio.run(body())
+
+
+@pytest.mark.parametrize("index", [None, "age"])
+def test_order_and_pagination(open_db, index):
+    async def body():
+        db = await people(open_db, index)
+        ordered = await names(db, order_by="age")
+        assert [name for name in ordered if name in ("bob", "dana")] == ordered[:2]
+        assert ordered[2:] == ["joe", "ann", "jon", "carl", "eve"]
+        assert (await names(db, order_by="age", descending=True))[:2] == ["eve", "carl"]
+
+        pages = [await names(db, order_by="id", limit=3, offset=offset) for offset in (0, 3, 6)]
+        assert pages == [["ann", "bob", "carl"], ["dana", "eve", "joe"], ["jon"]]
+        assert await names(db, {"city": "Oslo"}, order_by="age", limit=2, offset=1) == ["ann", "jon"]
+        assert await names(db, limit=0) == []
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_projection_and_get_range(open_db):
+    async def body():
+        db = await people(open_db)
+        assert [record async for record in db.query("people", {"name": "ann"}, columns=["name", "city"])] == [
+            {"name": "ann", "city": "Oslo"},
+        ]
+        assert sorted(record["name"] for record in await db.get_range("people", "age", 25, 38)) == ["ann", "joe", "jon"]
+        assert sorted(record["name"] for record in await db.get_range("people", "age", low=45)) == ["carl", "eve"]
+        db.create_index("people", "age")
+        assert sorted(record["name"] for record in await db.get_range("people", "age", high=17)) == ["bob", "dana"]
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_predicates_are_validated():
+    with pytest.raises(ValueError):
+        Predicate("age", "between", 1)
+    with pytest.raises(ValueError):
+        Predicate("age", "in", 3)
+    with pytest.raises(ValueError):
+        Predicate("name", "prefix", 3)
+    assert [(predicate.op, predicate.value) for predicate in parse_filters({"age": {"gte": 1, "lt": 5}})] == [
+        ("gte", 1), ("lt", 5),
+    ]
+    for filters in ({"name": {"bogus": 1}}, {"age": {"gte": 1, "bogus": 1}}):
+        with pytest.raises(ValueError, match="bogus"):
+            parse_filters(filters)
+    assert [(predicate.op, predicate.value) for predicate in parse_filters({"meta": {"eq": {"a": 1}}})] == [
+        ("eq", {"a": 1}),
+    ]
+    assert Query({"age": {"gte": 18, "lt": 65}, "name": "x"}).ranges() == {"age": (18, 65), "name": ("x", "x")}
+
+
+def test_numbers_compare_across_int_and_float():
+    assert Predicate("n", "eq", 1).matches({"n": 1.0})
+    assert Predicate("n", "gt", 1).matches({"n": 1.5})
+    assert not Predicate("n", "lt", 1).matches({"n": None})
@@ -0,0 +1,166 @@
+import asyncio
+import glob
+import os
+import orjson
+import pytest
+import storage
+from transactions import INTENT_FILE, TransactionConflict
+
+
+def test_torn_log_keeps_intact_frames(open_db):
+    # A crash cut the last log write short: the rows before it survive and new writes land after them.
+    async def body():
+        db = open_db()
+        db.create_table("t", schema=[('n', 'int')])
+        for n in range(5):
+            await db.add("t", data=[n])
+        wal_path = db.get_shard("t").wal_path
+        db.close()
+
+        with open(wal_path, "r+b") as file:
+            file.truncate(os.path.getsize(wal_path) - 3)
+
+        db = open_db()
+        assert [record["n"] for record in await db.get("t", filters={})] == [0, 1, 2, 3]
+        await db.add("t", data=[99])
+        db.close()
+
+        db = open_db()
+        assert (await db.get("t", "n", 99))["n"] == 99
+        assert len(await db.get("t", filters={})) == 5
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_corrupt_segment_page_is_reported(open_db, tmp_path):
+    async def body():
+        db = open_db()
+        db.create_table("big", schema=[('n', 'int'), ('s', 'string')])
+        await db.add_many("big", ([n, "x" * 50] for n in range(20000)))
+        store = db.get_shard("big")
+        store.compact_threshold = 1
+        store.maybe_compact()
+        db.close()
+
+        segment_path = sorted(glob.glob(str(tmp_path / "db" / "**" / "big.*.seg"), recursive=True))[0]
+        with open(segment_path, "r+b") as file:
+            file.seek(9000)
+            byte = file.read(1)
+            file.seek(9000)
+            file.write(bytes([byte[0] ^ 0xFF]))
+
+        db = open_db()
+        try:
+            with pytest.raises(ValueError, match="checksum"):
+                await db.get("big", filters={})
+        finally:
+            db.close()
+
+    asyncio.run(body())
+
+
+def test_leftover_intent_is_finished_on_open(open_db, tmp_path):
+    # A crash between the tables of a commit leaves its intent file; the next open finishes the commit.
+    async def body():
+        db = open_db()
+        db.create_table("accounts", schema=[('name', 'string'), ('balance', 'int')])
+        db.create_table("ledger", schema=[('account', 'int'), ('amount', 'int')])
+        await db.add("accounts", data=["alice", 100])
+        await db.add("ledger", data=[1, 100])
+        old = await db.get("accounts", "id", 1)
+        entry = await db.get("ledger", "id", 1)
+        db.close()
+
+        written = {
+            "accounts": [["put", {**old, "balance": 70}, old]],
+            "ledger": [["put", {"account": 1, "amount": -30, "id": 2}, None], ["delete", 1, entry]],
+        }
+        with open(tmp_path / "db" / INTENT_FILE, "wb") as file:
+            file.write(orjson.dumps(written))
+
+        db = open_db()
+        assert (await db.get("accounts", "id", 1))["balance"] == 70
+        assert [record["amount"] for record in await db.get("ledger", filters={})] == [-30]
+        assert not os.path.exists(tmp_path / "db" / INTENT_FILE)
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_batch_over_two_tables_survives_a_crash_between_them(open_db, tmp_path, monkeypatch):
+    async def body():
+        db = open_db()
+        db.create_table("a", schema=[('name', 'string')])
+        db.create_table("b", schema=[('name', 'string'), ('n', 'int')])
+        await db.add("b", data=["y", 1])
+
+        apply_batch = storage.TableStore.apply_batch
+        calls = []
+
+        def crash_on_second_table(store, ops, atomic=False):
+            calls.append(store.table_name)
+            if len(calls) == 2:
+                raise OSError("simulated crash")
+            return apply_batch(store, ops, atomic)
+
+        monkeypatch.setattr(storage.TableStore, "apply_batch", crash_on_second_table)
+        with pytest.raises(OSError):
+            await db.batch([
+                {"op": "add", "table": "a", "record": ["p"]},
+                {"op": "update", "table": "b", "id": 1, "changes": {"n": 7}},
+            ])
+        monkeypatch.setattr(storage.TableStore, "apply_batch", apply_batch)
+        assert os.path.exists(tmp_path / "db" / INTENT_FILE)
+        db.close()
+
+        db = open_db()
+        assert [record["name"] for record in await db.get("a", filters={})] == ["p"]
+        assert (await db.get("b", "id", 1))["n"] == 7
+        assert not os.path.exists(tmp_path / "db" / INTENT_FILE)
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_conflicting_transactions_first_committer_wins(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("accounts", schema=[('name', 'string'), ('balance', 'int')])
+        await db.add("accounts", data=["alice", 100])
+
+        slow = db.transaction()
+        await slow.update("accounts", 1, {"balance": 50})
+        await slow.add("accounts", ["bob", 50])
+        async with db.transaction() as fast:
+            await fast.update("accounts", 1, {"balance": 90})
+        with pytest.raises(TransactionConflict):
+            await slow.commit()
+
+        assert (await db.get("accounts", "id", 1))["balance"] == 90
+        assert await db.get("accounts", "name", "bob") is None
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_transaction_reads_its_snapshot_and_own_writes(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("t", schema=[('n', 'int')])
+        await db.add("t", data=[1])
+
+        async with db.transaction() as tx:
+            await tx.add("t", [2])
+            await db.add("t", data=[3])
+            assert sorted(record["n"] for record in await tx.get("t", filters={})) == [1, 2]
+        assert sorted(record["n"] for record in await db.get("t", filters={})) == [1, 2, 3]
+
+        with pytest.raises(RuntimeError):
+            async with db.transaction() as tx:
+                await tx.add("t", [4])
+                raise RuntimeError("roll back")
+        assert await db.get("t", "n", 4) is None
+        db.close()
+
+    asyncio.run(body())
@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from relations import Join, RelationError, default_column, join_columns, Relation
+
+
+class FakeStore:
+    def __init__(self, rows, indexes=()):
+        self.rows = rows
+        self.indexes = dict.fromkeys(indexes)
+
+    def estimated_rows(self):
+        return self.rows
+
+
+def test_join_plan_prefers_an_index_on_the_larger_side():
+    join = Join("id", "user_id")
+    assert join.plan(FakeStore(10), FakeStore(1000, ["user_id"])) == ("index", "left")
+    # Joined on id, the inner side needs no index of its own.
+    assert Join("user_id", "id").plan(FakeStore(10), FakeStore(1000)) == ("index", "left")
+    assert Join("user_id", "id").plan(FakeStore(1000, ["user_id"]), FakeStore(10)) == ("index", "right")
+    # Joined on id, the left table is looked up by its primary key when it is the larger one.
+    assert join.plan(FakeStore(1000), FakeStore(10)) == ("index", "right")
+
+    unindexed = Join("team", "team")
+    assert unindexed.plan(FakeStore(10), FakeStore(1000)) == ("hash", "right")
+    assert unindexed.plan(FakeStore(1000), FakeStore(10)) == ("hash", "left")
+
+
+def test_left_join_always_streams_the_left_table():
+    join = Join("team", "team", how="left")
+    assert join.plan(FakeStore(10), FakeStore(1000)) == ("hash", "left")
+    assert join.plan(FakeStore(1000), FakeStore(10, ["team"])) == ("hash", "left")
+    with pytest.raises(ValueError):
+        Join("a", "b", how="outer")
+
+
+def test_default_and_explicit_join_columns():
+    assert default_column("users", "orders", [["user_id", "int"], ["amount", "int"]]) == "user_id"
+    assert default_column("team", "users", [["team_id", "int"]]) == "team_id"
+    with pytest.raises(ValueError):
+        default_column("users", "orders", [["owner", "int"]])
+
+    relations = [Relation("users", "orders", "user_id", "cascade")]
+    assert join_columns(relations, "users", "orders", None) == ("id", "user_id")
+    assert join_columns(relations, "orders", "users", None) == ("user_id", "id")
+    assert join_columns(relations, "orders", "users", ("a", "b")) == ("a", "b")
+    with pytest.raises(ValueError):
+        join_columns(relations, "orders", "items", None)
+
+
+def test_joins_match_a_nested_loop(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("users", schema=[('name', 'string'), ('team', 'string')])
+        db.create_table("orders", schema=[('user_id', 'int'), ('amount', 'int')])
+        for n in range(20):
+            await db.add("users", data=[f"u{n}", [None, "a", "b"][n % 3]])
+        await db.add_many("orders", ([n % 25 or None, n] for n in range(200)))
+        await db.relate("users", "orders")
+        users = await db.get("users", filters={})
+        orders = await db.get("orders", filters={})
+
+        def expected(left, right, left_column, right_column, how):
+            pairs = []
+            for outer in left:
+                found = [inner for inner in right
+                         if outer.get(left_column) is not None and outer.get(left_column) == inner.get(right_column)]
+                pairs += [(outer["id"], inner["id"]) for inner in found]
+                if not found and how == "left":
+                    pairs.append((outer["id"], None))
+            return sorted(pairs, key=lambda pair: (pair[0], pair[1] or 0))
+
+        for left, right, left_table, right_table, on, columns in [
+            (users, orders, "users", "orders", None, ("id", "user_id")),
+            (orders, users, "orders", "users", None, ("user_id", "id")),
+            (users, users, "users", "users", "team", ("team", "team")),
+        ]:
+            for how in ("inner", "left"):
+                pairs = [
+                    (outer["id"], inner["id"] if inner else None)
+                    async for outer, inner in db.join(left_table, right_table, on, how)
+                ]
+                assert sorted(pairs, key=lambda pair: (pair[0], pair[1] or 0)) == expected(left, right, *columns, how)
+
+        filtered = [pair async for pair in db.join("users", "orders", right_filters={"amount": {"lt": 50}})]
+        assert filtered and all(order["amount"] < 50 for _, order in filtered)
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_cascade_and_restrict(open_db):
+    # Deleting a user cascades to its orders, unless one of them still has items.
+    async def body():
+        db = open_db()
+        db.create_table("users", schema=[('name', 'string')])
+        db.create_table("orders", schema=[('user_id', 'int'), ('amount', 'int')])
+        db.create_table("items", schema=[('order_id', 'int'), ('sku', 'string')])
+        await db.relate("users", "orders", on_change="cascade")
+        await db.relate("orders", "items", on_change="restrict")
+        assert "user_id" in db.get_shard("orders").indexes
+        await db.add("users", data=["alice"])
+        await db.add("users", data=["bob"])
+        await db.add("orders", data=[1, 10])
+        await db.add("orders", data=[2, 20])
+        await db.add("orders", data=[2, 30])
+        await db.add("items", data=[2, "x"])
+
+        with pytest.raises(RelationError):
+            await db.batch([{"op": "delete", "table": "users", "id": 2}])
+        assert await db.get("users", "id", 2) is not None
+        assert len(await db.get("orders", filters={"user_id": 2})) == 2
+
+        # db.delete reports the refusal instead of raising.
+        await db.delete("users", ["bob"])
+        assert await db.get("users", "id", 2) is not None
+
+        assert await db.batch([{"op": "delete", "table": "users", "id": 1}]) == [{"deleted": True}]
+        assert await db.get("users", "id", 1) is None
+        assert await db.get("orders", filters={"user_id": 1}) == []
+        db.close()
+
+        db = open_db()
+        assert [relation.on_change for relation in db.relations] == ["cascade", "restrict"]
+        await db.delete("items", 0)
+        await db.delete("users", ["bob"])
+        assert await db.get("orders", filters={}) == []
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_restrict_sees_references_added_after_the_snapshot(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("orders", schema=[('amount', 'int')])
+        db.create_table("items", schema=[('order_id', 'int'), ('sku', 'string')])
+        await db.relate("orders", "items", on_change="restrict")
+        await db.add("orders", data=[10])
+        await db.add("orders", data=[20])
+        await db.add("items", data=[2, "x"])
+
+        with pytest.raises(RelationError):
+            async with db.transaction() as tx:
+                assert await tx.delete("orders", 1)
+                # Added by another writer after the transaction checked its snapshot.
+                await db.add("items", data=[1, "y"])
+        assert await db.get("orders", "id", 1) is not None
+
+        # A reference the transaction itself moves away does not block the delete.
+        async with db.transaction() as tx:
+            await tx.update("items", 1, {"order_id": 1})
+            await tx.update("items", 2, {"order_id": 1})
+            assert await tx.delete("orders", 2)
+        assert await db.get("orders", "id", 2) is None
+        db.close()
+
+    asyncio.run(body())
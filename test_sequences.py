@@ -0,0 +1,66 @@
+import asyncio
+from sequences import SequenceAllocator
+
+
+def test_ids_come_from_leased_blocks():
+    saves = []
+    sequences = SequenceAllocator(block_size=10, save=lambda: saves.append(1))
+    assert list(sequences.allocate("t")) == [1]
+    assert list(sequences.allocate("t", 3)) == [2, 3, 4]
+    assert len(saves) == 1 and sequences.leases["t"] == 12
+    assert list(sequences.allocate("t", 10)) == list(range(5, 15))
+    assert len(saves) == 2
+    assert list(sequences.allocate("u")) == [1]
+
+
+def test_observed_ids_are_never_handed_out():
+    sequences = SequenceAllocator(block_size=10)
+    sequences.observe("t", 5)
+    sequences.observe("t", "not-a-number")
+    sequences.observe("t", True)
+    assert list(sequences.allocate("t")) == [6]
+    sequences.observe("t", 3)
+    assert list(sequences.allocate("t")) == [7]
+
+
+def test_restart_skips_the_unused_part_of_the_lease():
+    sequences = SequenceAllocator(block_size=10)
+    sequences.allocate("t", 2)
+    restarted = SequenceAllocator(sequences.leases, block_size=10)
+    assert list(restarted.allocate("t")) == [sequences.leases["t"]]
+    assert list(SequenceAllocator(first_id=lambda table: 42).allocate("t")) == [42]
+
+
+def test_claim_moves_past_other_processes_leases():
+    stored = {"t": 0}
+
+    def claim(table, held, start, end):
+        moved = max(start, stored[table]) if stored[table] > held else start
+        stored[table] = moved + (end - start)
+        return moved
+
+    first = SequenceAllocator(block_size=5, claim=claim)
+    second = SequenceAllocator(block_size=5, claim=claim)
+    a = list(first.allocate("t", 2))
+    b = list(second.allocate("t", 2))
+    assert not set(a) & set(b)
+
+
+def test_database_ids_continue_after_reopen(open_db):
+    async def body():
+        db = open_db(id_block_size=4)
+        db.create_table("t", schema=[('n', 'int')])
+        for n in range(3):
+            await db.add("t", data=[n])
+        await db.add("t", data={"id": 20, "n": 20})
+        await db.add("t", data=[21])
+        assert (await db.get("t", "n", 21))["id"] == 21
+        db.close()
+
+        db = open_db(id_block_size=4)
+        await db.add("t", data=[99])
+        ids = sorted(record["id"] for record in await db.get("t", filters={}))
+        assert ids[:5] == [1, 2, 3, 20, 21] and ids[5] > 21
+        db.close()
+
+    asyncio.run(body())
@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+
+AGGS = {"orders": ("count", None), "total": ("sum", "amount"), "average": ("avg", "amount"),
+        "low": ("min", "amount"), "high": ("max", "amount")}
+
+
+def test_aggregate_groups_and_functions(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("orders", schema=[('region', 'string'), ('amount', 'int')])
+        for region, amount in [("north", 10), ("south", 5), ("north", 30), ("south", None), ("east", 7)]:
+            await db.add("orders", data=[region, amount])
+
+        assert await db.aggregate("orders", "region", AGGS) == [
+            {"region": "east", "orders": 1, "total": 7, "average": 7.0, "low": 7, "high": 7},
+            {"region": "north", "orders": 2, "total": 40, "average": 20.0, "low": 10, "high": 30},
+            {"region": "south", "orders": 2, "total": 5, "average": 5.0, "low": 5, "high": 5},
+        ]
+        assert await db.aggregate("orders", aggs={"rows": ("count", None), "amounts": ("count", "amount")}) == [
+            {"rows": 5, "amounts": 4},
+        ]
+        with pytest.raises(ValueError):
+            await db.aggregate("orders", aggs={"x": ("median", "amount")})
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_aggregate_of_an_empty_table_has_one_row(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("orders", schema=[('region', 'string'), ('amount', 'int')])
+        assert await db.aggregate("orders", aggs={"rows": ("count", None), "total": ("sum", "amount")}) == [
+            {"rows": 0, "total": None},
+        ]
+        assert await db.aggregate("orders", "region", {"rows": ("count", None)}) == []
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_view_follows_writes_and_reopens(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("orders", schema=[('region', 'string'), ('amount', 'int')])
+        db.create_view("by_region", "orders", {"group_by": "region", "aggs": AGGS})
+        for n in range(30):
+            await db.add("orders", data=[["north", "south", "east"][n % 3], n])
+        await db.update("orders", 3, {"amount": 500})
+        await db.update("orders", 4, {"region": "west"})
+        # Row 0 and id 4 held the two smallest north amounts, so the view must find the next minimum.
+        await db.delete("orders", 0)
+        expected = await db.aggregate("orders", "region", AGGS)
+        assert await db.view("by_region") == expected
+        assert [row["low"] for row in expected if row["region"] == "north"] == [6]
+        db.close()
+
+        db = open_db()
+        assert await db.view("by_region") == expected
+        await db.add("orders", data=["west", 1])
+        assert await db.view("by_region") == await db.aggregate("orders", "region", AGGS)
+        db.close()
+
+    asyncio.run(body())
+
+
+def test_filtered_view(open_db):
+    async def body():
+        db = open_db()
+        db.create_table("orders", schema=[('status', 'string'), ('amount', 'int')])
+        db.create_view("paid", "orders", {"filters": {"status": "paid", "amount": {"gte": 10}},
+                                          "aggs": {"orders": ("count", None), "total": ("sum", "amount")}})
+        assert await db.view("paid") == [{"orders": 0, "total": None}]
+        await db.add("orders", data=["paid", 5])
+        await db.add("orders", data=["paid", 20])
+        await db.add("orders", data=["open", 50])
+        assert await db.view("paid") == [{"orders": 1, "total": 20}]
+        await db.update("orders", 3, {"status": "paid"})
+        assert await db.view("paid") == [{"orders": 2, "total": 70}]
+        with pytest.raises(ValueError):
+            db.create_view("bad", "orders", {"where": {}})
+        db.close()
+
+    asyncio.run(body())
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+import pytest
+import wire
+
+
+def test_columns_round_trip_rows_that_lack_a_column():
+    records = [{"id": 1, "name": "ann"}, {"id": 2}, {"id": 3, "name": None, "tags": [1]}]
+    batch = wire.to_columns(records)
+    assert batch["columns"] == ["id", "name", "tags"]
+    assert batch["absent"] == {"name": [1], "tags": [0, 1]}
+    assert wire.from_columns(batch) == records
+    assert wire.from_columns(wire.to_columns([])) == []
+
+
+def test_columnize_converts_nested_record_lists_only():
+    payload = {"items": [{"id": 1}, {"id": 2}], "next": 5, "ids": [1, 2], "nested": [[{"a": 1}]]}
+    columnized = wire.columnize(payload)
+    assert columnized["ids"] == [1, 2] and "$columns" in columnized["items"]
+    assert wire.decolumnize(columnized) == payload
+
+
+@pytest.mark.parametrize("media_type", [wire.JSON, wire.COLUMNAR])
+def test_encode_and_decode(media_type):
+    payload = {"items": [{"id": 1, "name": "ann"}, {"id": 2}], "count": 2}
+    assert wire.decode(wire.encode(payload, media_type), f"{media_type}; charset=utf-8") == payload
+
+
+def test_negotiate_falls_back_to_json():
+    assert wire.negotiate(None) == wire.JSON
+    assert wire.negotiate("text/html, */*") == wire.JSON
+    assert wire.negotiate(wire.accept_header("columnar")) == wire.COLUMNAR
+    assert wire.negotiate(f"{wire.COLUMNAR};q=0, {wire.JSON}") == wire.JSON
+    assert wire.negotiate(f"{wire.COLUMNAR} ; Q=0.0") == wire.JSON
+
+
+def test_negotiate_picks_the_highest_q_value(monkeypatch):
+    assert wire.negotiate(f"{wire.JSON}, {wire.COLUMNAR};q=0.5") == wire.JSON
+    assert wire.negotiate(f"{wire.COLUMNAR};q=0.4, {wire.JSON};q=0.9") == wire.JSON
+    assert wire.negotiate(f"{wire.COLUMNAR};q=bad, {wire.JSON};q=0.1") == wire.JSON
+    # Equal weights go to our preference order.
+    assert wire.negotiate(f"{wire.JSON}, {wire.COLUMNAR}") == wire.COLUMNAR
+
+    monkeypatch.setattr(wire, "msgpack", object())
+    assert wire.negotiate(f"{wire.MSGPACK};q=0.8, {wire.COLUMNAR};q=0.7") == wire.MSGPACK
+    assert wire.negotiate(f"{wire.MSGPACK};q=0, {wire.JSON};q=0.2") == wire.JSON
+
+
+def test_choose_compression(monkeypatch):
+    assert wire.choose_compression(None) is None
+    assert wire.choose_compression("br, identity") is None
+    assert wire.choose_compression("gzip, deflate") == "gzip"
+    assert wire.choose_compression("gzip;q=0") is None
+
+    monkeypatch.setattr(wire, "zstandard", object())
+    assert wire.choose_compression("gzip, zstd") == "zstd"
+    assert wire.choose_compression("zstd;q=0, gzip") == "gzip"
+    assert wire.choose_compression("zstd;q=0.5, GZIP;q=0.9") == "gzip"
+    monkeypatch.setattr(wire, "zstandard", None)
+    assert wire.choose_compression("zstd") is None
+
+
+def test_accept_header_rejects_unknown_formats():
+    assert wire.accept_header("json") == wire.JSON
+    with pytest.raises(ValueError):
+        wire.accept_header("xml")
+
+
+def test_stream_compressor_output_decodes_after_each_chunk():
+    compressor = wire.StreamCompressor("gzip")
+    decoder = zlib.decompressobj(31)
+    first = compressor.compress(b'{"id": 1}\n')
+    assert decoder.decompress(first) == b'{"id": 1}\n'
+    body = first + compressor.compress(b'{"id": 2}\n') + compressor.finish()
+    assert gzip.decompress(body) == b'{"id": 1}\n{"id": 2}\n'
+    assert gzip.decompress(wire.compress(b"x" * 2000, "gzip")) == b"x" * 2000
+    assert wire.compress(b"x", None) == b"x"
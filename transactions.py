@@ -0,0 +1,377 @@
+import contextlib
+import heapq
+import itertools
+import os
+import orjson
+from btree import sort_key
+from durability import write_file
+from query import Query
+from relations import RelationError
+from storage import merge_records
+
+# Written (atomically) before a transaction changes several tables, removed once all of them are written.
+INTENT_FILE = "transaction.intent"
+
+
+class TransactionConflict(RuntimeError):
+    """Raised by ``commit`` when another writer changed a record the transaction also wrote."""
+
+
+class TransactionView:
+    """
+    A table as a transaction sees it: its snapshot with the transaction's own writes on top.
+
+    Offers the read methods ``query.Query`` needs. Once the transaction has
+    written to the table its indexes are not used, as they do not cover
+    those writes, and the table is scanned instead.
+    """
+
+    def __init__(self, snapshot, writes):
+        self.snapshot = snapshot
+        self.writes = writes
+
+    @property
+    def indexes(self):
+        return {} if self.writes else self.snapshot.indexes
+
+    def lookup(self, column, value):
+        """Ids of the records with ``column == value``, own writes included; through the index when the snapshot has one."""
+        key = sort_key(value)
+        if column in self.snapshot.indexes:
+            stored = self.snapshot.lookup(column, value)
+        else:
+            stored = [record["id"] for record in self.snapshot.scan({column: (value, value)})
+                      if sort_key(record.get(column)) == key]
+        own = [
+            record_id for record_id, record in self.writes.items()
+            if record is not None and sort_key(record.get(column)) == key
+        ]
+        return [record_id for record_id in stored if record_id not in self.writes] + own
+
+    def between(self, column, low=None, high=None):
+        return self.snapshot.between(column, low, high)
+
+    def scan(self, ranges=None):
+        return merge_records(self.snapshot.scan(ranges), self.writes)
+
+    def scan_by_id(self, low=None):
+        low_key = sort_key(low) if low is not None else None
+        own = sorted(
+            (sort_key(record_id), dict(record))
+            for record_id, record in self.writes.items()
+            if record is not None and (low_key is None or sort_key(record_id) >= low_key)
+        )
+        stored = (
+            (sort_key(record["id"]), record)
+            for record in self.snapshot.scan_by_id(low)
+            if record["id"] not in self.writes
+        )
+        counter = itertools.count()
+        # The counter keeps heapq from comparing records when ids tie.
+        merged = heapq.merge(
+            ((key, next(counter), record) for key, record in stored),
+            ((key, next(counter), record) for key, record in own),
+        )
+        return (record for _, _, record in merged)
+
+    def find_many(self, record_ids):
+        stored = self.snapshot.find_many([record_id for record_id in record_ids if record_id not in self.writes])
+        found = {record["id"]: record for record in stored}
+        found.update(
+            (record_id, dict(record) if record is not None else None)
+            for record_id, record in self.writes.items() if record_id in record_ids
+        )
+        return [found[record_id] for record_id in record_ids if found.get(record_id) is not None]
+
+    def find(self, record_id):
+        found = self.find_many([record_id])
+        return found[0] if found else None
+
+
+class Transaction:
+    """
+    A unit of reads and writes over one or more tables, used as ``async with db.transaction() as tx:``.
+
+    Reads see a snapshot of each table, taken when the transaction first
+    touches it, plus the transaction's own writes; other writers are neither
+    seen nor blocked. Writes are buffered and applied by ``commit`` (on leaving
+    the block without an exception): each table's writes go to its log as one
+    atomic frame, and a commit spanning several tables first records all of
+    them in ``transaction.intent`` so a crash half way is finished on the next
+    open. If a record the transaction writes was changed by someone else after
+    the snapshot, ``commit`` raises ``TransactionConflict`` and writes nothing
+    (first committer wins). Leaving the block with an exception rolls back.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.snapshots = {}
+        # table -> {id: record, or None for a delete}
+        self.writes = {}
+        self.finished = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+    def check(self):
+        if self.finished:
+            raise RuntimeError("The transaction has already been committed or rolled back")
+
+    async def view(self, table_name):
+        self.check()
+        if self.db.schema_for(table_name) is None:
+            raise ValueError(f"No schema found for table {table_name!r}")
+        if table_name not in self.snapshots:
+            store = await self.db.open_store(table_name)
+            self.snapshots[table_name] = await self.db.run(store.snapshot)
+        return TransactionView(self.snapshots[table_name], self.writes.setdefault(table_name, {}))
+
+    async def query(self, table_name, filters=None, columns=None, order_by=None, descending=False,
+                    limit=None, offset=0, chunk_size=256):
+        """Like ``ElementalDB.query``, as of the transaction's snapshot and with its own writes."""
+        view = await self.view(table_name)
+        rows = Query(filters, columns, order_by, descending, limit, offset).execute(view)
+        try:
+            while chunk := await self.db.run(list, itertools.islice(rows, chunk_size)):
+                for record in chunk:
+                    yield record
+        finally:
+            rows.close()
+
+    async def get(self, table_name, column_name=None, value=None, filters=None):
+        """Like ``ElementalDB.get``: the first record with ``column_name == value``, or a list for ``filters``."""
+        if column_name is None:
+            return [record async for record in self.query(table_name, filters)]
+        found = [record async for record in self.query(table_name, {column_name: value}, limit=1)]
+        return found[0] if found else None
+
+    async def add(self, table_name, data):
+        """Adds a record (a list in schema order or a dict) and returns its id."""
+        await self.view(table_name)
+        record = await self.db.build_record(table_name, data)
+        self.writes[table_name][record['id']] = record
+        return record['id']
+
+    async def update(self, table_name, record_id, changes):
+        """Applies ``changes`` to a record and returns the new version, or ``None`` if there is no such record."""
+        view = await self.view(table_name)
+        current = await self.db.run(view.find, record_id)
+        if current is None:
+            return None
+        record = {**current, **changes}
+        self.writes[table_name][record_id] = record
+        return dict(record)
+
+    async def delete(self, table_name, record_id):
+        """
+        Deletes a record; returns whether it existed.
+
+        Records referencing it through a ``cascade`` relation (see
+        ``ElementalDB.relate``) are deleted with it. If a ``restrict``
+        relation still has records referencing it, or one of the cascaded
+        records, ``relations.RelationError`` is raised and nothing is deleted;
+        ``commit`` raises it too if another writer added such a reference since.
+        """
+        view = await self.view(table_name)
+        current = await self.db.run(view.find, record_id)
+        if current is None:
+            return False
+        doomed = {}
+        await self.collect_deletes(table_name, current, doomed)
+        for doomed_table, doomed_id in doomed:
+            self.writes[doomed_table][doomed_id] = None
+        return True
+
+    async def collect_deletes(self, table_name, record, doomed):
+        """Adds ``(table, id)`` of ``record`` and of everything its deletion cascades to to ``doomed``."""
+        doomed[(table_name, record["id"])] = True
+        for relation in self.db.relations_from(table_name):
+            view = await self.view(relation.to_table)
+            # The referencing column is indexed by relate(), so this is an index lookup.
+            ids = [
+                record_id for record_id in await self.db.run(view.lookup, relation.column, record["id"])
+                if (relation.to_table, record_id) not in doomed
+            ]
+            if not ids:
+                continue
+            if relation.on_change == "restrict":
+                raise RelationError(
+                    f"Cannot delete record {record['id']} of '{table_name}': "
+                    f"records {ids[:10]} of '{relation.to_table}' reference it"
+                )
+            for child in await self.db.run(view.find_many, ids):
+                if (relation.to_table, child["id"]) not in doomed:
+                    await self.collect_deletes(relation.to_table, child, doomed)
+
+    async def commit(self):
+        self.check()
+        try:
+            tables = sorted(table_name for table_name, writes in self.writes.items() if writes)
+            # The tables restricting the deletes are locked too, so nobody can add a reference before the check.
+            held = sorted(set(tables) | {relation.to_table for relation in self.restrictions(tables)})
+            async with contextlib.AsyncExitStack() as stack:
+                for table_name in held:
+                    await stack.enter_async_context(self.db.lock_for(table_name))
+                written = await self.db.run(self.apply, tables, held) if tables else {}
+        finally:
+            self.close()
+
+        for table_name, ops in written.items():
+            for kind, value, old in ops:
+                if kind == "put":
+                    self.db.cache.invalidate(table_name, old=old, new=value)
+                else:
+                    self.db.cache.invalidate(table_name, old=old)
+
+    async def rollback(self):
+        if not self.finished:
+            self.close()
+
+    def close(self):
+        self.finished = True
+        for snapshot in self.snapshots.values():
+            snapshot.close()
+
+    def restrictions(self, tables):
+        """Returns the ``restrict`` relations from the tables among ``tables`` this transaction deletes from."""
+        return [
+            relation for relation in self.db.relations
+            if relation.on_change == "restrict" and relation.from_table in tables
+            and None in self.writes[relation.from_table].values()
+        ]
+
+    def check_restrictions(self, stores, tables):
+        """
+        Raises ``RelationError`` if a record now references a record this transaction deletes.
+
+        ``delete`` checked the snapshot; this repeats the check against the
+        current tables, with their locks held, to catch references added since.
+        """
+        for relation in self.restrictions(tables):
+            deleted = [record_id for record_id, record in self.writes[relation.from_table].items() if record is None]
+            with stores[relation.to_table].snapshot() as snapshot:
+                view = TransactionView(snapshot, self.writes.get(relation.to_table, {}))
+                for record_id in deleted:
+                    ids = view.lookup(relation.column, record_id)
+                    if ids:
+                        raise RelationError(
+                            f"Cannot delete record {record_id} of '{relation.from_table}': "
+                            f"records {ids[:10]} of '{relation.to_table}' reference it"
+                        )
+
+    def apply(self, tables, held):
+        """Checks for conflicts and restrictions and writes ``tables``, holding the locks of ``held`` throughout."""
+        stores = {table_name: self.db.shards[table_name] for table_name in held}
+        with locked(stores):
+            for store in stores.values():
+                store.refresh()
+            self.check_restrictions(stores, tables)
+            written = {}
+            for table_name in tables:
+                store = stores[table_name]
+                writes = self.writes[table_name]
+                conflicts = store.conflicts(self.snapshots[table_name], writes)
+                if conflicts:
+                    raise TransactionConflict(
+                        f"Records {conflicts[:10]} of table '{table_name}' were changed by another writer"
+                    )
+
+                # No conflict, so the snapshot's versions are still the current ones.
+                olds = {record["id"]: record for record in self.snapshots[table_name].find_many(list(writes))}
+                ops = []
+                for record_id, record in writes.items():
+                    old = olds.get(record_id)
+                    if record is not None:
+                        ops.append(("put", record, old))
+                    elif old is not None:
+                        ops.append(("delete", record_id, old))
+                written[table_name] = ops
+            write(self.db, stores, written)
+        return written
+
+
+@contextlib.contextmanager
+def locked(stores):
+    """Holds the write locks of ``{table: store}``."""
+    with contextlib.ExitStack() as stack:
+        # Always in name order, so two committing writers cannot deadlock.
+        for table_name in sorted(stores):
+            stack.enter_context(stores[table_name].lock)
+            stack.enter_context(stores[table_name].exclusive())
+        yield
+
+
+def write(db, stores, written):
+    """
+    Writes ``{table: [("put", record, old) or ("delete", id, old)]}``, each table as one atomic frame.
+
+    Several tables are first recorded in ``transaction.intent``, so a crash
+    half way is finished by ``recover``. The caller holds the tables' locks.
+    """
+    tables = sorted(written)
+    if not tables:
+        return
+    if len(tables) == 1:
+        stores[tables[0]].apply_batch(written[tables[0]], atomic=True)
+        return
+
+    with db.map_locked():
+        intent_path = os.path.join(db.db_dir, INTENT_FILE)
+        write_file(intent_path, orjson.dumps(written))
+        for table_name in tables:
+            stores[table_name].apply_batch(written[table_name], atomic=True)
+        os.remove(intent_path)
+
+
+async def apply_batches(db, batches):
+    """
+    Applies ``{table: [op]}``, in the operations of ``TableStore.apply_batch``, to several tables at once.
+
+    The batches are resolved against the current records and written like a
+    transaction's commit, so a crash keeps all of them or none. Returns the
+    per-operation results of ``apply_batch`` for each table.
+    """
+    tables = sorted(batches)
+    stores = {table_name: await db.open_store(table_name) for table_name in tables}
+    async with contextlib.AsyncExitStack() as stack:
+        for table_name in tables:
+            await stack.enter_async_context(db.lock_for(table_name))
+        return await db.run(resolve_and_write, db, stores, batches)
+
+
+def resolve_and_write(db, stores, batches):
+    with locked(stores):
+        written = {}
+        results = {}
+        for table_name, store in stores.items():
+            store.refresh()
+            written[table_name], results[table_name] = store.resolve_ops(batches[table_name])
+        write(db, stores, {table_name: ops for table_name, ops in written.items() if ops})
+    return results
+
+
+def recover(db):
+    """Finishes a multi-table commit that a crash interrupted; ``ElementalDB`` calls it on open."""
+    intent_path = os.path.join(db.db_dir, INTENT_FILE)
+    if not os.path.exists(intent_path):
+        return
+    with open(intent_path, "rb") as file:
+        written = orjson.loads(file.read())
+
+    for table_name, ops in written.items():
+        store = db.get_shard(table_name)
+        # Some tables may already hold the writes; puts are redone against what is there now.
+        redo = []
+        for kind, value, old in ops:
+            if kind == "put":
+                redo.append(("put", value, store.find(value["id"])))
+            else:
+                redo.append(("delete", value, None))
+        store.apply_batch(redo, atomic=True)
+    os.remove(intent_path)
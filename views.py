@@ -0,0 +1,179 @@
+import orjson
+from btree import sort_key
+from columnar import label_key, parse_aggs
+from durability import write_file
+from query import parse_filters
+
+QUERY_KEYS = {"filters", "group_by", "aggs"}
+
+
+class ViewGroup:
+    """The running state of one group of a view: its row count and, per aggregate, what its value is derived from."""
+
+    __slots__ = ("labels", "rows", "state", "best")
+
+    def __init__(self, labels, aggs):
+        self.labels = labels
+        self.rows = 0
+        # count: an int; sum and avg: [total, values summed]; min and max: {label_key: [value, rows]}.
+        self.state = {}
+        for name, (function, _) in aggs.items():
+            if function == "count":
+                self.state[name] = 0
+            elif function in ("sum", "avg"):
+                self.state[name] = [0, 0]
+            else:
+                self.state[name] = {}
+        # min/max -> the current extreme, dropped when the row holding it goes and found again on the next read.
+        self.best = {}
+
+    def value(self, name, function):
+        state = self.state[name]
+        if function == "count":
+            return state
+        if function in ("sum", "avg"):
+            total, summed = state
+            if not summed:
+                return None
+            return total / summed if function == "avg" else total
+        if name not in self.best:
+            pick = min if function == "min" else max
+            self.best[name] = pick((value for value, _ in state.values()), key=sort_key, default=None)
+        return self.best[name]
+
+
+class MaterializedView:
+    """
+    The result of an aggregate query over one table, kept up to date by the table's writes.
+
+    ``query`` takes the ``filters`` of ``ElementalDB.query`` and the
+    ``group_by`` and ``aggs`` of ``ElementalDB.aggregate``. ``apply`` is given
+    the old and new version of every record a write changes and moves the
+    record out of its old group and into its new one, so no write rescans
+    the table and ``result`` costs only the size of the result. ``min`` and
+    ``max`` keep a row count per distinct value, so removing the current
+    extreme finds the next one. Unlike ``aggregate``, ``sum`` and ``avg``
+    skip values that are not numbers, since failing would fail the write.
+
+    ``lsn`` is the last log entry applied; views are checkpointed to disk at
+    that LSN the way B-tree indexes are (see ``storage.TableStore``).
+    """
+
+    def __init__(self, name, query, lsn=0):
+        unknown = set(query or {}) - QUERY_KEYS
+        if unknown:
+            raise ValueError(f"View {name!r}: unknown query keys {sorted(unknown)}, expected some of {sorted(QUERY_KEYS)}")
+        self.name = name
+        self.query = dict(query or {})
+        self.predicates = parse_filters(self.query.get("filters"))
+        group_by = self.query.get("group_by")
+        self.group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+        self.aggs = parse_aggs(self.query.get("aggs"))
+        self.lsn = lsn
+        # Tuple of the group values' label keys -> ViewGroup
+        self.groups = {}
+
+    def matches(self, record):
+        return all(predicate.matches(record) for predicate in self.predicates)
+
+    def apply(self, old, new):
+        """Replaces ``old`` by ``new`` (either may be ``None``, for an insert or a delete) in the view."""
+        if old is not None and self.matches(old):
+            self.change(old, -1)
+        if new is not None and self.matches(new):
+            self.change(new, 1)
+
+    def change(self, record, sign):
+        labels = tuple(record.get(column) for column in self.group_by)
+        key = tuple(label_key(value) for value in labels)
+        group = self.groups.get(key)
+        if group is None:
+            if sign < 0:
+                return
+            group = self.groups[key] = ViewGroup(labels, self.aggs)
+
+        group.rows += sign
+        if group.rows <= 0:
+            del self.groups[key]
+            return
+
+        for name, (function, column) in self.aggs.items():
+            value = record.get(column) if column is not None else None
+            if function == "count":
+                if column is None or value is not None:
+                    group.state[name] += sign
+            elif function in ("sum", "avg"):
+                if isinstance(value, (int, float)):
+                    state = group.state[name]
+                    state[0] += value * sign
+                    state[1] += sign
+            elif value is not None:
+                self.change_extreme(group, name, function, value, sign)
+
+    @staticmethod
+    def change_extreme(group, name, function, value, sign):
+        values = group.state[name]
+        value_key = label_key(value)
+        entry = values.setdefault(value_key, [value, 0])
+        entry[1] += sign
+        if sign > 0:
+            if name in group.best:
+                best = group.best[name]
+                if best is None:
+                    group.best[name] = value
+                elif function == "min" and sort_key(value) < sort_key(best):
+                    group.best[name] = value
+                elif function == "max" and sort_key(value) > sort_key(best):
+                    group.best[name] = value
+        elif entry[1] <= 0:
+            del values[value_key]
+            if name in group.best and label_key(group.best[name]) == value_key:
+                del group.best[name]
+
+    def result(self):
+        """Returns one dict per group, ordered by the group columns, as ``ElementalDB.aggregate`` does."""
+        groups = sorted(self.groups.values(), key=lambda group: [sort_key(value) for value in group.labels])
+        if not self.group_by and not groups:
+            # An aggregate without grouping has its one result row even over no rows.
+            groups = [ViewGroup((), self.aggs)]
+        results = []
+        for group in groups:
+            result = dict(zip(self.group_by, group.labels))
+            for name, (function, _) in self.aggs.items():
+                result[name] = group.value(name, function)
+            results.append(result)
+        return results
+
+    def write(self, path):
+        """Checkpoints the view, with its LSN, to ``path``."""
+        groups = []
+        for group in self.groups.values():
+            state = {}
+            for name, (function, _) in self.aggs.items():
+                value = group.state[name]
+                state[name] = list(value.values()) if function in ("min", "max") else value
+            groups.append([list(group.labels), group.rows, state])
+        write_file(path, orjson.dumps({"query": self.query, "lsn": self.lsn, "groups": groups}))
+
+    @classmethod
+    def read(cls, path, name, query):
+        """Loads the checkpoint at ``path``; returns ``None`` if it is missing, damaged or for another query."""
+        try:
+            with open(path, "rb") as file:
+                data = orjson.loads(file.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if data.get("query") != orjson.loads(orjson.dumps(query)):
+            return None
+
+        view = cls(name, query, data["lsn"])
+        for labels, rows, state in data["groups"]:
+            labels = tuple(labels)
+            group = view.groups[tuple(label_key(value) for value in labels)] = ViewGroup(labels, view.aggs)
+            group.rows = rows
+            for agg, (function, _) in view.aggs.items():
+                value = state[agg]
+                if function in ("min", "max"):
+                    value = {label_key(item): [item, count] for item, count in value}
+                group.state[agg] = value
+        return view
@@ -0,0 +1,189 @@
+import gzip
+import zlib
+import orjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# orjson-encoded payload whose record lists are sent column by column.
+COLUMNAR = "application/vnd.elementaldb.columnar+json"
+
+# Names accepted by the clients' ``wire_format`` option.
+FORMATS = {"json": JSON, "columnar": COLUMNAR, "msgpack": MSGPACK}
+
+# Responses smaller than this are not worth compressing.
+COMPRESS_MIN_BYTES = 1024
+
+
+def media_types():
+    """Returns the encodings this process can produce, preferred first."""
+    return [COLUMNAR, MSGPACK, JSON] if msgpack is not None else [COLUMNAR, JSON]
+
+
+def to_columns(records):
+    """
+    Turns a list of records into ``{"columns": [...], "values": [[...], ...]}``.
+
+    Each column name is sent once and ``values`` holds one list per column.
+    Rows lacking a column are listed under ``absent`` so they decode without it.
+    """
+    names = {}
+    for record in records:
+        for name in record:
+            names.setdefault(name, None)
+
+    columns = list(names)
+    values = [[record.get(name) for record in records] for name in columns]
+    absent = {}
+    for name in columns:
+        missing = [row for row, record in enumerate(records) if name not in record]
+        if missing:
+            absent[name] = missing
+
+    batch = {"columns": columns, "values": values, "rows": len(records)}
+    if absent:
+        batch["absent"] = absent
+    return batch
+
+
+def from_columns(batch):
+    columns = batch["columns"]
+    absent = {name: set(rows) for name, rows in batch.get("absent", {}).items()}
+    records = []
+    for row in range(batch["rows"]):
+        record = {}
+        for name, values in zip(columns, batch["values"]):
+            if name not in absent or row not in absent[name]:
+                record[name] = values[row]
+        records.append(record)
+    return records
+
+
+def is_records(value):
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+
+def columnize(payload):
+    """Converts every list of records in a response payload (e.g. ``items``) to columns."""
+    if is_records(payload):
+        return {"$columns": to_columns(payload)}
+    if isinstance(payload, dict):
+        return {key: columnize(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [columnize(value) for value in payload]
+    return payload
+
+
+def decolumnize(payload):
+    if isinstance(payload, dict):
+        if set(payload) == {"$columns"}:
+            return from_columns(payload["$columns"])
+        return {key: decolumnize(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [decolumnize(value) for value in payload]
+    return payload
+
+
+def accept_header(wire_format):
+    """Builds the ``Accept`` header a client sends to ask for ``wire_format``, with JSON as fallback."""
+    if wire_format not in FORMATS:
+        raise ValueError(f"Unknown wire format {wire_format!r}, expected one of {sorted(FORMATS)}")
+    if wire_format == "msgpack" and msgpack is None:
+        raise ImportError("The msgpack wire format requires msgpack (pip install msgpack)")
+    if wire_format == "json":
+        return JSON
+    return f"{FORMATS[wire_format]}, {JSON};q=0.5"
+
+
+def accepted(header):
+    """
+    Parses an ``Accept`` or ``Accept-Encoding`` header into ``{value: q}``.
+
+    Entries without a ``q`` parameter weigh 1; refused ones (``q=0``, or a
+    ``q`` that is not a number) are left out.
+    """
+    weights = {}
+    for part in (header or "").split(","):
+        value, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if value and q > 0:
+            weights[value.lower()] = max(q, weights.get(value.lower(), 0.0))
+    return weights
+
+
+def negotiate(accept):
+    """Picks the response encoding the ``Accept`` header weighs highest, falling back to JSON."""
+    weights = accepted(accept)
+    candidates = [media_type for media_type in media_types() if media_type in weights]
+    # max() keeps the first of equal weights, i.e. our preferred one.
+    return max(candidates, key=weights.get) if candidates else JSON
+
+
+def choose_compression(accept_encoding):
+    """Picks ``zstd`` or ``gzip``, whichever ``Accept-Encoding`` weighs highest (zstd on a tie), or ``None``."""
+    weights = accepted(accept_encoding)
+    codings = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    candidates = [coding for coding in codings if coding in weights]
+    return max(candidates, key=weights.get) if candidates else None
+
+
+def encode(payload, media_type=JSON):
+    if media_type == MSGPACK:
+        return msgpack.packb(payload)
+    if media_type == COLUMNAR:
+        return orjson.dumps(columnize(payload))
+    return orjson.dumps(payload)
+
+
+def decode(body, content_type=JSON):
+    """Decodes a response body according to its ``Content-Type``."""
+    media_type = (content_type or JSON).split(";")[0].strip()
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise ImportError("Decoding msgpack responses requires msgpack (pip install msgpack)")
+        return msgpack.unpackb(body)
+    if media_type == COLUMNAR:
+        return decolumnize(orjson.loads(body))
+    return orjson.loads(body)
+
+
+def compress(body, coding):
+    if coding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+
+class StreamCompressor:
+    """Compresses a streamed body chunk by chunk, flushing after each so the client can decode it right away."""
+
+    def __init__(self, coding):
+        if coding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            self.flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self.compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+            self.flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, chunk):
+        return self.compressor.compress(chunk) + self.compressor.flush(self.flush_mode)
+
+    def finish(self):
+        return self.compressor.flush()